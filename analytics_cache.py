@@ -0,0 +1,110 @@
+"""
+Cache de resultados do analytics
+Guarda o resultado de cada combinação de filtros junto com a marca d'água do
+banco (maior Click.id / ConversionEvent.id e linhas gravadas pelo ClickWriter)
+no momento do cálculo. O resultado é reutilizado enquanto a marca não avançar;
+períodos encerrados antes de hoje não mudam mais e nunca são recalculados.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Click, ConversionEvent
+from timezone_utils import agora_brasil
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente)
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "256"))
+# Folga após a meia-noite para cliques ainda no buffer do ClickWriter
+ANALYTICS_CACHE_IMMUTABLE_DELAY_S = int(os.getenv("ANALYTICS_CACHE_IMMUTABLE_DELAY_S", "300"))
+
+
+def marca_dagua(db: Session, incluir_eventos: bool = False) -> tuple:
+    """
+    Marca d'água atual dos dados de analytics
+
+    Os IDs de clique são gerados na captura e os workers podem gravá-los fora
+    de ordem, então o contador de linhas gravadas neste processo entra na marca.
+    """
+    from click_writer import click_writer
+
+    marca = (db.query(func.max(Click.id)).scalar() or 0, click_writer.rows_written)
+    if incluir_eventos:
+        marca += (db.query(func.max(ConversionEvent.id)).scalar() or 0,)
+    return marca
+
+
+class AnalyticsCache:
+    """LRU de resultados do analytics validados por marca d'água"""
+
+    def __init__(self, maxsize: int = ANALYTICS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # chave -> (marca d'água ou None se imutável, resultado)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def periodo_encerrado(fim: Optional[datetime], agora: Optional[datetime] = None) -> bool:
+        """Se o período (fim exclusivo, horário de Brasília sem tzinfo) terminou antes de hoje"""
+        if fim is None:
+            return False
+        agora = agora or agora_brasil().replace(tzinfo=None)
+        hoje = agora.replace(hour=0, minute=0, second=0, microsecond=0)
+        return fim <= hoje and agora - fim >= timedelta(seconds=ANALYTICS_CACHE_IMMUTABLE_DELAY_S)
+
+    def obter(self, db: Session, chave: tuple, calcular: Callable[[], dict],
+              fim: Optional[datetime] = None, incluir_eventos: bool = False):
+        """Retorna o resultado em cache para a chave ou calcula (e guarda) um novo"""
+        if self.maxsize <= 0:
+            return calcular()
+
+        with self._lock:
+            entrada = self._data.get(chave)
+            if entrada is not None and entrada[0] is None:
+                self._data.move_to_end(chave)
+                self.hits += 1
+                return entrada[1]
+
+        marca = marca_dagua(db, incluir_eventos)
+        with self._lock:
+            entrada = self._data.get(chave)
+            if entrada is not None and entrada[0] == marca:
+                self._data.move_to_end(chave)
+                self.hits += 1
+                return entrada[1]
+            self.misses += 1
+
+        resultado = calcular()
+        if resultado is None:
+            # "Não encontrado" não é guardado: o link pode ser criado a qualquer momento
+            return resultado
+        with self._lock:
+            self._data[chave] = (None if self.periodo_encerrado(fim) else marca, resultado)
+            self._data.move_to_end(chave)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return resultado
+
+    def clear(self):
+        """Descarta todos os resultados (links alterados ou removidos mudam o histórico)"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "immutable": sum(1 for marca, _ in self._data.values() if marca is None),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+# Instância global usada pelos endpoints de analytics
+analytics_cache = AnalyticsCache()
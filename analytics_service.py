@@ -1,20 +1,319 @@
 """
 Serviço de analytics para cálculo de métricas de cliques
 """
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import Session
+from sqlalchemy import func, and_, or_, select, literal, union_all
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List
-from models import Link, Click, ConversionEvent
-from timezone_utils import agora_brasil, converter_para_brasil
+from models import Link, Click, ClickRollupHora, ClickIpSketchDia, ConversionEvent
+from hyperloglog import HyperLogLog, mesclar
+from click_snapshot import click_snapshot, CLICK_SNAPSHOT_MIN_DAYS
+from timezone_utils import agora_brasil
+import os
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Quantidade padrão de links no ranking (top_links)
+ANALYTICS_TOP_LINKS = int(os.getenv("ANALYTICS_TOP_LINKS", "10"))
+# No modo "auto", IPs únicos são contados exatamente até este total de cliques no período;
+# acima disso, estimados pelos sketches HyperLogLog
+ANALYTICS_UNIQUE_IPS_EXACT_MAX_CLICKS = int(os.getenv("ANALYTICS_UNIQUE_IPS_EXACT_MAX_CLICKS", "50000"))
+
+
+# Tipos de evento que contam como conversão
+TIPOS_CONVERSAO = ["whatsapp", "form", "download", "call", "purchase"]
+# Rótulos das linhas do heatmap, na ordem do %w do strftime
+DIAS_SEMANA = ["domingo", "segunda", "terça", "quarta", "quinta", "sexta", "sábado"]
+FORMATO_HORA_SEMANA = "%w-%H"
+
+
+def _ou_unknown(coluna):
+    """Valor da coluna, ou "unknown" quando nulo/vazio (mesma normalização dos rollups)"""
+    return func.coalesce(func.nullif(coluna, ""), "unknown")
+
+
+# Dimensões de agrupamento: (expressão sobre click_rollup_hora, expressão sobre clicks).
+# Datas são gravadas no horário de Brasília sem offset, então date() já devolve o dia local
+_DIMENSOES = {
+    "ponto": (Link.ponto_dooh, Link.ponto_dooh),
+    "campanha": (Link.campanha, Link.campanha),
+    "device": (ClickRollupHora.device_type, _ou_unknown(Click.device_type)),
+    "country": (ClickRollupHora.country, _ou_unknown(Click.country)),
+    "dia": (func.date(ClickRollupHora.hora), func.date(Click.clicked_at)),
+    "link": (ClickRollupHora.link_id, Click.link_id),
+    # Célula do heatmap: "<dia da semana>-<hora>" (%w: 0 = domingo)
+    "hora_semana": (func.strftime(FORMATO_HORA_SEMANA, ClickRollupHora.hora), func.strftime(FORMATO_HORA_SEMANA, Click.clicked_at)),
+}
+
+
+class PeriodoAnalytics:
+    """
+    Período de consulta [inicio, fim) dividido entre rollups e cliques brutos
+    
+    As horas inteiras são lidas de click_rollup_hora; só a hora parcial do
+    início (start_date com minutos) é contada na tabela clicks. end_date
+    inclui o dia inteiro, então o fim sempre cai em uma virada de hora.
+    """
+    
+    def __init__(self, start_date: Optional[str] = None, end_date: Optional[str] = None, avisar: bool = False):
+        self.inicio = None
+        self.fim = None
+        if start_date:
+            try:
+                self.inicio = datetime.fromisoformat(start_date).replace(tzinfo=None)
+            except ValueError:
+                if avisar:
+                    logger.warning(f"Data inicial inválida: {start_date}")
+        
+        if end_date:
+            try:
+                # Fim exclusivo: meia-noite do dia seguinte
+                fim_dia = datetime.fromisoformat(end_date).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+                self.fim = fim_dia + timedelta(days=1)
+            except ValueError:
+                if avisar:
+                    logger.warning(f"Data final inválida: {end_date}")
+        
+        self._calcular_limites()
+    
+    def a_partir_de(self, corte: datetime) -> "PeriodoAnalytics":
+        """Mesmo período, começando no máximo entre o início atual e o corte"""
+        periodo = PeriodoAnalytics()
+        periodo.inicio = corte if self.inicio is None else max(self.inicio, corte)
+        periodo.fim = self.fim
+        periodo._calcular_limites()
+        return periodo
+    
+    def dias(self) -> Optional[float]:
+        """Tamanho do período em dias (None quando não tem início)"""
+        if self.inicio is None:
+            return None
+        fim = self.fim or agora_brasil().replace(tzinfo=None)
+        return (fim - self.inicio).total_seconds() / 86400
+    
+    def _calcular_limites(self):
+        # Primeira hora inteira e primeiro dia inteiro do período
+        self.hora_inicial = None
+        self.dia_inicial = None
+        if self.inicio is not None:
+            self.hora_inicial = self.inicio.replace(minute=0, second=0, microsecond=0)
+            if self.hora_inicial < self.inicio:
+                self.hora_inicial += timedelta(hours=1)
+            self.dia_inicial = self.inicio.replace(hour=0, minute=0, second=0, microsecond=0)
+            if self.dia_inicial < self.inicio:
+                self.dia_inicial += timedelta(days=1)
+    
+    def condicoes_cliques(self) -> list:
+        """Período inteiro sobre clicks.clicked_at"""
+        condicoes = []
+        if self.inicio is not None:
+            condicoes.append(Click.clicked_at >= self.inicio)
+        if self.fim is not None:
+            condicoes.append(Click.clicked_at < self.fim)
+        return condicoes
+    
+    def condicoes_rollup(self) -> list:
+        """Horas inteiras do período sobre click_rollup_hora.hora"""
+        condicoes = []
+        if self.hora_inicial is not None:
+            condicoes.append(ClickRollupHora.hora >= self.hora_inicial)
+        if self.fim is not None:
+            condicoes.append(ClickRollupHora.hora < self.fim)
+        return condicoes
+    
+    def condicoes_borda(self) -> Optional[list]:
+        """Hora parcial do início sobre clicks.clicked_at (None quando o início é hora cheia)"""
+        if self.inicio is None or self.hora_inicial == self.inicio:
+            return None
+        limite = self.hora_inicial if self.fim is None else min(self.hora_inicial, self.fim)
+        return [Click.clicked_at >= self.inicio, Click.clicked_at < limite]
+    
+    def condicoes_sketch(self) -> list:
+        """Dias inteiros do período sobre click_ip_sketch_dia.dia"""
+        condicoes = []
+        if self.dia_inicial is not None:
+            condicoes.append(ClickIpSketchDia.dia >= self.dia_inicial.date())
+        if self.fim is not None:
+            condicoes.append(ClickIpSketchDia.dia < self.fim.date())
+        return condicoes
+    
+    def condicoes_borda_dia(self) -> Optional[list]:
+        """Dia parcial do início sobre clicks.clicked_at (None quando o início é meia-noite)"""
+        if self.inicio is None or self.dia_inicial == self.inicio:
+            return None
+        limite = self.dia_inicial if self.fim is None else min(self.dia_inicial, self.fim)
+        return [Click.clicked_at >= self.inicio, Click.clicked_at < limite]
+
 
 class AnalyticsService:
     """Serviço para cálculo de métricas de analytics"""
     
+    @staticmethod
+    def filtros_link(
+        ponto_dooh: Optional[str] = None,
+        campanha: Optional[str] = None,
+        link_id: Optional[int] = None
+    ) -> list:
+        """Condições sobre Link para os filtros de ponto, campanha e link"""
+        filtros = []
+        if ponto_dooh:
+            filtros.append(Link.ponto_dooh == ponto_dooh)
+        if campanha:
+            filtros.append(Link.campanha == campanha)
+        if link_id:
+            filtros.append(Link.id == link_id)
+        return filtros
+    
+    @staticmethod
+    def _contagens(dimensao: str, filtros_link: list, periodo: PeriodoAnalytics):
+        """
+        Subconsulta (valor, n) com os cliques do período na dimensão informada
+        
+        Une as linhas dos rollups (n = cliques da hora) às da borda parcial em clicks (n = 1).
+        """
+        coluna_rollup, coluna_clique = _DIMENSOES[dimensao]
+        partes = [
+            select(coluna_rollup.label("valor"), ClickRollupHora.clicks.label("n"))
+            .select_from(ClickRollupHora)
+            .join(Link, Link.id == ClickRollupHora.link_id)
+            .where(*filtros_link, *periodo.condicoes_rollup())
+        ]
+        borda = periodo.condicoes_borda()
+        if borda:
+            partes.append(
+                select(coluna_clique.label("valor"), literal(1).label("n"))
+                .select_from(Click)
+                .join(Link)
+                .where(*filtros_link, *borda)
+            )
+        return (union_all(*partes) if len(partes) > 1 else partes[0]).subquery()
+    
+    @staticmethod
+    def _contar_por(db: Session, dimensao: str, filtros_link: list, periodo: PeriodoAnalytics) -> Dict[str, int]:
+        """Contagem de cliques agrupada pela dimensão (valores nulos/vazios são omitidos)"""
+        contagens = AnalyticsService._contagens(dimensao, filtros_link, periodo)
+        linhas = db.query(contagens.c.valor, func.sum(contagens.c.n)).group_by(contagens.c.valor).all()
+        return {valor: int(total) for valor, total in linhas if valor and total}
+    
+    @staticmethod
+    def _total_clicks(db: Session, filtros_link: list, periodo: PeriodoAnalytics) -> int:
+        contagens = AnalyticsService._contagens("link", filtros_link, periodo)
+        return int(db.query(func.sum(contagens.c.n)).scalar() or 0)
+    
+    @staticmethod
+    def _snapshot_para(periodo: PeriodoAnalytics):
+        """Snapshot colunar vigente, se o período for longo e começar antes do corte dele"""
+        snapshot = click_snapshot.atual()
+        if snapshot is None:
+            return None
+        if periodo.inicio is not None and periodo.inicio >= snapshot.corte:
+            return None
+        dias = periodo.dias()
+        if dias is not None and dias < CLICK_SNAPSHOT_MIN_DAYS:
+            return None
+        return snapshot
+    
+    @staticmethod
+    def _contar_dimensoes(db: Session, dimensoes: tuple, filtros_link: list, periodo: PeriodoAnalytics) -> dict:
+        """
+        Contagens do período: {"total": n, dimensão: {valor: cliques}}
+        
+        Em períodos longos, a parte anterior ao corte do snapshot colunar
+        (click_snapshot.py) é contada nele com NumPy e só o restante vem dos
+        rollups; nesse caso o resultado inclui também a dimensão "link".
+        """
+        snapshot = AnalyticsService._snapshot_para(periodo)
+        if snapshot is None:
+            resultado = {"total": AnalyticsService._total_clicks(db, filtros_link, periodo)}
+            for dimensao in dimensoes:
+                resultado[dimensao] = AnalyticsService._contar_por(db, dimensao, filtros_link, periodo)
+            return resultado
+        
+        links = {
+            link_id: (ponto, campanha) for link_id, ponto, campanha in
+            db.query(Link.id, Link.ponto_dooh, Link.campanha).filter(*filtros_link).all()
+        }
+        resultado = snapshot.contar(
+            periodo.inicio, periodo.fim, set(links),
+            tuple(d for d in dimensoes if d not in ("ponto", "campanha"))
+        )
+        click_snapshot.consultas += 1
+        for dimensao, posicao in (("ponto", 0), ("campanha", 1)):
+            contagem = {}
+            for link_id, total in resultado["link"].items():
+                valor = links[link_id][posicao]
+                if valor:
+                    contagem[valor] = contagem.get(valor, 0) + total
+            resultado[dimensao] = contagem
+        
+        # Cauda posterior ao corte, nos rollups
+        if periodo.fim is None or periodo.fim > snapshot.corte:
+            cauda = periodo.a_partir_de(snapshot.corte)
+            resultado["total"] += AnalyticsService._total_clicks(db, filtros_link, cauda)
+            for dimensao in set(dimensoes) | {"link"}:
+                for valor, total in AnalyticsService._contar_por(db, dimensao, filtros_link, cauda).items():
+                    resultado[dimensao][valor] = resultado[dimensao].get(valor, 0) + total
+        
+        return {chave: resultado[chave] for chave in ("total", "link") + tuple(dimensoes)}
+    
+    @staticmethod
+    def _unique_ips_exato(modo: str, total_clicks: int) -> bool:
+        """Contagem exata (COUNT DISTINCT nos cliques) ou estimativa pelos sketches HyperLogLog"""
+        if modo == "exact":
+            return True
+        if modo == "approx":
+            return False
+        return total_clicks <= ANALYTICS_UNIQUE_IPS_EXACT_MAX_CLICKS
+    
+    @staticmethod
+    def _unique_ips(db: Session, filtros_link: list, periodo: PeriodoAnalytics, exato: bool = True) -> int:
+        """IPs distintos: exatos nos cliques brutos ou estimados pela mescla dos sketches diários"""
+        if exato:
+            return (
+                db.query(func.count(func.distinct(func.nullif(Click.ip_address, ""))))
+                .select_from(Click)
+                .join(Link)
+                .filter(*filtros_link, *periodo.condicoes_cliques())
+                .scalar()
+            ) or 0
+        
+        return AnalyticsService._sketches_por_link(db, filtros_link, periodo, agrupar=False)[None].count()
+    
+    @staticmethod
+    def _sketches_por_link(db: Session, filtros_link: list, periodo: PeriodoAnalytics, agrupar: bool = True) -> dict:
+        """
+        Mescla os sketches diários do período ({link_id: HyperLogLog}, ou {None: HyperLogLog} sem agrupar)
+        
+        Os IPs do dia parcial do início vêm dos cliques brutos.
+        """
+        sketches = {}
+        linhas = (
+            db.query(ClickIpSketchDia.link_id, ClickIpSketchDia.sketch)
+            .join(Link, Link.id == ClickIpSketchDia.link_id)
+            .filter(*filtros_link, *periodo.condicoes_sketch())
+            .all()
+        )
+        for link_id, sketch in linhas:
+            sketches.setdefault(link_id if agrupar else None, []).append(sketch)
+        resultado = {chave: mesclar(lista) for chave, lista in sketches.items()}
+        
+        borda = periodo.condicoes_borda_dia()
+        if borda:
+            ips = (
+                db.query(Click.link_id, Click.ip_address)
+                .join(Link)
+                .filter(*filtros_link, *borda, func.coalesce(Click.ip_address, "") != "")
+                .distinct()
+                .all()
+            )
+            for link_id, ip in ips:
+                resultado.setdefault(link_id if agrupar else None, HyperLogLog()).add(ip)
+        
+        if not agrupar:
+            resultado.setdefault(None, HyperLogLog())
+        return resultado
+    
     @staticmethod
     def get_link_analytics(
         db: Session,
@@ -22,199 +321,138 @@ class AnalyticsService:
         campanha: Optional[str] = None,
         link_id: Optional[int] = None,
         start_date: Optional[str] = None,
-        end_date: Optional[str] = None
+        end_date: Optional[str] = None,
+        top_n: int = ANALYTICS_TOP_LINKS,
+        unique_ips_mode: str = "auto"
     ) -> dict:
         """
         Calcula métricas agregadas de cliques com filtros opcionais
         
+        unique_ips_mode: "exact" (COUNT DISTINCT), "approx" (sketches HyperLogLog)
+        ou "auto" (exato até ANALYTICS_UNIQUE_IPS_EXACT_MAX_CLICKS cliques no período)
+        
         Retorna:
         - total_clicks: Total de cliques
         - unique_ips: IPs únicos
+        - unique_ips_approximate: Se unique_ips é estimativa (erro padrão HLL_ERRO_PADRAO)
         - clicks_by_ponto: Dict {ponto: count}
         - clicks_by_campanha: Dict {campanha: count}
         - clicks_by_device: Dict {device: count}
         - clicks_by_country: Dict {country: count}
         - clicks_by_day: Dict {YYYY-MM-DD: count}
-        - top_links: Lista dos top 10 links
+        - top_links: Lista dos top_n links
         """
-        # Construir query base
-        query = db.query(Click)
-        
-        # Aplicar filtros de data
-        if start_date:
-            try:
-                start_dt = datetime.fromisoformat(start_date)
-                query = query.filter(Click.clicked_at >= start_dt)
-            except ValueError:
-                logger.warning(f"Data inicial inválida: {start_date}")
-        
-        if end_date:
-            try:
-                # Ajustar para fim do dia
-                end_dt = datetime.fromisoformat(end_date)
-                end_dt = end_dt.replace(hour=23, minute=59, second=59)
-                query = query.filter(Click.clicked_at <= end_dt)
-            except ValueError:
-                logger.warning(f"Data final inválida: {end_date}")
+        # Período e filtros de link aplicados a todas as agregações
+        periodo = PeriodoAnalytics(start_date, end_date, avisar=True)
+        filtros_link = AnalyticsService.filtros_link(ponto_dooh, campanha, link_id)
         
-        # Aplicar filtros de link (ponto, campanha, link_id)
-        link_filters = []
-        if ponto_dooh:
-            link_filters.append(Link.ponto_dooh == ponto_dooh)
-        if campanha:
-            link_filters.append(Link.campanha == campanha)
-        if link_id:
-            link_filters.append(Link.id == link_id)
-        
-        if link_filters:
-            query = query.join(Link).filter(and_(*link_filters))
-        else:
-            query = query.join(Link)
-        
-        # Obter todos os cliques filtrados com eager loading do link
-        clicks = query.options(joinedload(Click.link)).all()
-        
-        # Calcular métricas
-        total_clicks = len(clicks)
-        
-        # IPs únicos
-        unique_ips = len(set(click.ip_address for click in clicks if click.ip_address))
-        
-        # Agrupamentos
-        clicks_by_ponto = {}
-        clicks_by_campanha = {}
-        clicks_by_device = {}
-        clicks_by_country = {}
-        clicks_by_day = {}
-        
-        for click in clicks:
-            # Por ponto DOOH
-            if hasattr(click, 'link') and click.link and click.link.ponto_dooh:
-                ponto = click.link.ponto_dooh
-                clicks_by_ponto[ponto] = clicks_by_ponto.get(ponto, 0) + 1
-            
-            # Por campanha
-            if hasattr(click, 'link') and click.link and click.link.campanha:
-                camp = click.link.campanha
-                clicks_by_campanha[camp] = clicks_by_campanha.get(camp, 0) + 1
-            
-            # Por dispositivo
-            device = click.device_type or "unknown"
-            clicks_by_device[device] = clicks_by_device.get(device, 0) + 1
-            
-            # Por país
-            country = click.country or "unknown"
-            clicks_by_country[country] = clicks_by_country.get(country, 0) + 1
-            
-            # Por dia
-            if click.clicked_at:
-                # Converter para timezone do Brasil se necessário
-                dt_brasil = converter_para_brasil(click.clicked_at) if click.clicked_at.tzinfo else click.clicked_at
-                day_str = dt_brasil.strftime("%Y-%m-%d")
-                clicks_by_day[day_str] = clicks_by_day.get(day_str, 0) + 1
-        
-        # Top 10 links
-        top_links = AnalyticsService._get_top_links(
-            db, ponto_dooh, campanha, link_id, start_date, end_date
+        # Totais e agrupamentos (rollups horários + borda parcial, ou snapshot + cauda)
+        contagens = AnalyticsService._contar_dimensoes(
+            db, ("ponto", "campanha", "device", "country", "dia"), filtros_link, periodo
         )
+        total_clicks = contagens["total"]
+        exato = AnalyticsService._unique_ips_exato(unique_ips_mode, total_clicks)
+        unique_ips = AnalyticsService._unique_ips(db, filtros_link, periodo, exato)
+        
+        # Top N links (mesmo período e filtros)
+        top_links = AnalyticsService._get_top_links(db, filtros_link, periodo, top_n, exato, contagens.get("link"))
         
         return {
             "total_clicks": total_clicks,
             "unique_ips": unique_ips,
-            "clicks_by_ponto": clicks_by_ponto,
-            "clicks_by_campanha": clicks_by_campanha,
-            "clicks_by_device": clicks_by_device,
-            "clicks_by_country": clicks_by_country,
-            "clicks_by_day": clicks_by_day,
+            "unique_ips_approximate": not exato,
+            "clicks_by_ponto": contagens["ponto"],
+            "clicks_by_campanha": contagens["campanha"],
+            "clicks_by_device": contagens["device"],
+            "clicks_by_country": contagens["country"],
+            "clicks_by_day": contagens["dia"],
             "top_links": top_links
         }
     
     @staticmethod
     def _get_top_links(
         db: Session,
-        ponto_dooh: Optional[str] = None,
-        campanha: Optional[str] = None,
-        link_id: Optional[int] = None,
-        start_date: Optional[str] = None,
-        end_date: Optional[str] = None
+        filtros_link: list,
+        periodo: PeriodoAnalytics,
+        limite: int = ANALYTICS_TOP_LINKS,
+        unique_ips_exato: bool = True,
+        por_link: Optional[Dict[int, int]] = None
     ) -> List[dict]:
         """
-        Calcula top 10 links por total de cliques
+        Calcula os top N links por total de cliques
+        
+        O ranking sai de uma única consulta agrupada sobre os rollups (ou das
+        contagens por link já calculadas, quando informadas em por_link); os IPs
+        únicos dos N links vêm de uma segunda consulta (cliques brutos ou sketches).
         
         Retorna lista de dicts com:
         - link_id, identifier, destination_url, ponto_dooh, campanha
         - total_clicks, unique_ips
         """
-        # Query base para links
-        query = db.query(Link)
-        
-        # Aplicar filtros de link
-        if ponto_dooh:
-            query = query.filter(Link.ponto_dooh == ponto_dooh)
-        if campanha:
-            query = query.filter(Link.campanha == campanha)
-        if link_id:
-            query = query.filter(Link.id == link_id)
-        
-        links = query.all()
-        
-        # Calcular métricas para cada link
-        link_metrics = []
-        
-        for link in links:
-            # Query de cliques para este link
-            clicks_query = db.query(Click).filter(Click.link_id == link.id)
-            
-            # Aplicar filtros de data
-            if start_date:
-                try:
-                    start_dt = datetime.fromisoformat(start_date)
-                    clicks_query = clicks_query.filter(Click.clicked_at >= start_dt)
-                except ValueError:
-                    pass
-            
-            if end_date:
-                try:
-                    end_dt = datetime.fromisoformat(end_date)
-                    end_dt = end_dt.replace(hour=23, minute=59, second=59)
-                    clicks_query = clicks_query.filter(Click.clicked_at <= end_dt)
-                except ValueError:
-                    pass
-            
-            clicks = clicks_query.all()
-            total_clicks = len(clicks)
-            
-            # Só incluir links com pelo menos 1 clique
-            if total_clicks > 0:
-                unique_ips = len(set(c.ip_address for c in clicks if c.ip_address))
-                
-                link_metrics.append({
-                    "link_id": link.id,
-                    "identifier": link.identifier,
-                    "destination_url": link.destination_url,
-                    "ponto_dooh": link.ponto_dooh,
-                    "campanha": link.campanha,
-                    "total_clicks": total_clicks,
-                    "unique_ips": unique_ips
-                })
-        
-        # Ordenar por total_clicks (decrescente) e limitar a 10
-        link_metrics.sort(key=lambda x: x["total_clicks"], reverse=True)
-        return link_metrics[:10]
+        colunas_link = (Link.id, Link.identifier, Link.destination_url, Link.ponto_dooh, Link.campanha)
+        if por_link is not None:
+            ranking = sorted(((total, link_id) for link_id, total in por_link.items() if total > 0),
+                             key=lambda item: (-item[0], item[1]))[:max(1, limite)]
+            detalhes = {linha.id: linha for linha in db.query(*colunas_link).filter(Link.id.in_([l for _, l in ranking])).all()}
+            linhas = [(detalhes[link_id], total) for total, link_id in ranking if link_id in detalhes]
+        else:
+            contagens = AnalyticsService._contagens("link", filtros_link, periodo)
+            total_clicks = func.sum(contagens.c.n).label("total_clicks")
+            linhas = [
+                (linha, linha.total_clicks) for linha in
+                db.query(*colunas_link, total_clicks)
+                .select_from(contagens)
+                .join(Link, Link.id == contagens.c.valor)
+                .group_by(Link.id)
+                .having(total_clicks > 0)
+                .order_by(total_clicks.desc(), Link.id)
+                .limit(max(1, limite))
+                .all()
+            ]
+        if not linhas:
+            return []
+        
+        ids = [linha.id for linha, _ in linhas]
+        if unique_ips_exato:
+            unique_ips = dict(
+                db.query(Click.link_id, func.count(func.distinct(func.nullif(Click.ip_address, ""))))
+                .filter(Click.link_id.in_(ids), *periodo.condicoes_cliques())
+                .group_by(Click.link_id)
+                .all()
+            )
+        else:
+            sketches = AnalyticsService._sketches_por_link(db, [Link.id.in_(ids)], periodo)
+            unique_ips = {link: sketch.count() for link, sketch in sketches.items()}
+        
+        return [
+            {
+                "link_id": linha.id,
+                "identifier": linha.identifier,
+                "destination_url": linha.destination_url,
+                "ponto_dooh": linha.ponto_dooh,
+                "campanha": linha.campanha,
+                "total_clicks": int(total),
+                "unique_ips": unique_ips.get(linha.id, 0)
+            }
+            for linha, total in linhas
+        ]
     
     @staticmethod
     def get_link_specific_analytics(
         db: Session,
         link_id: int,
         start_date: Optional[str] = None,
-        end_date: Optional[str] = None
+        end_date: Optional[str] = None,
+        unique_ips_mode: str = "auto"
     ) -> dict:
         """
         Calcula métricas específicas de um link
         
+        unique_ips_mode: ver get_link_analytics
+        
         Retorna:
         - link_id, identifier, destination_url, ponto_dooh, campanha
-        - total_clicks, unique_ips
+        - total_clicks, unique_ips, unique_ips_approximate
         - clicks_by_device, clicks_by_country, clicks_by_day
         """
         # Buscar link
@@ -222,48 +460,14 @@ class AnalyticsService:
         if not link:
             return None
         
-        # Query de cliques
-        query = db.query(Click).filter(Click.link_id == link_id)
-        
-        # Aplicar filtros de data
-        if start_date:
-            try:
-                start_dt = datetime.fromisoformat(start_date)
-                query = query.filter(Click.clicked_at >= start_dt)
-            except ValueError:
-                pass
-        
-        if end_date:
-            try:
-                end_dt = datetime.fromisoformat(end_date)
-                end_dt = end_dt.replace(hour=23, minute=59, second=59)
-                query = query.filter(Click.clicked_at <= end_dt)
-            except ValueError:
-                pass
-        
-        clicks = query.all()
+        periodo = PeriodoAnalytics(start_date, end_date)
+        filtros_link = [Link.id == link_id]
         
         # Calcular métricas
-        total_clicks = len(clicks)
-        unique_ips = len(set(c.ip_address for c in clicks if c.ip_address))
-        
-        # Agrupamentos
-        clicks_by_device = {}
-        clicks_by_country = {}
-        clicks_by_day = {}
-        
-        for click in clicks:
-            device = click.device_type or "unknown"
-            clicks_by_device[device] = clicks_by_device.get(device, 0) + 1
-            
-            country = click.country or "unknown"
-            clicks_by_country[country] = clicks_by_country.get(country, 0) + 1
-            
-            if click.clicked_at:
-                # Converter para timezone do Brasil se necessário
-                dt_brasil = converter_para_brasil(click.clicked_at) if click.clicked_at.tzinfo else click.clicked_at
-                day_str = dt_brasil.strftime("%Y-%m-%d")
-                clicks_by_day[day_str] = clicks_by_day.get(day_str, 0) + 1
+        contagens = AnalyticsService._contar_dimensoes(db, ("device", "country", "dia"), filtros_link, periodo)
+        total_clicks = contagens["total"]
+        exato = AnalyticsService._unique_ips_exato(unique_ips_mode, total_clicks)
+        unique_ips = AnalyticsService._unique_ips(db, filtros_link, periodo, exato)
         
         return {
             "link_id": link.id,
@@ -273,9 +477,66 @@ class AnalyticsService:
             "campanha": link.campanha,
             "total_clicks": total_clicks,
             "unique_ips": unique_ips,
-            "clicks_by_device": clicks_by_device,
-            "clicks_by_country": clicks_by_country,
-            "clicks_by_day": clicks_by_day
+            "unique_ips_approximate": not exato,
+            "clicks_by_device": contagens["device"],
+            "clicks_by_country": contagens["country"],
+            "clicks_by_day": contagens["dia"]
+        }
+    
+    @staticmethod
+    def get_heatmap(
+        db: Session,
+        ponto_dooh: Optional[str] = None,
+        campanha: Optional[str] = None,
+        link_id: Optional[int] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None
+    ) -> dict:
+        """
+        Scans e conversões por dia da semana e hora (matrizes 7x24)
+        
+        clicked_at/occurred_at já são gravados no horário de Brasília (UTC-03:00
+        fixo, ver timezone_utils), então o strftime do SQLite agrupa direto na
+        hora local. Os scans vêm dos rollups horários (ou do snapshot colunar em
+        períodos longos); as conversões, dos eventos de TIPOS_CONVERSAO.
+        
+        Retorna:
+        - weekdays: Rótulos das linhas (0 = domingo, como o %w do strftime)
+        - clicks: Matriz [dia da semana][hora] de scans
+        - conversions: Matriz [dia da semana][hora] de conversões
+        - total_clicks / total_conversions: Somas das matrizes
+        """
+        periodo = PeriodoAnalytics(start_date, end_date, avisar=True)
+        filtros_link = AnalyticsService.filtros_link(ponto_dooh, campanha, link_id)
+        
+        cliques = AnalyticsService._contar_dimensoes(db, ("hora_semana",), filtros_link, periodo)["hora_semana"]
+        
+        query = (
+            db.query(func.strftime(FORMATO_HORA_SEMANA, ConversionEvent.occurred_at), func.count(ConversionEvent.id))
+            .filter(ConversionEvent.event_type.in_(TIPOS_CONVERSAO))
+        )
+        if periodo.inicio is not None:
+            query = query.filter(ConversionEvent.occurred_at >= periodo.inicio)
+        if periodo.fim is not None:
+            query = query.filter(ConversionEvent.occurred_at < periodo.fim)
+        if filtros_link:
+            query = query.join(Click, ConversionEvent.click_id == Click.id).join(Link).filter(*filtros_link)
+        conversoes = dict(query.group_by(func.strftime(FORMATO_HORA_SEMANA, ConversionEvent.occurred_at)).all())
+        
+        def matriz(contagem: dict) -> List[List[int]]:
+            linhas = [[0] * 24 for _ in DIAS_SEMANA]
+            for celula, total in contagem.items():
+                if celula:
+                    dia_semana, hora = celula.split("-")
+                    linhas[int(dia_semana)][int(hora)] += int(total)
+            return linhas
+        
+        return {
+            "weekdays": DIAS_SEMANA,
+            "clicks": matriz(cliques),
+            "conversions": matriz(conversoes),
+            "total_clicks": sum(cliques.values()),
+            "total_conversions": sum(conversoes.values())
         }
     
     @staticmethod
@@ -297,21 +558,19 @@ class AnalyticsService:
         - conversion_rate: Taxa de conversão (eventos de conversão / total de cliques)
         - conversions_by_type: Dict {conversion_type: count}
         """
-        # Query base para eventos
-        query = db.query(ConversionEvent)
-        
-        # Aplicar filtros
+        # Filtros dos eventos
+        condicoes = []
         if click_id:
-            query = query.filter(ConversionEvent.click_id == click_id)
+            condicoes.append(ConversionEvent.click_id == click_id)
         
         if link_id:
             # Filtrar por link_id através do click
-            query = query.join(Click).filter(Click.link_id == link_id)
+            condicoes.append(ConversionEvent.click_id.in_(select(Click.id).where(Click.link_id == link_id)))
         
         if start_date:
             try:
                 start_dt = datetime.fromisoformat(start_date)
-                query = query.filter(ConversionEvent.occurred_at >= start_dt)
+                condicoes.append(ConversionEvent.occurred_at >= start_dt)
             except ValueError:
                 pass
         
@@ -319,67 +578,47 @@ class AnalyticsService:
             try:
                 end_dt = datetime.fromisoformat(end_date)
                 end_dt = end_dt.replace(hour=23, minute=59, second=59)
-                query = query.filter(ConversionEvent.occurred_at <= end_dt)
+                condicoes.append(ConversionEvent.occurred_at <= end_dt)
             except ValueError:
                 pass
         
-        events = query.all()
+        # Eventos por tipo
+        events_by_type = dict(
+            db.query(ConversionEvent.event_type, func.count(ConversionEvent.id))
+            .filter(*condicoes)
+            .group_by(ConversionEvent.event_type)
+            .all()
+        )
+        total_events = sum(events_by_type.values())
         
-        # Calcular métricas
-        total_events = len(events)
+        conversions_by_type = {t: events_by_type[t] for t in TIPOS_CONVERSAO if t in events_by_type}
         
-        # Eventos por tipo
-        events_by_type = {}
-        scroll_depths = []
-        time_on_page_values = []
-        conversion_types = ["whatsapp", "form", "download", "call", "purchase"]
-        conversions_by_type = {}
-        
-        for event in events:
-            # Contar por tipo
-            event_type = event.event_type
-            events_by_type[event_type] = events_by_type.get(event_type, 0) + 1
-            
-            # Extrair dados de scroll
-            if event_type == "scroll" and event.event_value:
-                try:
-                    import json
-                    event_data = json.loads(event.event_value)
-                    if "depth" in event_data:
-                        scroll_depths.append(event_data["depth"])
-                except:
-                    pass
-            
-            # Extrair tempo de permanência
-            if event_type == "pageview" and event.event_value:
-                try:
-                    import json
-                    event_data = json.loads(event.event_value)
-                    if "time_on_page" in event_data:
-                        time_on_page_values.append(event_data["time_on_page"])
-                except:
-                    pass
-            
-            # Contar conversões
-            if event_type in conversion_types:
-                conversions_by_type[event_type] = conversions_by_type.get(event_type, 0) + 1
-        
-        # Calcular tempo médio de permanência
-        average_time_on_page = sum(time_on_page_values) / len(time_on_page_values) if time_on_page_values else 0
+        # Tempo médio de permanência (campo time_on_page_s dos pageviews)
+        average_time_on_page = (
+            db.query(func.avg(ConversionEvent.time_on_page_s))
+            .filter(*condicoes, ConversionEvent.event_type == "pageview")
+            .scalar()
+        ) or 0
         
         # Estatísticas de scroll depth
-        scroll_depth_stats = {
-            "25": scroll_depths.count(25),
-            "50": scroll_depths.count(50),
-            "75": scroll_depths.count(75),
-            "100": scroll_depths.count(100)
-        }
+        profundidades = ["25", "50", "75", "100"]
+        contagem_scroll = dict(
+            db.query(ConversionEvent.scroll_depth, func.count(ConversionEvent.id))
+            .filter(
+                *condicoes,
+                ConversionEvent.event_type == "scroll",
+                ConversionEvent.scroll_depth.in_([int(p) for p in profundidades])
+            )
+            .group_by(ConversionEvent.scroll_depth)
+            .all()
+        )
+        scroll_depth_stats = {p: contagem_scroll.get(int(p), 0) for p in profundidades}
         
         # Calcular taxa de conversão
         total_conversions = sum(conversions_by_type.values())
         
         # Obter total de cliques para calcular taxa
-        clicks_query = db.query(Click)
+        clicks_query = db.query(func.count(Click.id))
         if link_id:
             clicks_query = clicks_query.filter(Click.link_id == link_id)
         if click_id:
@@ -398,7 +637,7 @@ class AnalyticsService:
             except ValueError:
                 pass
         
-        total_clicks = clicks_query.count()
+        total_clicks = clicks_query.scalar() or 0
         conversion_rate = (total_conversions / total_clicks * 100) if total_clicks > 0 else 0
         
         return {
@@ -0,0 +1,223 @@
+"""
+Benchmark do analytics de períodos longos
+
+Cria um banco SQLite descartável com N cliques espalhados por vários meses,
+reconstrói os rollups, exporta o snapshot colunar (click_snapshot.py) e mede
+get_link_analytics no período inteiro por três caminhos:
+
+- orm: implementação antiga (todos os Click em memória, contagem em Python),
+  medida em uma amostra e extrapolada linearmente acima de --orm-max-rows
+- rollups: GROUP BY sobre click_rollup_hora
+- snapshot: NumPy sobre o snapshot mapeado em memória + cauda nos rollups
+
+O heatmap (get_heatmap) do mesmo período é medido pelos dois últimos caminhos.
+
+Durante a exportação do snapshot, uma thread grava cliques pelo ClickWriter
+(uma transação por clique, como no flush) e mede a maior espera por escrita
+e as falhas ("database is locked").
+
+Uso:
+    python benchmarks/bench_analytics_snapshot.py --rows 10000000 --output resultado.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DISPOSITIVOS = ["mobile", "mobile", "mobile", "desktop", "tablet", None]
+PAISES = ["Brasil", "Brasil", "Brasil", "Portugal", "Estados Unidos", None]
+NAVEGADORES = ["Chrome Mobile", "Safari", "Samsung Internet", "Chrome", "Firefox"]
+
+
+def semear(caminho_db: str, linhas: int, links: int, dias: int, inicio: datetime, lote: int = 200000):
+    """Insere links e cliques direto pelo sqlite3 (o schema já foi criado pelo SQLAlchemy)"""
+    rnd = random.Random(7)
+    conn = sqlite3.connect(caminho_db)
+    conn.executemany(
+        "INSERT INTO links (id, identifier, destination_url, ponto_dooh, campanha) VALUES (?, ?, ?, ?, ?)",
+        [(i, f"bench-{i}", f"https://example.com/{i}", f"Ponto {i % 25}", f"Campanha {i % 9}") for i in range(1, links + 1)]
+    )
+    # Cliques em ordem cronológica, como chegam na produção
+    passo = dias * 86400 / linhas
+    gerados = 0
+    while gerados < linhas:
+        quantidade = min(lote, linhas - gerados)
+        conn.executemany(
+            "INSERT INTO clicks (id, link_id, ip_address, device_type, browser, country, clicked_at, repeat_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            [
+                (
+                    gerados + i + 1,
+                    rnd.randint(1, links),
+                    f"10.{rnd.randint(0, 63)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}",
+                    rnd.choice(DISPOSITIVOS),
+                    rnd.choice(NAVEGADORES),
+                    rnd.choice(PAISES),
+                    (inicio + timedelta(seconds=(gerados + i) * passo)).strftime("%Y-%m-%d %H:%M:%S.%f")
+                )
+                for i in range(quantidade)
+            ]
+        )
+        conn.commit()
+        gerados += quantidade
+        print(f"  {gerados}/{linhas} cliques", end="\r", flush=True)
+    print()
+    conn.close()
+
+
+def gravar_durante(parar: threading.Event, inicio_id: int, link_id: int, clicked_at: datetime) -> dict:
+    """Grava um clique por vez pelo ClickWriter até `parar`; retorna contagens e a maior espera"""
+    from click_writer import ClickWriter
+
+    writer = ClickWriter()
+    gravados = falhas = 0
+    maior = 0.0
+    click_id = inicio_id
+    while not parar.is_set():
+        click_id += 1
+        row = {
+            "id": click_id, "link_id": link_id, "ip_address": "10.0.0.1", "user_agent": None, "referrer": None,
+            "device_type": "mobile", "browser": "Chrome", "operating_system": None, "country": "Brasil",
+            "city": None, "state": None, "isp": None, "timezone": None, "language": None,
+            "clicked_at": clicked_at, "repeat_count": 0
+        }
+        t0 = time.perf_counter()
+        _, erro = writer._gravar_transacao([row], {})
+        maior = max(maior, time.perf_counter() - t0)
+        if erro is None:
+            gravados += 1
+        else:
+            falhas += 1
+        time.sleep(0.01)
+    return {"writes": gravados, "write_failures": falhas, "max_write_wait_s": round(maior, 3)}
+
+
+def medir(funcao, repeticoes: int) -> float:
+    """Mediana do tempo de execução em segundos"""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    tempos.sort()
+    return tempos[len(tempos) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Quantidade de cliques")
+    parser.add_argument("--links", type=int, default=500, help="Quantidade de links")
+    parser.add_argument("--days", type=int, default=180, help="Dias cobertos pelos cliques")
+    parser.add_argument("--orm-max-rows", type=int, default=500_000, help="Acima disso o caminho ORM é medido em amostra e extrapolado")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições por caminho (mediana)")
+    parser.add_argument("--output", help="Arquivo JSON com o resultado")
+    args = parser.parse_args()
+
+    # Banco descartável: database.py usa sqlite:///./conteudooh.db relativo ao diretório atual
+    os.chdir(tempfile.mkdtemp(prefix="conteudooh-snapshot-"))
+
+    from database import Base, engine, SessionLocal
+    import analytics_service
+    from analytics_service import AnalyticsService
+    import click_rollups
+    import click_snapshot
+    from check_analytics import _referencia
+
+    Base.metadata.create_all(bind=engine)
+    inicio = datetime(2025, 1, 1)
+    fim = inicio + timedelta(days=args.days)
+    print(f"Semeando {args.rows} cliques em {args.days} dias...")
+    t0 = time.perf_counter()
+    semear("conteudooh.db", args.rows, args.links, args.days, inicio)
+    tempo_seed = time.perf_counter() - t0
+
+    db = SessionLocal()
+    t0 = time.perf_counter()
+    click_rollups.reconstruir(db)
+    tempo_rollups = time.perf_counter() - t0
+    print(f"Rollups reconstruídos em {tempo_rollups:.1f} s")
+
+    # Snapshot até 1 dia antes do fim: o último dia vem da cauda nos rollups
+    # (com gravação de cliques concorrente, depois do fim, fora do snapshot)
+    parar = threading.Event()
+    escrita = {}
+    gravador = threading.Thread(target=lambda: escrita.update(gravar_durante(parar, args.rows, 1, fim)))
+    gravador.start()
+    t0 = time.perf_counter()
+    metadata = click_snapshot.exportar(db, diretorio="snapshot", corte=fim - timedelta(days=1))
+    tempo_export = time.perf_counter() - t0
+    parar.set()
+    gravador.join()
+    print(f"Gravação concorrente: {escrita}")
+    tamanho = sum(os.path.getsize(os.path.join("snapshot", metadata["versao"], n)) for n in os.listdir(os.path.join("snapshot", metadata["versao"])))
+    print(f"Snapshot: {metadata['linhas']} cliques, {tamanho / 1e6:.1f} MB, exportado em {tempo_export:.1f} s")
+
+    start_date, end_date = inicio.date().isoformat(), (fim - timedelta(days=1)).date().isoformat()
+    filtros = {"start_date": start_date, "end_date": end_date, "unique_ips_mode": "approx"}
+
+    # Caminho ORM (implementação antiga)
+    amostra = min(args.rows, args.orm_max_rows)
+    if amostra < args.rows:
+        antes_de = inicio + timedelta(days=args.days * amostra / args.rows)
+        tempo_orm = medir(lambda: _referencia(db, start_date=start_date, antes_de=antes_de), 1) * args.rows / amostra
+    else:
+        tempo_orm = medir(lambda: _referencia(db, start_date=start_date, end_date=end_date), 1)
+
+    # Rollups (sem snapshot)
+    click_snapshot.click_snapshot.diretorio = "sem-snapshot"
+    tempo_rollups_q = medir(lambda: AnalyticsService.get_link_analytics(db, **filtros), args.repeat)
+    resultado_rollups = AnalyticsService.get_link_analytics(db, **filtros)
+    tempo_heatmap_rollups = medir(lambda: AnalyticsService.get_heatmap(db, start_date=start_date, end_date=end_date), args.repeat)
+    heatmap_rollups = AnalyticsService.get_heatmap(db, start_date=start_date, end_date=end_date)
+
+    # Snapshot + cauda
+    click_snapshot.click_snapshot.diretorio = "snapshot"
+    click_snapshot.click_snapshot.reload(force=True)
+    analytics_service.CLICK_SNAPSHOT_MIN_DAYS = 0
+    tempo_snapshot = medir(lambda: AnalyticsService.get_link_analytics(db, **filtros), args.repeat)
+    resultado_snapshot = AnalyticsService.get_link_analytics(db, **filtros)
+    tempo_heatmap_snapshot = medir(lambda: AnalyticsService.get_heatmap(db, start_date=start_date, end_date=end_date), args.repeat)
+    heatmap_snapshot = AnalyticsService.get_heatmap(db, start_date=start_date, end_date=end_date)
+    db.close()
+
+    iguais = all(resultado_rollups[k] == resultado_snapshot[k] for k in resultado_rollups if k != "top_links")
+    iguais = iguais and heatmap_rollups == heatmap_snapshot
+    resultado = {
+        "rows": args.rows,
+        "links": args.links,
+        "days": args.days,
+        "seed_s": round(tempo_seed, 1),
+        "rollup_rebuild_s": round(tempo_rollups, 1),
+        "snapshot_export_s": round(tempo_export, 1),
+        "snapshot_mb": round(tamanho / 1e6, 1),
+        "concurrent_writes": escrita,
+        "orm_s": round(tempo_orm, 3),
+        "orm_extrapolated_from_rows": amostra if amostra < args.rows else None,
+        "rollups_s": round(tempo_rollups_q, 3),
+        "snapshot_s": round(tempo_snapshot, 3),
+        "speedup_snapshot_vs_orm": round(tempo_orm / tempo_snapshot, 1),
+        "speedup_snapshot_vs_rollups": round(tempo_rollups_q / tempo_snapshot, 1),
+        "heatmap_rollups_s": round(tempo_heatmap_rollups, 3),
+        "heatmap_snapshot_s": round(tempo_heatmap_snapshot, 3),
+        "results_match": iguais
+    }
+    print(json.dumps(resultado, indent=2))
+    if args.output:
+        with open(os.path.join(RAIZ, args.output) if not os.path.isabs(args.output) else args.output, "w") as f:
+            json.dump(resultado, f, indent=2)
+    if not iguais or escrita["write_failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
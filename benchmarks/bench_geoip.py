@@ -0,0 +1,90 @@
+"""
+Microbenchmark do motor de GeoIP offline (geoip_service)
+
+Gera um arquivo sintético de faixas IPv4/IPv6, carrega o índice e mede
+consultas por segundo com e sem o cache por IP.
+
+Uso:
+    python benchmarks/bench_geoip.py --ranges 200000 --lookups 500000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import ipaddress
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geoip_service import GeoIPIndex, GeoIPService
+
+CIDADES = [
+    ("Brazil", "Paraíba", "Cajazeiras", "America/Fortaleza"),
+    ("Brazil", "Paraíba", "João Pessoa", "America/Fortaleza"),
+    ("Brazil", "Ceará", "Fortaleza", "America/Fortaleza"),
+    ("Brazil", "Pernambuco", "Recife", "America/Recife"),
+    ("Brazil", "São Paulo", "São Paulo", "America/Sao_Paulo"),
+]
+ISPS = ["Claro", "Vivo", "TIM", "Oi", "Provedor Local"]
+
+
+def gerar_dataset(caminho: str, ranges: int):
+    """Escreve faixas contíguas de /24 (IPv4) e /48 (IPv6)"""
+    metade = ranges // 2
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        arquivo.write("start_ip,end_ip,country,state,city,isp,timezone\n")
+        base_v4 = int(ipaddress.IPv4Address("1.0.0.0"))
+        for i in range(metade):
+            inicio = base_v4 + i * 256
+            country, state, city, tz = random.choice(CIDADES)
+            arquivo.write(f"{ipaddress.IPv4Address(inicio)},{ipaddress.IPv4Address(inicio + 255)},"
+                          f"{country},{state},{city},{random.choice(ISPS)},{tz}\n")
+        base_v6 = int(ipaddress.IPv6Address("2804::"))
+        tamanho_v6 = 1 << 80
+        for i in range(ranges - metade):
+            inicio = base_v6 + i * tamanho_v6
+            country, state, city, tz = random.choice(CIDADES)
+            arquivo.write(f"{ipaddress.IPv6Address(inicio)},{ipaddress.IPv6Address(inicio + tamanho_v6 - 1)},"
+                          f"{country},{state},{city},{random.choice(ISPS)},{tz}\n")
+    return base_v4, metade * 256, base_v6, (ranges - metade) * tamanho_v6
+
+
+def medir(nome: str, funcao, ips: list):
+    inicio = time.perf_counter()
+    for ip in ips:
+        funcao(ip)
+    duracao = time.perf_counter() - inicio
+    print(f"{nome:<32} {len(ips) / duracao:>12,.0f} consultas/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ranges", type=int, default=200000, help="Número de faixas no dataset sintético")
+    parser.add_argument("--lookups", type=int, default=200000, help="Número de consultas por cenário")
+    parser.add_argument("--distintos", type=int, default=2000, help="IPs distintos no cenário com cache")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, "geoip.csv")
+        base_v4, span_v4, base_v6, span_v6 = gerar_dataset(caminho, args.ranges)
+
+        inicio = time.perf_counter()
+        indice = GeoIPIndex(caminho)
+        print(f"Carga do índice: {len(indice)} faixas em {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+        ips_v4 = [str(ipaddress.IPv4Address(base_v4 + random.randrange(span_v4))) for _ in range(args.lookups)]
+        ips_v6 = [str(ipaddress.IPv6Address(base_v6 + random.randrange(span_v6))) for _ in range(args.lookups)]
+        repetidos = random.choices(ips_v4[:args.distintos], k=args.lookups)
+
+        medir("Índice IPv4 (sem cache)", indice.lookup, ips_v4)
+        medir("Índice IPv6 (sem cache)", indice.lookup, ips_v6)
+
+        servico = GeoIPService(caminho=caminho, cache_size=args.distintos * 2, reload_interval=3600)
+        servico.reload()
+        medir(f"Serviço com cache ({args.distintos} IPs)", servico.lookup, repetidos)
+        print(f"Cache: {servico.stats()}")
+
+
+if __name__ == "__main__":
+    main()
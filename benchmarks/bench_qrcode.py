@@ -0,0 +1,47 @@
+"""
+Microbenchmark do cache de QR codes (qr_cache)
+
+Mede o tempo por imagem da geração completa (qrcode + PNG), da leitura do
+disco e do acerto em memória, para os dois tamanhos.
+
+Uso:
+    python benchmarks/bench_qrcode.py --imagens 200
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qr_cache import QRCodeCache, TAMANHOS
+
+
+def medir(nome: str, cache: QRCodeCache, urls: list, tamanho: str):
+    inicio = time.perf_counter()
+    for identifier, url in urls:
+        cache.obter(identifier, url, tamanho)
+    duracao = time.perf_counter() - inicio
+    print(f"{nome:<28} {duracao * 1000 / len(urls):>10.3f} ms/imagem")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do cache de QR codes")
+    parser.add_argument("--imagens", type=int, default=200, help="Quantidade de URLs distintas")
+    args = parser.parse_args()
+
+    urls = [(f"noticia-{i}", f"https://dooh.example.com/r/noticia-{i}") for i in range(args.imagens)]
+    diretorio = tempfile.mkdtemp(prefix="conteudooh-qr-")
+    for tamanho in TAMANHOS:
+        print(f"tamanho={tamanho}")
+        cache = QRCodeCache(maxsize=args.imagens, diretorio=diretorio)
+        medir("geração (miss)", cache, urls, tamanho)
+        medir("memória (hit)", cache, urls, tamanho)
+        cache.clear()
+        medir("disco (hit)", cache, urls, tamanho)
+        print(f"  {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
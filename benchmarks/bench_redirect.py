@@ -0,0 +1,304 @@
+"""
+Teste de carga do endpoint /r/{identifier}
+
+- Cria um banco SQLite descartável com N links
+- Sobe um stub local do ipapi.co (latência configurável) e aponta IPAPI_URL para ele
+- Sobe a aplicação com uvicorn em um subprocesso (feed RSS substituído por lista vazia)
+- Dispara redirects com C clientes concorrentes (conexões keep-alive) e um mix realista de User-Agents
+- Reporta RPS e latência p50/p95/p99 e grava o resultado em JSON
+
+Uso:
+    python benchmarks/bench_redirect.py --links 500 --clients 50 --duration 20 --output resultado.json
+    python benchmarks/bench_redirect.py --compare resultado.json --tolerance 0.15
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import platform
+import subprocess
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Mix de User-Agents típico de scans de QR code em DOOH (peso, UA)
+USER_AGENTS = [
+    (30, "Mozilla/5.0 (Linux; Android 13; SM-A135M) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.144 Mobile Safari/537.36"),
+    (15, "Mozilla/5.0 (Linux; Android 12; moto g(20)) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.6045.163 Mobile Safari/537.36"),
+    (12, "Mozilla/5.0 (iPhone; CPU iPhone OS 17_1_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.1.2 Mobile/15E148 Safari/604.1"),
+    (8, "Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1"),
+    (10, "Mozilla/5.0 (Linux; Android 13; SAMSUNG SM-A325M) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/23.0 Chrome/115.0.0.0 Mobile Safari/537.36"),
+    (7, "Mozilla/5.0 (Linux; Android 11; Redmi Note 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.43 Mobile Safari/537.36"),
+    (5, "Mozilla/5.0 (Linux; Android 13; SM-G991B Build/TP1A.220624.014; wv) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/120.0.6099.144 Mobile Safari/537.36 Instagram 312.0.0.32.112 Android"),
+    (4, "Mozilla/5.0 (iPhone; CPU iPhone OS 17_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 [FBAN/FBIOS;FBAV/444.0.0.41.109;FBBV/549321429]"),
+    (4, "Mozilla/5.0 (iPad; CPU OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1"),
+    (3, "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"),
+    (2, "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36"),
+]
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def iniciar_stub_ipapi(latencia_ms: float) -> ThreadingHTTPServer:
+    """Stub do ipapi.co: responde /{ip}/json/ com uma localização fixa após latencia_ms"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latencia_ms / 1000.0)
+            corpo = json.dumps({
+                "country_name": "Brazil",
+                "region": "Paraíba",
+                "city": "Cajazeiras",
+                "org": "Provedor Local",
+                "timezone": "America/Fortaleza"
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", _porta_livre()), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def semear_banco(diretorio: str, quantidade: int) -> list:
+    """Cria o schema e N links no banco do diretório informado (processo separado)"""
+    script = (
+        "import sys\n"
+        f"sys.path.insert(0, {RAIZ!r})\n"
+        "from database import engine, Base, SessionLocal\n"
+        "from models import Link\n"
+        "Base.metadata.create_all(bind=engine)\n"
+        "db = SessionLocal()\n"
+        f"for i in range({quantidade}):\n"
+        "    db.add(Link(identifier=f'bench-{i}', destination_url=f'https://example.com/campanha/{i}?ref=qr',\n"
+        "                ponto_dooh=f'Ponto {i % 20}', campanha=f'Campanha {i % 7}',\n"
+        "                utm_source='dooh', utm_medium='led', utm_campaign=f'campanha-{i % 7}', utm_content=f'qr-{i}'))\n"
+        "db.commit()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=diretorio, check=True)
+    return [f"bench-{i}" for i in range(quantidade)]
+
+
+def iniciar_app(diretorio: str, porta: int, env_extra: dict) -> subprocess.Popen:
+    """Sobe main:app com uvicorn sem o scraping real do feed"""
+    bootstrap = (
+        "import sys\n"
+        f"sys.path.insert(0, {RAIZ!r})\n"
+        "import scraper\n"
+        "scraper.RadiocentroScraper.obter_noticias = lambda self, limite=20: []\n"
+        "import uvicorn\n"
+        f"uvicorn.run('main:app', host='127.0.0.1', port={porta}, log_level='warning')\n"
+    )
+    env = dict(os.environ, **env_extra)
+    processo = subprocess.Popen([sys.executable, "-c", bootstrap], cwd=diretorio, env=env)
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", porta), timeout=0.5):
+                return processo
+        except OSError:
+            if processo.poll() is not None:
+                raise RuntimeError("A aplicação encerrou durante a inicialização")
+            time.sleep(0.1)
+    processo.kill()
+    raise RuntimeError("A aplicação não respondeu em 30 s")
+
+
+async def _http_get(reader, writer, caminho: str, headers: dict) -> int:
+    """GET HTTP/1.1 keep-alive mínimo; retorna o status"""
+    linhas = [f"GET {caminho} HTTP/1.1", "Host: 127.0.0.1"]
+    linhas += [f"{k}: {v}" for k, v in headers.items()]
+    writer.write(("\r\n".join(linhas) + "\r\n\r\n").encode())
+    await writer.drain()
+
+    cabecalho = await reader.readuntil(b"\r\n\r\n")
+    linhas_resposta = cabecalho.decode("latin-1").split("\r\n")
+    status = int(linhas_resposta[0].split(" ")[1])
+    tamanho = 0
+    for linha in linhas_resposta[1:]:
+        if linha.lower().startswith("content-length:"):
+            tamanho = int(linha.split(":", 1)[1])
+    if tamanho:
+        await reader.readexactly(tamanho)
+    return status
+
+
+async def _cliente(porta: int, identifiers: list, fim: float, latencias: list, erros: list, pesos: list, uas: list):
+    reader, writer = await asyncio.open_connection("127.0.0.1", porta)
+    try:
+        while time.monotonic() < fim:
+            identifier = random.choice(identifiers)
+            headers = {
+                "User-Agent": random.choices(uas, weights=pesos)[0],
+                "X-Forwarded-For": f"{random.randint(177, 191)}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}",
+                "Accept-Language": "pt-BR,pt;q=0.9"
+            }
+            inicio = time.perf_counter()
+            try:
+                status = await _http_get(reader, writer, f"/r/{identifier}", headers)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                erros.append("conexao")
+                writer.close()
+                reader, writer = await asyncio.open_connection("127.0.0.1", porta)
+                continue
+            latencias.append(time.perf_counter() - inicio)
+            if status != 302:
+                erros.append(status)
+    finally:
+        writer.close()
+
+
+async def gerar_carga(porta: int, identifiers: list, clientes: int, duracao: float, aquecimento: float):
+    pesos = [p for p, _ in USER_AGENTS]
+    uas = [ua for _, ua in USER_AGENTS]
+
+    # Aquecimento: popula caches (links, User-Agent) sem contar nas métricas
+    if aquecimento > 0:
+        fim = time.monotonic() + aquecimento
+        await asyncio.gather(*[
+            _cliente(porta, identifiers, fim, [], [], pesos, uas) for _ in range(clientes)
+        ])
+
+    latencias, erros = [], []
+    inicio = time.monotonic()
+    fim = inicio + duracao
+    await asyncio.gather(*[
+        _cliente(porta, identifiers, fim, latencias, erros, pesos, uas) for _ in range(clientes)
+    ])
+    return latencias, erros, time.monotonic() - inicio
+
+
+def _percentil(valores_ordenados: list, p: float) -> float:
+    if not valores_ordenados:
+        return 0.0
+    indice = min(len(valores_ordenados) - 1, int(round(p / 100.0 * (len(valores_ordenados) - 1))))
+    return valores_ordenados[indice]
+
+
+def _obter_stats(porta: int) -> dict:
+    import urllib.request
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{porta}/api/tracking/stats", timeout=5) as resposta:
+            return json.loads(resposta.read())
+    except Exception:
+        return {}
+
+
+def comparar(atual: dict, referencia_path: str, tolerancia: float) -> bool:
+    """Compara com um resultado anterior; retorna False se houver regressão"""
+    with open(referencia_path, encoding="utf-8") as arquivo:
+        referencia = json.load(arquivo)
+
+    ok = True
+    rps_ref, rps = referencia["rps"], atual["rps"]
+    print(f"\nComparação com {referencia_path} (commit {referencia.get('commit')}):")
+    print(f"  RPS: {rps_ref:.1f} -> {rps:.1f} ({(rps / rps_ref - 1) * 100 if rps_ref else 0:+.1f}%)")
+    if rps_ref and rps < rps_ref * (1 - tolerancia):
+        ok = False
+    for chave in ("p50_ms", "p95_ms", "p99_ms"):
+        ref, val = referencia["latency"][chave], atual["latency"][chave]
+        print(f"  {chave}: {ref:.2f} -> {val:.2f} ({(val / ref - 1) * 100 if ref else 0:+.1f}%)")
+        if chave != "p50_ms" and ref and val > ref * (1 + tolerancia):
+            ok = False
+    print("  Resultado: " + ("OK" if ok else f"REGRESSÃO (tolerância {tolerancia:.0%})"))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=200, help="Quantidade de links semeados")
+    parser.add_argument("--clients", type=int, default=32, help="Clientes concorrentes")
+    parser.add_argument("--duration", type=float, default=15.0, help="Duração da medição (s)")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Aquecimento antes da medição (s)")
+    parser.add_argument("--geoip-latency-ms", type=float, default=50.0, help="Latência do stub do ipapi.co")
+    parser.add_argument("--output", default="bench_redirect.json", help="Arquivo JSON de saída")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para detectar regressão")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Piora máxima aceita na comparação (fração)")
+    args = parser.parse_args()
+
+    stub = iniciar_stub_ipapi(args.geoip_latency_ms)
+    diretorio = tempfile.mkdtemp(prefix="conteudooh-bench-")
+    identifiers = semear_banco(diretorio, args.links)
+    porta = _porta_livre()
+    app = iniciar_app(diretorio, porta, {
+        "GEOIP_BACKEND": "ipapi",
+        "IPAPI_URL": f"http://127.0.0.1:{stub.server_address[1]}/{{ip}}/json/"
+    })
+
+    try:
+        latencias, erros, duracao = asyncio.run(
+            gerar_carga(porta, identifiers, args.clients, args.duration, args.warmup)
+        )
+        stats_servidor = _obter_stats(porta)
+    finally:
+        app.terminate()
+        try:
+            app.wait(15)
+        except subprocess.TimeoutExpired:
+            app.kill()
+        stub.shutdown()
+
+    latencias.sort()
+    resultado = {
+        "benchmark": "redirect",
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {
+            "links": args.links,
+            "clients": args.clients,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "geoip_latency_ms": args.geoip_latency_ms
+        },
+        "requests": len(latencias),
+        "errors": len(erros),
+        "rps": round(len(latencias) / duracao, 2) if duracao else 0.0,
+        "latency": {
+            "p50_ms": round(_percentil(latencias, 50) * 1000, 3),
+            "p95_ms": round(_percentil(latencias, 95) * 1000, 3),
+            "p99_ms": round(_percentil(latencias, 99) * 1000, 3),
+            "max_ms": round((latencias[-1] if latencias else 0.0) * 1000, 3)
+        },
+        "server_stats": stats_servidor
+    }
+
+    print(f"Requisições: {resultado['requests']}  Erros: {resultado['errors']}")
+    print(f"RPS: {resultado['rps']:.1f}")
+    print("Latência: p50={p50_ms:.2f} ms  p95={p95_ms:.2f} ms  p99={p99_ms:.2f} ms  max={max_ms:.2f} ms".format(**resultado["latency"]))
+
+    with open(args.output, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+    print(f"Resultado salvo em {args.output}")
+
+    if args.compare and not comparar(resultado, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
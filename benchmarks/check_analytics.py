@@ -0,0 +1,365 @@
+"""
+Verificação das agregações de analytics
+
+Cria um banco SQLite descartável com links e cliques sintéticos (valores
+nulos, vazios e vários dias incluídos) e compara AnalyticsService com a
+implementação de referência abaixo, que carrega todos os cliques e conta em
+Python. Roda com os rollups horários mantidos na gravação, de novo após
+reconstruí-los e com o snapshot colunar cobrindo parte do período; IPs únicos estimados (HyperLogLog) devem ficar a até 4 erros
+padrão do valor exato. O heatmap (dia da semana x hora) é comparado em todas
+as fases. As métricas de conversão são comparadas com a leitura
+de event_value em Python, com os campos tipados gravados na inserção e
+preenchidos depois (conversion_events.preencher_campos). Qualquer divergência
+termina o script com código 1.
+
+Uso:
+    python benchmarks/check_analytics.py --clicks 5000
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def _referencia(db, ponto_dooh=None, campanha=None, link_id=None, start_date=None, end_date=None, top_n=10,
+                antes_de=None):
+    """Cálculo de referência: todos os cliques em memória (antes_de limita a amostra nos benchmarks)"""
+    from models import Link, Click
+
+    query = db.query(Click).join(Link)
+    if antes_de:
+        query = query.filter(Click.clicked_at < antes_de)
+    if start_date:
+        query = query.filter(Click.clicked_at >= datetime.fromisoformat(start_date))
+    if end_date:
+        fim = datetime.fromisoformat(end_date).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        query = query.filter(Click.clicked_at < fim)
+    if ponto_dooh:
+        query = query.filter(Link.ponto_dooh == ponto_dooh)
+    if campanha:
+        query = query.filter(Link.campanha == campanha)
+    if link_id:
+        query = query.filter(Link.id == link_id)
+    clicks = query.all()
+
+    def contar(valores):
+        contagem = {}
+        for valor in valores:
+            if valor:
+                contagem[valor] = contagem.get(valor, 0) + 1
+        return contagem
+
+    por_link = {}
+    for c in clicks:
+        por_link.setdefault(c.link_id, []).append(c)
+    top_links = [
+        {
+            "link_id": c[0].link.id,
+            "identifier": c[0].link.identifier,
+            "destination_url": c[0].link.destination_url,
+            "ponto_dooh": c[0].link.ponto_dooh,
+            "campanha": c[0].link.campanha,
+            "total_clicks": len(c),
+            "unique_ips": len({x.ip_address for x in c if x.ip_address})
+        }
+        for c in por_link.values()
+    ]
+    top_links.sort(key=lambda x: x["total_clicks"], reverse=True)
+
+    return {
+        "total_clicks": len(clicks),
+        "unique_ips": len({c.ip_address for c in clicks if c.ip_address}),
+        "clicks_by_ponto": contar(c.link.ponto_dooh for c in clicks),
+        "clicks_by_campanha": contar(c.link.campanha for c in clicks),
+        "clicks_by_device": contar(c.device_type or "unknown" for c in clicks),
+        "clicks_by_country": contar(c.country or "unknown" for c in clicks),
+        "clicks_by_day": contar(c.clicked_at.strftime("%Y-%m-%d") for c in clicks if c.clicked_at),
+        "top_links": top_links[:top_n]
+    }
+
+
+def _referencia_heatmap(db, ponto_dooh=None, campanha=None, link_id=None, start_date=None, end_date=None):
+    """Heatmap de referência: weekday()/hour de cada clique e conversão em Python"""
+    from models import Link, Click, ConversionEvent
+
+    def filtrar(query, coluna):
+        if start_date:
+            query = query.filter(coluna >= datetime.fromisoformat(start_date))
+        if end_date:
+            fim = datetime.fromisoformat(end_date).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            query = query.filter(coluna < fim)
+        if ponto_dooh:
+            query = query.filter(Link.ponto_dooh == ponto_dooh)
+        if campanha:
+            query = query.filter(Link.campanha == campanha)
+        if link_id:
+            query = query.filter(Link.id == link_id)
+        return query
+
+    def matriz(datas):
+        linhas = [[0] * 24 for _ in range(7)]
+        for dt in datas:
+            # weekday(): 0 = segunda; no heatmap 0 = domingo
+            linhas[(dt.weekday() + 1) % 7][dt.hour] += 1
+        return linhas
+
+    cliques = [c for (c,) in filtrar(db.query(Click.clicked_at).join(Link), Click.clicked_at).all() if c]
+    conversoes = [
+        e for (e,) in filtrar(
+            db.query(ConversionEvent.occurred_at).join(Click).join(Link)
+            .filter(ConversionEvent.event_type.in_(["whatsapp", "form", "download", "call", "purchase"])),
+            ConversionEvent.occurred_at
+        ).all()
+    ]
+    return {
+        "clicks": matriz(cliques),
+        "conversions": matriz(conversoes),
+        "total_clicks": len(cliques),
+        "total_conversions": len(conversoes)
+    }
+
+
+def _referencia_conversoes(db, link_id=None, click_id=None, start_date=None, end_date=None):
+    """Métricas de conversão de referência: todos os eventos em memória e json.loads por linha"""
+    import json
+    from models import Click, ConversionEvent
+
+    query = db.query(ConversionEvent)
+    if click_id:
+        query = query.filter(ConversionEvent.click_id == click_id)
+    if link_id:
+        query = query.join(Click).filter(Click.link_id == link_id)
+    if start_date:
+        query = query.filter(ConversionEvent.occurred_at >= datetime.fromisoformat(start_date))
+    if end_date:
+        query = query.filter(ConversionEvent.occurred_at <= datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59))
+    events = query.all()
+
+    events_by_type, scroll_depths, tempos, conversions_by_type = {}, [], [], {}
+    for event in events:
+        events_by_type[event.event_type] = events_by_type.get(event.event_type, 0) + 1
+        try:
+            dados = json.loads(event.event_value) if event.event_value else {}
+        except ValueError:
+            dados = {}
+        if event.event_type == "scroll" and isinstance(dados, dict) and "depth" in dados:
+            scroll_depths.append(dados["depth"])
+        if event.event_type == "pageview" and isinstance(dados, dict) and "time_on_page" in dados:
+            tempos.append(dados["time_on_page"])
+        if event.event_type in ("whatsapp", "form", "download", "call", "purchase"):
+            conversions_by_type[event.event_type] = conversions_by_type.get(event.event_type, 0) + 1
+
+    clicks = db.query(Click)
+    if link_id:
+        clicks = clicks.filter(Click.link_id == link_id)
+    if click_id:
+        clicks = clicks.filter(Click.id == click_id)
+    if start_date:
+        clicks = clicks.filter(Click.clicked_at >= datetime.fromisoformat(start_date))
+    if end_date:
+        clicks = clicks.filter(Click.clicked_at <= datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59))
+    total_clicks = clicks.count()
+    total_conversions = sum(conversions_by_type.values())
+
+    return {
+        "total_events": len(events),
+        "events_by_type": events_by_type,
+        "average_time_on_page": round(sum(tempos) / len(tempos), 2) if tempos else 0,
+        "scroll_depth_stats": {p: scroll_depths.count(int(p)) for p in ("25", "50", "75", "100")},
+        "conversion_rate": round(total_conversions / total_clicks * 100, 2) if total_clicks else 0,
+        "total_conversions": total_conversions,
+        "conversions_by_type": conversions_by_type
+    }
+
+
+def _semear_eventos(db, quantidade: int, inicio: datetime):
+    """Metade dos eventos com campos tipados (como na API), metade sem (como antes da migração)"""
+    from sqlalchemy import insert
+    from models import Click, ConversionEvent
+    import conversion_events
+
+    rnd = random.Random(7)
+    click_ids = [i for (i,) in db.query(Click.id).all()]
+    valores = {
+        "scroll": ['{"depth": 25}', '{"depth": 50}', '{"depth": 75.0}', '{"depth": 100}', '{"depth": "50"}',
+                   '{"depth": 33}', '{"percent": 50}', '[50]', 'não é json', None],
+        "pageview": ['{"time_on_page": 12}', '{"time_on_page": 47.5}', '{"time_on_page": 0}', '{"url": "/"}', '{}', None],
+    }
+    rows = []
+    for i in range(quantidade):
+        event_type = rnd.choice(["pageview", "pageview", "scroll", "scroll", "cta_click", "whatsapp", "form", "purchase"])
+        event_value = rnd.choice(valores.get(event_type, [None, '{"label": "x"}']))
+        row = {
+            "click_id": rnd.choice(click_ids),
+            "event_type": event_type,
+            "event_value": event_value,
+            "occurred_at": inicio + timedelta(seconds=rnd.randint(0, 10 * 86400))
+        }
+        if i % 2:
+            row.update(conversion_events.campos_tipados(event_type, event_value))
+        rows.append(row)
+    db.execute(insert(ConversionEvent), rows)
+    db.commit()
+
+
+def _semear(db, quantidade_links: int, quantidade_cliques: int, inicio: datetime):
+    """Grava os cliques como o ClickWriter: INSERT em lote e rollups na mesma transação"""
+    from sqlalchemy import insert
+    from models import Link, Click
+    import click_rollups
+
+    rnd = random.Random(42)
+    links = [
+        Link(identifier=f"check-{i}", destination_url=f"https://example.com/{i}",
+             ponto_dooh=f"Ponto {i % 5}", campanha=f"Campanha {i % 3}")
+        for i in range(quantidade_links)
+    ]
+    db.add_all(links)
+    db.flush()
+    rows = [
+        {
+            "link_id": rnd.choice(links).id,
+            "ip_address": rnd.choice([None, "", f"10.0.{rnd.randint(0, 15)}.{rnd.randint(1, 250)}"]),
+            "device_type": rnd.choice([None, "", "mobile", "desktop", "tablet"]),
+            "country": rnd.choice([None, "", "Brasil", "Portugal"]),
+            "clicked_at": inicio + timedelta(seconds=rnd.randint(0, 10 * 86400))
+        }
+        for _ in range(quantidade_cliques)
+    ]
+    for i in range(0, len(rows), 200):
+        db.execute(insert(Click), rows[i:i + 200])
+        click_rollups.registrar(db, rows[i:i + 200])
+    db.commit()
+
+
+def _comparar(nome: str, obtido: dict, esperado: dict) -> bool:
+    chaves = [k for k in esperado if k != "top_links"]
+    erros = [k for k in chaves if obtido.get(k) != esperado[k]]
+    # Empates no top podem vir em qualquer ordem: comparar as contagens na ordem e o conteúdo
+    top_obtido, top_esperado = obtido.get("top_links", []), esperado.get("top_links", [])
+    if [t["total_clicks"] for t in top_obtido] != [t["total_clicks"] for t in top_esperado]:
+        erros.append("top_links")
+    else:
+        por_id = {t["link_id"]: t for t in top_esperado}
+        if any(t["link_id"] in por_id and t != por_id[t["link_id"]] for t in top_obtido):
+            erros.append("top_links")
+    print(f"{'OK ' if not erros else 'ERRO'} {nome}" + (f" -> {', '.join(erros)}" if erros else ""))
+    return not erros
+
+
+def _comparar_aproximado(nome: str, obtido: dict, esperado: dict) -> bool:
+    """IPs únicos estimados pelos sketches: dentro de 4 erros padrão do valor exato"""
+    from hyperloglog import HLL_ERRO_PADRAO
+
+    def dentro(estimado: int, exato: int) -> bool:
+        return abs(estimado - exato) <= max(2, 4 * HLL_ERRO_PADRAO * exato)
+
+    erros = []
+    if not obtido.get("unique_ips_approximate"):
+        erros.append("unique_ips_approximate")
+    if not dentro(obtido["unique_ips"], esperado["unique_ips"]):
+        erros.append(f"unique_ips ({obtido['unique_ips']} x {esperado['unique_ips']})")
+    por_id = {t["link_id"]: t for t in esperado.get("top_links", [])}
+    for t in obtido.get("top_links", []):
+        if t["link_id"] in por_id and not dentro(t["unique_ips"], por_id[t["link_id"]]["unique_ips"]):
+            erros.append(f"top_links[{t['link_id']}].unique_ips")
+    print(f"{'OK ' if not erros else 'ERRO'} {nome}" + (f" -> {', '.join(erros)}" if erros else ""))
+    return not erros
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=40, help="Quantidade de links")
+    parser.add_argument("--clicks", type=int, default=5000, help="Quantidade de cliques")
+    args = parser.parse_args()
+
+    # Banco descartável: database.py usa sqlite:///./conteudooh.db relativo ao diretório atual
+    os.chdir(tempfile.mkdtemp(prefix="conteudooh-analytics-"))
+
+    from database import Base, engine, SessionLocal
+    import analytics_service
+    from analytics_service import AnalyticsService
+    import click_rollups
+    import click_snapshot
+
+    Base.metadata.create_all(bind=engine)
+    inicio = datetime(2025, 3, 1, 6, 30)
+    db = SessionLocal()
+    _semear(db, args.links, args.clicks, inicio)
+
+    cenarios = {
+        "sem filtros": {},
+        "por ponto": {"ponto_dooh": "Ponto 1"},
+        "por campanha e período": {"campanha": "Campanha 2", "start_date": "2025-03-03", "end_date": "2025-03-06"},
+        "por link": {"link_id": 3},
+        "data inválida": {"start_date": "ontem"},
+        "início no meio da hora": {"start_date": "2025-03-04T10:30:15", "end_date": "2025-03-07"},
+        "início e fim no mesmo dia": {"start_date": "2025-03-05T23:10", "end_date": "2025-03-05"},
+        "top 3": {"top_n": 3},
+        "top 25 por ponto": {"ponto_dooh": "Ponto 2", "top_n": 25},
+    }
+    heatmaps = {
+        "sem filtros": {},
+        "por campanha e período": {"campanha": "Campanha 1", "start_date": "2025-03-02T14:40", "end_date": "2025-03-08"},
+        "por ponto": {"ponto_dooh": "Ponto 3"},
+    }
+    ok = True
+    # Rollups mantidos na gravação, reconstruídos do zero e, por fim, snapshot colunar + cauda
+    for origem in ("incremental", "rebuild", "snapshot"):
+        if origem == "rebuild":
+            print(f"Rollups reconstruídos: {click_rollups.reconstruir(db)} linhas")
+        if origem == "snapshot":
+            # Corte fora de hora cheia para exercitar também a borda lida de clicks
+            metadata = click_snapshot.exportar(db, diretorio="snapshot", corte=datetime(2025, 3, 6, 13, 17))
+            print(f"Snapshot exportado: {metadata['linhas']} cliques até {metadata['corte']}")
+            click_snapshot.click_snapshot.diretorio = "snapshot"
+            click_snapshot.click_snapshot.reload(force=True)
+            analytics_service.CLICK_SNAPSHOT_MIN_DAYS = 0
+        for nome, filtros in cenarios.items():
+            obtido = AnalyticsService.get_link_analytics(db, **filtros)
+            esperado = _referencia(db, **{k: v for k, v in filtros.items() if v != "ontem"})
+            ok = _comparar(f"[{origem}] {nome}", obtido, esperado) and ok
+            aproximado = AnalyticsService.get_link_analytics(db, unique_ips_mode="approx", **filtros)
+            ok = _comparar_aproximado(f"[{origem}] {nome} (HyperLogLog)", aproximado, esperado) and ok
+
+        for nome, filtros in heatmaps.items():
+            obtido = AnalyticsService.get_heatmap(db, **filtros)
+            esperado = _referencia_heatmap(db, **filtros)
+            ok = _comparar(f"[{origem}] heatmap {nome}", obtido, {k: esperado[k] for k in ("clicks", "total_clicks")}) and ok
+
+        for link_id in (1, 7):
+            obtido = AnalyticsService.get_link_specific_analytics(db, link_id, "2025-03-02T08:45", "2025-03-08")
+            esperado = _referencia(db, link_id=link_id, start_date="2025-03-02T08:45", end_date="2025-03-08")
+            esperado = {k: esperado[k] for k in ("total_clicks", "unique_ips", "clicks_by_device", "clicks_by_country", "clicks_by_day")}
+            ok = _comparar(f"[{origem}] link {link_id}", obtido, esperado) and ok
+
+    # Métricas de conversão (campos tipados preenchidos para os eventos gravados sem eles)
+    import conversion_events
+    _semear_eventos(db, max(args.clicks // 5, 100), inicio)
+    print(f"Eventos preenchidos: {conversion_events.preencher_campos(db, lote=97)}")
+    for nome, filtros in {
+        "sem filtros": {},
+        "por link": {"link_id": 3},
+        "por período": {"start_date": "2025-03-03", "end_date": "2025-03-06"},
+    }.items():
+        obtido = AnalyticsService.get_conversion_metrics(db, **filtros)
+        ok = _comparar(f"[conversões] {nome}", obtido, _referencia_conversoes(db, **filtros)) and ok
+    for nome, filtros in heatmaps.items():
+        ok = _comparar(f"[conversões] heatmap {nome}", AnalyticsService.get_heatmap(db, **filtros), _referencia_heatmap(db, **filtros)) and ok
+
+    db.close()
+    if click_snapshot.click_snapshot.consultas == 0:
+        print("ERRO snapshot não foi consultado")
+        ok = False
+    if not ok:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Verificação de regressão do modelo de execução
+
+Sobe a aplicação com uvicorn (banco SQLite descartável), dispara uma
+requisição lenta em /api/clima (serviço de clima substituído por um sleep)
+e, em paralelo, mede a latência de /r/{identifier}. Se algum handler voltar
+a bloquear o event loop, o redirect passa a esperar a requisição lenta e o
+script termina com código 1.
+
+Uso:
+    python benchmarks/check_event_loop.py --slow 2.0 --limite 0.5
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import urllib.request
+import urllib.error
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+class _SemRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url: str) -> float:
+    """Faz GET sem seguir redirect e retorna a latência em segundos"""
+    opener = urllib.request.build_opener(_SemRedirect)
+    inicio = time.perf_counter()
+    try:
+        opener.open(url, timeout=30).read()
+    except urllib.error.HTTPError as e:
+        if e.code != 302:
+            raise
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slow", type=float, default=2.0, help="Duração da requisição lenta (s)")
+    parser.add_argument("--limite", type=float, default=0.5, help="Latência máxima aceitável do redirect (s)")
+    args = parser.parse_args()
+
+    # Banco descartável: main.py usa sqlite:///./conteudooh.db relativo ao diretório atual
+    tmp = tempfile.mkdtemp(prefix="conteudooh-check-")
+    os.chdir(tmp)
+
+    import scraper
+    scraper.RadiocentroScraper.obter_noticias = lambda self, limite=20: []
+    import weather_service
+
+    def clima_lento(self, nome_cidade="Cajazeiras - PB"):
+        time.sleep(args.slow)
+        return {"atual": {}, "localizacao": {"nome": nome_cidade}}
+
+    weather_service.WeatherService.obter_clima_atual = clima_lento
+
+    import uvicorn
+    import main as app_main
+    from database import SessionLocal
+    from models import Link
+
+    db = SessionLocal()
+    db.add(Link(identifier="check", destination_url="https://example.com/", ponto_dooh="Check", campanha="Check"))
+    db.commit()
+    db.close()
+
+    porta = _porta_livre()
+    servidor = uvicorn.Server(uvicorn.Config(app_main.app, host="127.0.0.1", port=porta, log_level="warning"))
+    threading.Thread(target=servidor.run, daemon=True).start()
+    while not servidor.started:
+        time.sleep(0.05)
+
+    base = f"http://127.0.0.1:{porta}"
+    _get(f"{base}/r/check")  # aquece o cache de links
+
+    lenta = threading.Thread(target=_get, args=(f"{base}/api/clima",))
+    lenta.start()
+    time.sleep(min(0.2, args.slow / 4))
+    latencia = _get(f"{base}/r/check")
+    lenta.join()
+
+    servidor.should_exit = True
+    print(f"Latência de /r/ durante requisição lenta de {args.slow:.1f}s: {latencia * 1000:.1f} ms")
+    if latencia > args.limite:
+        print(f"FALHOU: acima do limite de {args.limite * 1000:.0f} ms (event loop bloqueado)")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
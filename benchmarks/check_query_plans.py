@@ -0,0 +1,174 @@
+"""
+Verificação dos planos de consulta (EXPLAIN QUERY PLAN)
+
+Cria um banco SQLite descartável, executa os cenários filtrados do analytics
+(AnalyticsService, com rollups e com snapshot + cauda), da exportação e dos
+filtros de frescor das notícias, captura todo SELECT enviado ao banco e roda
+EXPLAIN QUERY PLAN em cada um. Falha (código 1) se algum plano varrer uma
+tabela inteira ("SCAN <tabela>", com ou sem índice de cobertura).
+
+Consultas sem WHERE (analytics de todos os links em todo o período, a lista
+de links usada para mapear o snapshot colunar) leem a tabela inteira por
+definição e são apenas contadas.
+
+Uso:
+    python benchmarks/check_query_plans.py -v
+"""
+import os
+import re
+import sys
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+_SCAN = re.compile(r"^SCAN (\w+)")
+_WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+
+
+class CapturaConsultas:
+    """Guarda os SELECTs (com parâmetros) executados no engine enquanto ativa"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.consultas = {}
+        self.sem_filtro = set()
+        self.cenario = None
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, "before_cursor_execute", self._registrar)
+        return self
+
+    def __exit__(self, *args):
+        from sqlalchemy import event
+        event.remove(self.engine, "before_cursor_execute", self._registrar)
+
+    def _registrar(self, conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return
+        if not _WHERE.search(statement):
+            self.sem_filtro.add(statement)
+        elif statement not in self.consultas:
+            self.consultas[statement] = (self.cenario, parameters)
+
+
+def varreduras(conn, statement: str, parameters, tabelas: set) -> tuple:
+    """(linhas do plano que percorrem uma tabela inteira, plano completo)"""
+    plano = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    detalhes = [linha[3] for linha in plano]
+    return [d for d in detalhes if (m := _SCAN.match(d)) and m.group(1) in tabelas], detalhes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-v", "--verbose", action="store_true", help="Mostra o plano de todas as consultas")
+    args = parser.parse_args()
+
+    # Banco descartável: database.py usa sqlite:///./conteudooh.db relativo ao diretório atual
+    os.chdir(tempfile.mkdtemp(prefix="conteudooh-planos-"))
+
+    from database import Base, engine, SessionLocal
+    from models import Noticia
+    import analytics_service
+    from analytics_service import AnalyticsService
+    from export_service import ExportService
+    import click_snapshot
+    from timezone_utils import agora_brasil
+    from check_analytics import _semear, _semear_eventos
+
+    Base.metadata.create_all(bind=engine)
+    inicio = datetime(2025, 3, 1, 6, 30)
+    db = SessionLocal()
+    _semear(db, 40, 2000, inicio)
+    _semear_eventos(db, 400, inicio)
+    db.add_all(
+        Noticia(titulo=f"Notícia {i}", url=f"https://example.com/n/{i}",
+                data_publicacao=None if i % 3 == 0 else agora_brasil() - timedelta(days=i % 5))
+        for i in range(30)
+    )
+    db.commit()
+
+    periodo = {"start_date": "2025-03-03T10:20", "end_date": "2025-03-06"}
+    cenarios = {
+        "analytics por ponto": lambda: AnalyticsService.get_link_analytics(db, ponto_dooh="Ponto 1"),
+        "analytics por campanha": lambda: AnalyticsService.get_link_analytics(db, campanha="Campanha 2"),
+        "analytics por ponto e campanha": lambda: AnalyticsService.get_link_analytics(db, ponto_dooh="Ponto 1", campanha="Campanha 2"),
+        "analytics por link": lambda: AnalyticsService.get_link_analytics(db, link_id=3),
+        "analytics por período": lambda: AnalyticsService.get_link_analytics(db, **periodo),
+        "analytics por ponto e período": lambda: AnalyticsService.get_link_analytics(db, ponto_dooh="Ponto 1", **periodo),
+        "analytics por campanha e período": lambda: AnalyticsService.get_link_analytics(db, campanha="Campanha 2", **periodo),
+        "analytics por link e período": lambda: AnalyticsService.get_link_analytics(db, link_id=3, **periodo),
+        "analytics por período (HyperLogLog)": lambda: AnalyticsService.get_link_analytics(db, unique_ips_mode="approx", **periodo),
+        "analytics por campanha (HyperLogLog)": lambda: AnalyticsService.get_link_analytics(db, campanha="Campanha 2", unique_ips_mode="approx"),
+        "analytics por link e período (exato)": lambda: AnalyticsService.get_link_analytics(db, link_id=3, unique_ips_mode="exact", **periodo),
+        "analytics do link": lambda: AnalyticsService.get_link_specific_analytics(db, 3),
+        "analytics do link no período": lambda: AnalyticsService.get_link_specific_analytics(db, 3, **periodo),
+        "conversões por link": lambda: AnalyticsService.get_conversion_metrics(db, link_id=3),
+        "conversões por clique": lambda: AnalyticsService.get_conversion_metrics(db, click_id=1),
+        "conversões por período": lambda: AnalyticsService.get_conversion_metrics(db, **periodo),
+        "conversões por link e período": lambda: AnalyticsService.get_conversion_metrics(db, link_id=3, **periodo),
+        "heatmap por campanha e período": lambda: AnalyticsService.get_heatmap(db, campanha="Campanha 2", **periodo),
+        "heatmap por ponto": lambda: AnalyticsService.get_heatmap(db, ponto_dooh="Ponto 1"),
+        "heatmap por período": lambda: AnalyticsService.get_heatmap(db, **periodo),
+        "exportação de cliques por campanha e período": lambda: list(ExportService.clicks("csv", campanha="Campanha 2", **periodo)),
+        "exportação de cliques por link": lambda: list(ExportService.clicks("ndjson", link_id=3)),
+        "exportação de eventos por ponto e período": lambda: list(ExportService.events("csv", ponto_dooh="Ponto 1", **periodo)),
+        "notícias aleatórias (ativas e recentes)": lambda: db.query(Noticia).filter(
+            Noticia.ativa == True, Noticia.filtro_recente(agora_brasil() - timedelta(days=2))
+        ).all(),
+        "notícias recentes": lambda: db.query(Noticia).filter(
+            Noticia.filtro_recente(agora_brasil() - timedelta(days=2))
+        ).order_by(Noticia.data_criacao.desc()).all(),
+    }
+
+    with CapturaConsultas(engine) as captura:
+        for nome, executar in cenarios.items():
+            captura.cenario = nome
+            executar()
+
+        # Caminho do snapshot colunar: cauda lida dos rollups a partir do corte
+        captura.cenario = "exportação do snapshot"
+        metadata = click_snapshot.exportar(db, diretorio="snapshot", corte=datetime(2025, 3, 6, 13, 17))
+        click_snapshot.click_snapshot.diretorio = "snapshot"
+        click_snapshot.click_snapshot.reload(force=True)
+        analytics_service.CLICK_SNAPSHOT_MIN_DAYS = 0
+        for nome, filtros in {
+            "snapshot por ponto": {"ponto_dooh": "Ponto 1"},
+            "snapshot por campanha": {"campanha": "Campanha 2"},
+            "snapshot por período": {"start_date": "2025-03-02"},
+        }.items():
+            captura.cenario = nome
+            AnalyticsService.get_link_analytics(db, unique_ips_mode="approx", **filtros)
+    db.close()
+
+    tabelas = set(Base.metadata.tables)
+    ok = True
+    with engine.connect() as conn:
+        for statement, (cenario, parameters) in captura.consultas.items():
+            problemas, detalhes = varreduras(conn, statement, parameters, tabelas)
+            resumo = " ".join(statement.split())[:140]
+            if problemas:
+                ok = False
+                print(f"ERRO [{cenario}] {resumo}")
+                for d in detalhes:
+                    print(f"       {d}")
+            elif args.verbose:
+                print(f"OK   [{cenario}] {resumo}")
+                for d in detalhes:
+                    print(f"       {d}")
+
+    print(
+        f"{len(captura.consultas)} consultas verificadas em {len(cenarios) + 4} cenários "
+        f"({len(captura.sem_filtro)} sem WHERE ignoradas, snapshot {metadata['versao']})"
+    )
+    if not ok:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
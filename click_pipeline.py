@@ -0,0 +1,204 @@
+"""
+Pipeline de enriquecimento de cliques em background
+O redirect apenas captura o scan bruto e enfileira; parse de User-Agent e
+GeoIP rodam em workers fora do caminho da requisição, e a persistência fica
+a cargo do ClickWriter (gravação em lote)
+
+A gravação não depende do enriquecimento: com a fila acumulada os workers
+deixam de consultar o GeoIP, com a fila cheia o scan vai direto ao
+ClickWriter sem enriquecimento, e no encerramento o que restou na fila é
+gravado da mesma forma. Nenhum scan aceito é descartado.
+"""
+import os
+import queue
+import threading
+import time
+import logging
+from tracking_service import TrackingService, GEOIP_BACKEND
+from click_writer import click_writer
+
+logger = logging.getLogger(__name__)
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente)
+CLICK_PIPELINE_WORKERS = int(os.getenv("CLICK_PIPELINE_WORKERS", "2"))
+CLICK_PIPELINE_QUEUE_SIZE = int(os.getenv("CLICK_PIPELINE_QUEUE_SIZE", "10000"))
+# Scans na fila a partir dos quais o GeoIP remoto (ipapi) deixa de ser consultado
+CLICK_PIPELINE_GEOIP_BACKLOG = int(os.getenv("CLICK_PIPELINE_GEOIP_BACKLOG", "50"))
+
+# Marcador para encerrar os workers
+_STOP = object()
+
+
+class ClickPipeline:
+    """Fila limitada de scans com workers de enriquecimento"""
+
+    def __init__(self, workers: int = CLICK_PIPELINE_WORKERS, queue_size: int = CLICK_PIPELINE_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._pending = set()  # click_ids enfileirados e ainda não persistidos
+        self._em_processo = {}  # click_id -> scan retirado da fila por um worker
+        self._lock = threading.Lock()
+        self._encerrando = False
+        self.processed = 0
+        self.unenriched = 0  # gravados sem enriquecimento (fila cheia ou encerramento)
+        self.geoip_skipped = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self):
+        """Inicia os workers (idempotente)"""
+        if self.running:
+            return
+        self._encerrando = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"click-pipeline-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"[ClickPipeline] {self.workers} workers iniciados (fila máx. {self._queue.maxsize})")
+
+    def stop(self, timeout: float = 10.0):
+        """Grava o que restou na fila sem enriquecimento e encerra os workers"""
+        if not self._threads:
+            return
+        # Workers em andamento terminam sem GeoIP; a fila é drenada direto para o writer
+        self._encerrando = True
+        restantes = self._drenar_fila()
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+        # Scans que um worker não concluiu no prazo (ex.: preso no GeoIP) são gravados crus
+        with self._lock:
+            em_processo = list(self._em_processo.values())
+            self._em_processo.clear()
+        for scan in em_processo:
+            self._gravar_sem_enriquecimento(scan)
+        logger.info(
+            f"[ClickPipeline] Encerrado (processados={self.processed}, sem enriquecimento={self.unenriched}, "
+            f"drenados={restantes + len(em_processo)}, falhas={self.failed})"
+        )
+
+    def submit(self, scan: dict) -> bool:
+        """
+        Enfileira um scan capturado por TrackingService.capture_scan
+
+        Nunca bloqueia nem descarta: se a fila estiver cheia o scan é entregue
+        ao ClickWriter na hora, sem GeoIP (User-Agent só se já estiver em cache).
+        """
+        with self._lock:
+            self._pending.add(scan["click_id"])
+        try:
+            self._queue.put_nowait(scan)
+            return True
+        except queue.Full:
+            logger.warning(f"[ClickPipeline] Fila cheia, scan gravado sem enriquecimento: link_id={scan['link_id']}")
+            return self._gravar_sem_enriquecimento(scan)
+
+    def _drenar_fila(self) -> int:
+        """Grava sem enriquecimento os scans ainda na fila"""
+        total = 0
+        while True:
+            try:
+                scan = self._queue.get_nowait()
+            except queue.Empty:
+                return total
+            try:
+                if scan is not _STOP:
+                    self._gravar_sem_enriquecimento(scan)
+                    total += 1
+            finally:
+                self._queue.task_done()
+
+    def _gravar_sem_enriquecimento(self, scan: dict) -> bool:
+        try:
+            click_writer.add(TrackingService.build_raw_click_row(scan), bloquear=False)
+            with self._lock:
+                self.unenriched += 1
+            return True
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error(f"[ClickPipeline] Erro ao gravar clique {scan['click_id']}: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._pending.discard(scan["click_id"])
+
+    def is_pending(self, click_id: int) -> bool:
+        """Indica se o clique foi aceito mas ainda não chegou ao banco"""
+        with self._lock:
+            if click_id in self._pending:
+                return True
+        return click_writer.is_pending(click_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": len(self._threads),
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "pending": len(self._pending),
+                "processed": self.processed,
+                "unenriched": self.unenriched,
+                "geoip_skipped": self.geoip_skipped,
+                "failed": self.failed
+            }
+
+    def _worker(self):
+        while True:
+            scan = self._queue.get()
+            try:
+                if scan is _STOP:
+                    return
+                self._process(scan)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, scan: dict):
+        click_id = scan["click_id"]
+        with self._lock:
+            self._em_processo[click_id] = scan
+        try:
+            # GeoIP remoto é o gargalo (até 3 s por scan): com fila acumulada grava só com o User-Agent
+            geoip = not self._encerrando and (
+                GEOIP_BACKEND == "local" or self._queue.qsize() < CLICK_PIPELINE_GEOIP_BACKLOG
+            )
+            row = TrackingService.build_click_row(scan, geoip=geoip)
+        except Exception as e:
+            logger.error(f"[ClickPipeline] Erro ao enriquecer clique {click_id}: {e}")
+            row = None
+
+        with self._lock:
+            # Encerramento já gravou este scan (worker passou do prazo do stop)
+            if self._em_processo.pop(click_id, None) is None:
+                return
+            if row is not None and not geoip:
+                self.geoip_skipped += 1
+        if row is None:
+            self._gravar_sem_enriquecimento(scan)
+            return
+        try:
+            # Entregar ao writer antes de sair de _pending (is_pending sem lacunas)
+            click_writer.add(row)
+            with self._lock:
+                self.processed += 1
+            logger.debug(f"Clique enfileirado para gravação: link_id={scan['link_id']}, device={row['device_type']}, click_id={click_id}")
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error(f"[ClickPipeline] Erro ao gravar clique {click_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(click_id)
+
+
+# Instância global usada pela aplicação
+click_pipeline = ClickPipeline()
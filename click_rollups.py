@@ -0,0 +1,176 @@
+"""
+Rollups horários de cliques
+Mantém a tabela click_rollup_hora (cliques por link, hora, dispositivo e país)
+e os sketches diários de IPs (click_ip_sketch_dia) para que o analytics não
+precise varrer a tabela clicks inteira.
+
+Reconstrução a partir dos cliques existentes:
+    python click_rollups.py --rebuild
+"""
+import logging
+import argparse
+from datetime import datetime, date
+from sqlalchemy import func, select, delete, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import Click, ClickRollupHora, ClickIpSketchDia
+from hyperloglog import HyperLogLog
+from timezone_utils import converter_para_brasil
+
+logger = logging.getLogger(__name__)
+
+# Formato de DateTime do SQLAlchemy no SQLite, truncado na hora
+_FORMATO_HORA_SQLITE = "%Y-%m-%d %H:00:00.000000"
+
+
+def hora_do_clique(clicked_at: datetime) -> datetime:
+    """Início da hora do clique no horário de Brasília (sem tzinfo, como é gravado)"""
+    if clicked_at.tzinfo:
+        clicked_at = converter_para_brasil(clicked_at).replace(tzinfo=None)
+    return clicked_at.replace(minute=0, second=0, microsecond=0)
+
+
+def _ou_unknown(valor: str) -> str:
+    return valor or "unknown"
+
+
+def registrar(db: Session, rows: list):
+    """
+    Soma os cliques informados (dicts com as colunas de Click) aos rollups
+
+    Não faz commit: deve rodar na mesma transação do INSERT dos cliques.
+    """
+    contagem = {}
+    ips_por_dia = {}
+    for row in rows:
+        if not row.get("clicked_at"):
+            continue
+        hora = hora_do_clique(row["clicked_at"])
+        chave = (row["link_id"], hora, _ou_unknown(row.get("device_type")), _ou_unknown(row.get("country")))
+        contagem[chave] = contagem.get(chave, 0) + 1
+        if row.get("ip_address"):
+            ips_por_dia.setdefault((row["link_id"], hora.date()), []).append(row["ip_address"])
+    if not contagem:
+        return
+
+    stmt = sqlite_insert(ClickRollupHora)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["link_id", "hora", "device_type", "country"],
+        set_={"clicks": ClickRollupHora.clicks + stmt.excluded.clicks}
+    )
+    db.execute(stmt, [
+        {"link_id": link_id, "hora": hora, "device_type": device, "country": country, "clicks": total}
+        for (link_id, hora, device, country), total in contagem.items()
+    ])
+    if ips_por_dia:
+        _registrar_ips(db, ips_por_dia)
+
+
+def _registrar_ips(db: Session, ips_por_dia: dict):
+    """Acrescenta os IPs aos sketches diários (lê os sketches existentes e grava a mescla)"""
+    existentes = dict(
+        ((link_id, dia), sketch) for link_id, dia, sketch in
+        db.query(ClickIpSketchDia.link_id, ClickIpSketchDia.dia, ClickIpSketchDia.sketch)
+        .filter(tuple_(ClickIpSketchDia.link_id, ClickIpSketchDia.dia).in_(list(ips_por_dia)))
+        .all()
+    )
+    valores = []
+    for (link_id, dia), ips in ips_por_dia.items():
+        sketch = HyperLogLog.from_bytes(existentes[(link_id, dia)]) if (link_id, dia) in existentes else HyperLogLog()
+        sketch.update(ips)
+        valores.append({"link_id": link_id, "dia": dia, "sketch": sketch.to_bytes()})
+
+    stmt = sqlite_insert(ClickIpSketchDia)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["link_id", "dia"],
+        set_={"sketch": stmt.excluded.sketch}
+    )
+    db.execute(stmt, valores)
+
+
+def reconstruir(db: Session) -> int:
+    """Recalcula todos os rollups e sketches a partir da tabela clicks (retorna a quantidade de linhas de rollup)"""
+    hora = func.strftime(_FORMATO_HORA_SQLITE, Click.clicked_at)
+    device = func.coalesce(func.nullif(Click.device_type, ""), "unknown")
+    country = func.coalesce(func.nullif(Click.country, ""), "unknown")
+    agregacao = (
+        select(Click.link_id, hora, device, country, func.count(Click.id))
+        .where(Click.clicked_at.isnot(None))
+        .group_by(Click.link_id, hora, device, country)
+    )
+
+    db.execute(delete(ClickRollupHora))
+    db.execute(
+        ClickRollupHora.__table__.insert().from_select(
+            ["link_id", "hora", "device_type", "country", "clicks"], agregacao
+        )
+    )
+    _reconstruir_sketches(db)
+    db.commit()
+    return db.query(func.count()).select_from(ClickRollupHora).scalar() or 0
+
+
+def _reconstruir_sketches(db: Session, lote: int = 500):
+    """Recalcula os sketches diários percorrendo os cliques em ordem de (link, dia): um sketch em memória por vez"""
+    db.execute(delete(ClickIpSketchDia))
+    dia = func.date(Click.clicked_at)
+    linhas = db.execute(
+        select(Click.link_id, dia, Click.ip_address)
+        .where(Click.clicked_at.isnot(None), func.coalesce(Click.ip_address, "") != "")
+        .order_by(Click.link_id, dia)
+        .execution_options(yield_per=5000)
+    )
+
+    pendentes = []
+    chave_atual, sketch = None, None
+    for link_id, dia_clique, ip in linhas:
+        chave = (link_id, dia_clique)
+        if chave != chave_atual:
+            if sketch is not None:
+                pendentes.append(_linha_sketch(chave_atual, sketch))
+            chave_atual, sketch = chave, HyperLogLog()
+        sketch.add(ip)
+        if len(pendentes) >= lote:
+            db.execute(ClickIpSketchDia.__table__.insert(), pendentes)
+            pendentes = []
+    if sketch is not None:
+        pendentes.append(_linha_sketch(chave_atual, sketch))
+    if pendentes:
+        db.execute(ClickIpSketchDia.__table__.insert(), pendentes)
+
+
+def _linha_sketch(chave: tuple, sketch: HyperLogLog) -> dict:
+    link_id, dia = chave
+    return {"link_id": link_id, "dia": date.fromisoformat(dia), "sketch": sketch.to_bytes()}
+
+
+def preencher_se_vazio(db: Session) -> int:
+    """Reconstrói rollups e sketches quando estão vazios e já existem cliques (bancos anteriores a eles)"""
+    if db.query(Click.id).first() is None:
+        return 0
+    sem_rollups = db.query(ClickRollupHora.link_id).first() is None
+    sem_sketches = (
+        db.query(ClickIpSketchDia.link_id).first() is None
+        and db.query(Click.id).filter(func.coalesce(Click.ip_address, "") != "").first() is not None
+    )
+    if not sem_rollups and not sem_sketches:
+        return 0
+    return reconstruir(db)
+
+
+if __name__ == "__main__":
+    from database import Base, engine, SessionLocal
+
+    parser = argparse.ArgumentParser(description="Manutenção dos rollups horários de cliques")
+    parser.add_argument("--rebuild", action="store_true", help="Recalcula rollups e sketches a partir da tabela clicks")
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+    else:
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        try:
+            print(f"Rollups reconstruídos: {reconstruir(db)} linhas")
+        finally:
+            db.close()
@@ -0,0 +1,336 @@
+"""
+Snapshot colunar de cliques para relatórios de períodos longos
+Exporta periodicamente a tabela clicks para arrays NumPy em disco (uma coluna
+por arquivo .npy, ordenadas por clicked_at) e os consulta via memory-map com
+agrupamentos vetorizados. Colunas:
+
+- ts: int64, epoch em segundos
+- link_id: int32
+- device_type, country, browser: códigos inteiros de dicionário (metadata.json)
+
+O snapshot cobre os cliques anteriores ao corte gravado em metadata.json;
+o que veio depois é lido do SQLite (rollups) pelo AnalyticsService.
+
+A exportação lê a tabela em páginas por id (keyset), cada uma em uma
+transação curta: o lock de leitura do SQLite não fica preso durante a
+exportação inteira e o ClickWriter continua gravando entre as páginas.
+
+Exportação manual:
+    python click_snapshot.py --export
+"""
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, date
+from typing import Optional
+import numpy as np
+from sqlalchemy import func, select, cast, Integer
+from sqlalchemy.orm import Session
+from models import Click
+from timezone_utils import agora_brasil
+
+logger = logging.getLogger(__name__)
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente)
+CLICK_SNAPSHOT_DIR = os.getenv("CLICK_SNAPSHOT_DIR", os.path.join("snapshots", "clicks"))
+CLICK_SNAPSHOT_INTERVAL_MIN = int(os.getenv("CLICK_SNAPSHOT_INTERVAL_MIN", "60"))  # 0 desativa a exportação periódica
+CLICK_SNAPSHOT_STARTUP_DELAY_S = int(os.getenv("CLICK_SNAPSHOT_STARTUP_DELAY_S", "600"))  # primeira exportação sem snapshot em disco
+CLICK_SNAPSHOT_LAG_S = int(os.getenv("CLICK_SNAPSHOT_LAG_S", "300"))  # cliques mais recentes que isso ficam fora do snapshot
+CLICK_SNAPSHOT_MIN_DAYS = int(os.getenv("CLICK_SNAPSHOT_MIN_DAYS", "31"))  # períodos a partir deste tamanho usam o snapshot
+CLICK_SNAPSHOT_RELOAD_INTERVAL = int(os.getenv("CLICK_SNAPSHOT_RELOAD_INTERVAL", "60"))  # segundos entre checagens do disco
+CLICK_SNAPSHOT_PAGE_SIZE = int(os.getenv("CLICK_SNAPSHOT_PAGE_SIZE", "20000"))  # linhas por página (transação) da exportação
+
+# clicked_at é gravado no horário de Brasília (UTC-03:00) sem offset
+_OFFSET_BRASIL_S = 3 * 3600
+_EPOCA = datetime(1970, 1, 1)
+_DIA_EPOCA = date(1970, 1, 1)
+
+COLUNAS_CATEGORICAS = ("device_type", "country", "browser")
+_ARQUIVO_ATUAL = "atual.json"
+
+
+def para_epoch(dt: datetime) -> int:
+    """datetime no horário de Brasília (sem tzinfo) -> epoch em segundos"""
+    return int((dt - _EPOCA).total_seconds()) + _OFFSET_BRASIL_S
+
+
+def _menor_dtype(maximo: int):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if maximo <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def exportar(db: Session, diretorio: str = CLICK_SNAPSHOT_DIR, corte: Optional[datetime] = None,
+             lote: int = CLICK_SNAPSHOT_PAGE_SIZE) -> dict:
+    """
+    Exporta os cliques anteriores ao corte para uma nova versão do snapshot
+
+    O corte padrão é a hora cheia anterior a (agora - CLICK_SNAPSHOT_LAG_S),
+    para que a cauda lida do SQLite comece em uma hora inteira dos rollups.
+    A versão nova só passa a valer quando atual.json é substituído.
+
+    Cada página de `lote` linhas é lida em uma transação própria (encerrada
+    com db.rollback()); as linhas vêm em ordem de id e são ordenadas por
+    clicked_at no final, já em arrays.
+    """
+    if corte is None:
+        corte = agora_brasil().replace(tzinfo=None) - timedelta(seconds=CLICK_SNAPSHOT_LAG_S)
+        corte = corte.replace(minute=0, second=0, microsecond=0)
+
+    inicio = time.perf_counter()
+    os.makedirs(diretorio, exist_ok=True)
+    versao = f"v{int(time.time() * 1000)}"
+    destino = os.path.join(diretorio, versao)
+    os.makedirs(destino)
+
+    normalizadas = [func.coalesce(func.nullif(getattr(Click, nome), ""), "unknown") for nome in COLUNAS_CATEGORICAS]
+    consulta = (
+        select(
+            Click.id,
+            cast(func.strftime("%s", Click.clicked_at), Integer) + _OFFSET_BRASIL_S,
+            Click.link_id,
+            *normalizadas
+        )
+        .where(Click.clicked_at.isnot(None), Click.clicked_at < corte)
+        .order_by(Click.id)
+        .limit(lote)
+    )
+
+    dicionarios = {nome: {} for nome in COLUNAS_CATEGORICAS}
+    partes = {nome: [] for nome in ("ts", "link_id") + COLUNAS_CATEGORICAS}
+    ultimo_id = 0
+    while True:
+        try:
+            bloco = db.execute(consulta.where(Click.id > ultimo_id)).all()
+        finally:
+            # Fecha a transação de leitura: libera o lock entre as páginas
+            db.rollback()
+        if not bloco:
+            break
+        ultimo_id = bloco[-1][0]
+        colunas = list(zip(*bloco))
+        partes["ts"].append(np.array(colunas[1], dtype=np.int64))
+        partes["link_id"].append(np.array(colunas[2], dtype=np.int32))
+        for nome, valores in zip(COLUNAS_CATEGORICAS, colunas[3:]):
+            dicionario = dicionarios[nome]
+            partes[nome].append(np.array([dicionario.setdefault(v, len(dicionario)) for v in valores], dtype=np.uint32))
+        if len(bloco) < lote:
+            break
+
+    # Ordem por id não garante ordem por clicked_at: ordenar todas as colunas por ts
+    ordem = np.argsort(np.concatenate(partes["ts"]), kind="stable") if partes["ts"] else None
+
+    total = 0
+    for nome, blocos in partes.items():
+        if nome in ("ts", "link_id"):
+            dtype = np.int64 if nome == "ts" else np.int32
+        else:
+            dtype = _menor_dtype(max(len(dicionarios[nome]) - 1, 0))
+        coluna = np.concatenate(blocos)[ordem].astype(dtype, copy=False) if blocos else np.empty(0, dtype=dtype)
+        total = len(coluna)
+        np.save(os.path.join(destino, f"{nome}.npy"), coluna)
+
+    metadata = {
+        "versao": versao,
+        "linhas": total,
+        "corte": corte.isoformat(),
+        "gerado_em": agora_brasil().isoformat(),
+        "dicionarios": {nome: list(d) for nome, d in dicionarios.items()}
+    }
+    with open(os.path.join(destino, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False)
+
+    # Troca atômica da versão vigente
+    temporario = os.path.join(diretorio, _ARQUIVO_ATUAL + ".tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump({"versao": versao}, f)
+    os.replace(temporario, os.path.join(diretorio, _ARQUIVO_ATUAL))
+    _remover_versoes_antigas(diretorio, manter=versao)
+
+    logger.info(f"[Snapshot] {total} cliques exportados até {corte} em {time.perf_counter() - inicio:.1f} s")
+    return metadata
+
+
+def _remover_versoes_antigas(diretorio: str, manter: str, quantidade: int = 2):
+    """Mantém a versão vigente e a anterior (que ainda pode estar mapeada em memória)"""
+    versoes = sorted(
+        (n for n in os.listdir(diretorio) if n.startswith("v") and os.path.isdir(os.path.join(diretorio, n))),
+        reverse=True
+    )
+    for nome in versoes[quantidade:]:
+        if nome != manter:
+            shutil.rmtree(os.path.join(diretorio, nome), ignore_errors=True)
+
+
+class ClickSnapshot:
+    """Versão do snapshot mapeada em memória"""
+
+    def __init__(self, caminho: str):
+        with open(os.path.join(caminho, "metadata.json"), encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.versao = self.metadata["versao"]
+        self.corte = datetime.fromisoformat(self.metadata["corte"])
+        self.dicionarios = self.metadata["dicionarios"]
+        self.colunas = {
+            nome: np.load(os.path.join(caminho, f"{nome}.npy"), mmap_mode="r")
+            for nome in ("ts", "link_id") + COLUNAS_CATEGORICAS
+        }
+
+    def __len__(self):
+        return len(self.colunas["ts"])
+
+    def contar(self, inicio: Optional[datetime], fim: Optional[datetime], links: set,
+               dimensoes: tuple = ("device", "country", "dia")) -> dict:
+        """
+        Contagens dos cliques em [inicio, min(fim, corte)) dos links informados
+
+        Retorna {"total": n, "link": {...}} mais as dimensões pedidas, entre
+        "device", "country", "dia" (YYYY-MM-DD) e "hora_semana" ("<%w>-<%H>",
+        mesmo formato do strftime do SQLite; 0 = domingo)
+        """
+        ts = self.colunas["ts"]
+        fim = self.corte if fim is None else min(fim, self.corte)
+        a = 0 if inicio is None else int(np.searchsorted(ts, para_epoch(inicio), "left"))
+        b = int(np.searchsorted(ts, para_epoch(fim), "left"))
+        vazio = {"total": 0, "link": {}, **{dimensao: {} for dimensao in dimensoes}}
+        if b <= a or not links:
+            return vazio
+
+        link_id = np.asarray(self.colunas["link_id"][a:b])
+        permitidos = np.zeros(max(int(link_id.max()), max(links)) + 1, dtype=bool)
+        permitidos[list(links)] = True
+        mascara = permitidos[link_id]
+        total = int(np.count_nonzero(mascara))
+        if not total:
+            return vazio
+        completo = total == len(mascara)
+
+        def selecionar(coluna):
+            valores = np.asarray(coluna[a:b])
+            return valores if completo else valores[mascara]
+
+        por_link = np.bincount(link_id if completo else link_id[mascara])
+        resultado = {"total": total, "link": {int(i): int(c) for i, c in enumerate(por_link) if c}}
+
+        for nome, chave in (("device_type", "device"), ("country", "country")):
+            if chave not in dimensoes:
+                continue
+            valores = self.dicionarios[nome]
+            contagem = np.bincount(selecionar(self.colunas[nome]), minlength=len(valores))
+            resultado[chave] = {valores[i]: int(c) for i, c in enumerate(contagem) if c}
+
+        if "dia" not in dimensoes and "hora_semana" not in dimensoes:
+            return resultado
+        local = selecionar(ts) - _OFFSET_BRASIL_S
+
+        if "dia" in dimensoes:
+            # Dia local; ts está ordenado, então os dias também estão
+            dias = local // 86400
+            primeiro = int(dias[0])
+            contagem = np.bincount(dias - primeiro)
+            resultado["dia"] = {
+                (_DIA_EPOCA + timedelta(days=primeiro + i)).isoformat(): int(c)
+                for i, c in enumerate(contagem) if c
+            }
+
+        if "hora_semana" in dimensoes:
+            # 01/01/1970 foi uma quinta-feira (%w = 4)
+            celula = ((local // 86400 + 4) % 7) * 24 + (local // 3600) % 24
+            contagem = np.bincount(celula, minlength=7 * 24)
+            resultado["hora_semana"] = {
+                f"{i // 24}-{i % 24:02d}": int(c) for i, c in enumerate(contagem) if c
+            }
+        return resultado
+
+
+class ClickSnapshotStore:
+    """Snapshot vigente, recarregado quando atual.json muda"""
+
+    def __init__(self, diretorio: str = CLICK_SNAPSHOT_DIR, reload_interval: int = CLICK_SNAPSHOT_RELOAD_INTERVAL):
+        self.diretorio = diretorio
+        self.reload_interval = reload_interval
+        self._snapshot = None
+        self._mtime = None
+        self._ultima_checagem = 0.0
+        self._lock = threading.Lock()
+        self.consultas = 0
+
+    def atual(self) -> Optional[ClickSnapshot]:
+        if self._mtime is None or time.monotonic() - self._ultima_checagem >= self.reload_interval:
+            self.reload()
+        return self._snapshot
+
+    def reload(self, force: bool = False) -> bool:
+        with self._lock:
+            self._ultima_checagem = time.monotonic()
+            arquivo = os.path.join(self.diretorio, _ARQUIVO_ATUAL)
+            try:
+                mtime = os.path.getmtime(arquivo)
+            except OSError:
+                self._mtime = -1
+                return False
+            if not force and mtime == self._mtime:
+                return False
+            try:
+                with open(arquivo, encoding="utf-8") as f:
+                    versao = json.load(f)["versao"]
+                snapshot = ClickSnapshot(os.path.join(self.diretorio, versao))
+            except Exception as e:
+                logger.error(f"[Snapshot] Erro ao carregar snapshot de {self.diretorio}: {e}")
+                return False
+            self._snapshot = snapshot
+            self._mtime = mtime
+            logger.info(f"[Snapshot] Versão {snapshot.versao} carregada ({len(snapshot)} cliques até {snapshot.corte})")
+            return True
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "versao": snapshot.versao if snapshot is not None else None,
+            "linhas": len(snapshot) if snapshot is not None else 0,
+            "corte": snapshot.corte.isoformat() if snapshot is not None else None,
+            "consultas": self.consultas
+        }
+
+
+def exportar_periodicamente():
+    """Job do scheduler: exporta um snapshot novo e o carrega"""
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        exportar(db)
+        click_snapshot.reload()
+    except Exception as e:
+        logger.error(f"[Snapshot] Erro ao exportar cliques: {e}")
+    finally:
+        db.close()
+
+
+# Instância global usada pelo AnalyticsService
+click_snapshot = ClickSnapshotStore()
+
+
+if __name__ == "__main__":
+    from database import Base, engine, SessionLocal
+
+    parser = argparse.ArgumentParser(description="Snapshot colunar de cliques")
+    parser.add_argument("--export", action="store_true", help="Exporta um snapshot novo da tabela clicks")
+    args = parser.parse_args()
+
+    if not args.export:
+        parser.print_help()
+    else:
+        logging.basicConfig(level=logging.INFO)
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        try:
+            metadata = exportar(db)
+            print(f"Snapshot {metadata['versao']}: {metadata['linhas']} cliques até {metadata['corte']}")
+        finally:
+            db.close()
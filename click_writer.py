@@ -0,0 +1,325 @@
+"""
+Gravação de cliques em lote (group commit)
+Acumula registros de clique e grava com um único INSERT multi-linha por
+transação quando o lote atinge N linhas ou o clique mais antigo espera T ms.
+Incrementos de repeat_count (scans repetidos) e os rollups horários
+(click_rollups.py) são gravados na mesma transação.
+
+Um lote que falha não é descartado: volta ao buffer e é regravado com
+backoff; se continuar falhando, as linhas são gravadas uma a uma para que
+uma linha inválida não derrube o lote inteiro.
+"""
+import os
+import time
+import threading
+import logging
+from sqlalchemy import insert, update, bindparam
+from database import SessionLocal
+from models import Click
+import click_rollups
+
+logger = logging.getLogger(__name__)
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente)
+CLICK_WRITER_BATCH_SIZE = int(os.getenv("CLICK_WRITER_BATCH_SIZE", "200"))
+CLICK_WRITER_FLUSH_MS = int(os.getenv("CLICK_WRITER_FLUSH_MS", "250"))
+CLICK_WRITER_MAX_BUFFER = int(os.getenv("CLICK_WRITER_MAX_BUFFER", "20000"))
+# Tempo máximo para aguardar a linha original de um incremento de repeat_count
+CLICK_WRITER_REPEAT_RETRY_S = int(os.getenv("CLICK_WRITER_REPEAT_RETRY_S", "120"))
+# Lote que falhou (ex.: "database is locked") volta ao buffer e é regravado com backoff
+# exponencial; esgotadas as tentativas, é gravado linha a linha
+CLICK_WRITER_MAX_RETRIES = int(os.getenv("CLICK_WRITER_MAX_RETRIES", "5"))
+CLICK_WRITER_RETRY_BACKOFF_MS = int(os.getenv("CLICK_WRITER_RETRY_BACKOFF_MS", "100"))
+CLICK_WRITER_RETRY_BACKOFF_MAX_MS = int(os.getenv("CLICK_WRITER_RETRY_BACKOFF_MAX_MS", "5000"))
+
+_INCREMENTAR_REPETICOES = (
+    update(Click)
+    .where(Click.id == bindparam("click_id"))
+    .values(repeat_count=Click.repeat_count + bindparam("incremento"))
+)
+
+
+class ClickWriter:
+    """Buffer de cliques com thread de flush em lote"""
+
+    def __init__(self, batch_size: int = CLICK_WRITER_BATCH_SIZE, flush_interval_ms: int = CLICK_WRITER_FLUSH_MS,
+                 max_buffer: int = CLICK_WRITER_MAX_BUFFER):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000.0
+        self.max_buffer = max(self.batch_size, max_buffer)
+        self._buffer = []
+        self._por_id = {}  # id -> linha ainda no buffer
+        self._repeats = {}  # click_id -> [incremento, instante do primeiro]
+        self._oldest = None  # instante em que o item mais antigo do buffer chegou
+        self._pending = set()  # ids no buffer ou em gravação
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._falhas_seguidas = 0  # lotes seguidos que falharam
+        self._retry_em = None  # instante da próxima tentativa após falha
+        # Métricas
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.retries = 0
+        self.row_fallbacks = 0
+        self.repeats_applied = 0
+        self.repeats_dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        """Inicia a thread de flush (idempotente)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="click-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"[ClickWriter] Iniciado (lote={self.batch_size}, intervalo={self.flush_interval * 1000:.0f} ms)")
+
+    def stop(self, timeout: float = 10.0):
+        """Para a thread e grava o que restou no buffer"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+        logger.info(f"[ClickWriter] Encerrado (gravados={self.rows_written}, falhas={self.rows_failed})")
+
+    def add(self, row: dict, bloquear: bool = True):
+        """
+        Adiciona um clique (dict com as colunas de Click) ao buffer
+
+        Bloqueia quando o buffer está cheio, aplicando backpressure nos workers do pipeline.
+        Com bloquear=False (scans gravados direto pelo redirect ou no encerramento)
+        a linha entra mesmo acima do limite: o clique não pode ser perdido.
+        """
+        with self._cond:
+            while bloquear and len(self._buffer) >= self.max_buffer and not self._stopping:
+                self._cond.wait()
+            primeiro = not self._buffer and not self._repeats
+            if primeiro:
+                self._oldest = time.monotonic()
+            # Repetições que chegaram antes da linha original
+            repeticao = self._repeats.pop(row["id"], None)
+            if repeticao:
+                row["repeat_count"] = row.get("repeat_count", 0) + repeticao[0]
+            self._buffer.append(row)
+            self._por_id[row["id"]] = row
+            self._pending.add(row["id"])
+            # Acordar a thread de flush para armar o timer ou gravar o lote cheio
+            if primeiro or len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+
+    def add_repeat(self, click_id: int, incremento: int = 1):
+        """Registra um scan repetido (repeat_count += incremento) para o clique informado"""
+        with self._cond:
+            row = self._por_id.get(click_id)
+            if row is not None:
+                row["repeat_count"] = row.get("repeat_count", 0) + incremento
+                return
+            if not self._buffer and not self._repeats:
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+            repeticao = self._repeats.setdefault(click_id, [0, time.monotonic()])
+            repeticao[0] += incremento
+
+    def is_pending(self, click_id: int) -> bool:
+        with self._cond:
+            return click_id in self._pending
+
+    def flush(self):
+        """Grava imediatamente tudo que está no buffer (em lotes de batch_size)"""
+        while True:
+            with self._cond:
+                rows, repeats = self._take()
+            if not rows and not repeats:
+                return
+            # Sem devolver ao buffer (encerramento): lote que falhar vai direto para linha a linha
+            self._write(rows, repeats, devolver=False)
+            if not rows:
+                # Só restavam incrementos; os que aguardam a linha original ficam para o próximo flush
+                return
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queue_depth": len(self._buffer),
+                "batch_size": self.batch_size,
+                "flush_interval_ms": int(self.flush_interval * 1000),
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "rows_failed": self.rows_failed,
+                "retries": self.retries,
+                "row_fallbacks": self.row_fallbacks,
+                "repeats_pending": len(self._repeats),
+                "repeats_applied": self.repeats_applied,
+                "repeats_dropped": self.repeats_dropped,
+                "last_flush_ms": round(self.last_flush_ms, 2),
+                "avg_flush_ms": round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+                "max_flush_ms": round(self.max_flush_ms, 2)
+            }
+
+    def _take(self):
+        """Retira do buffer o próximo lote e os incrementos pendentes (chamar com _cond adquirido)"""
+        rows = self._buffer[:self.batch_size]
+        self._buffer = self._buffer[self.batch_size:]
+        for row in rows:
+            self._por_id.pop(row["id"], None)
+        repeats, self._repeats = self._repeats, {}
+        self._oldest = time.monotonic() if self._buffer else None
+        self._cond.notify_all()
+        return rows, repeats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    # Backoff após um lote que falhou
+                    if self._retry_em is not None:
+                        restante = self._retry_em - time.monotonic()
+                        if restante > 0:
+                            self._cond.wait(restante)
+                            continue
+                    if len(self._buffer) >= self.batch_size:
+                        break
+                    if self._oldest is not None:
+                        restante = self._oldest + self.flush_interval - time.monotonic()
+                        if restante <= 0:
+                            break
+                        self._cond.wait(restante)
+                    else:
+                        self._cond.wait()
+                if self._stopping:
+                    return
+                rows, repeats = self._take()
+            if rows or repeats:
+                self._write(rows, repeats)
+
+    def _gravar(self, db, rows: list, repeats: dict) -> dict:
+        """INSERT das linhas, rollups e incrementos na transação de db; retorna os incrementos sem linha original"""
+        if rows:
+            db.execute(insert(Click), rows)
+            click_rollups.registrar(db, rows)
+        aguardando = {}
+        if repeats:
+            existentes = {
+                click_id for (click_id,) in
+                db.query(Click.id).filter(Click.id.in_(list(repeats))).all()
+            }
+            params = [
+                {"click_id": click_id, "incremento": repeticao[0]}
+                for click_id, repeticao in repeats.items() if click_id in existentes
+            ]
+            if params:
+                db.connection().execute(_INCREMENTAR_REPETICOES, params)
+            # Linha original ainda no pipeline: tentar de novo no próximo flush
+            aguardando = {k: v for k, v in repeats.items() if k not in existentes}
+        db.commit()
+        return aguardando
+
+    def _gravar_transacao(self, rows: list, repeats: dict):
+        """(incrementos sem linha original, erro ou None) de uma transação própria"""
+        db = SessionLocal()
+        try:
+            return self._gravar(db, rows, repeats), None
+        except Exception as e:
+            db.rollback()
+            return {}, e
+        finally:
+            db.close()
+
+    def _gravar_por_linha(self, rows: list) -> list:
+        """Grava cada linha em sua própria transação; retorna as que falharam"""
+        falhas = []
+        for row in rows:
+            _, erro = self._gravar_transacao([row], {})
+            if erro is not None:
+                falhas.append(row)
+                logger.error(f"[ClickWriter] Erro ao gravar clique {row['id']}: {erro}")
+        return falhas
+
+    def _write(self, rows: list, repeats: dict, devolver: bool = True):
+        # Um flush por vez: mantém a ordem dos lotes e evita disputa de lock no SQLite
+        falhas = []
+        repeticoes_perdidas = 0
+        with self._write_lock:
+            inicio = time.perf_counter()
+            aguardando, erro = self._gravar_transacao(rows, repeats)
+            if erro is not None:
+                if devolver and self._falhas_seguidas < CLICK_WRITER_MAX_RETRIES:
+                    self._devolver(rows, repeats, erro)
+                    return
+                # Tentativas esgotadas: uma linha ruim não pode derrubar o lote
+                logger.error(f"[ClickWriter] Lote de {len(rows)} cliques falhou ({erro}); gravando linha a linha")
+                falhas = self._gravar_por_linha(rows)
+                if repeats:
+                    aguardando, erro_repeticoes = self._gravar_transacao([], repeats)
+                    if erro_repeticoes is not None:
+                        logger.error(f"[ClickWriter] Erro ao gravar incrementos de repeat_count: {erro_repeticoes}")
+                        repeticoes_perdidas = sum(r[0] for r in repeats.values())
+            duracao_ms = (time.perf_counter() - inicio) * 1000
+
+        with self._cond:
+            for row in rows:
+                self._pending.discard(row["id"])
+            self.flushes += 1
+            self.last_flush_ms = duracao_ms
+            self.max_flush_ms = max(self.max_flush_ms, duracao_ms)
+            self._total_flush_ms += duracao_ms
+            if erro is not None:
+                self.row_fallbacks += 1
+            self.rows_written += len(rows) - len(falhas)
+            self.rows_failed += len(falhas)
+            self.repeats_dropped += repeticoes_perdidas
+            if not repeticoes_perdidas:
+                self.repeats_applied += sum(r[0] for r in repeats.values()) - sum(r[0] for r in aguardando.values())
+            # Próximo lote recomeça com todas as tentativas
+            self._falhas_seguidas = 0
+            self._retry_em = None
+            self._reagendar_repeticoes(aguardando)
+
+    def _devolver(self, rows: list, repeats: dict, erro: Exception):
+        """Recoloca um lote que falhou no início do buffer e agenda a próxima tentativa"""
+        with self._cond:
+            self._falhas_seguidas += 1
+            self.retries += 1
+            espera_ms = min(
+                CLICK_WRITER_RETRY_BACKOFF_MS * 2 ** (self._falhas_seguidas - 1),
+                CLICK_WRITER_RETRY_BACKOFF_MAX_MS
+            )
+            self._retry_em = time.monotonic() + espera_ms / 1000.0
+            self._buffer = rows + self._buffer
+            for row in rows:
+                self._por_id[row["id"]] = row
+            self._reagendar_repeticoes(repeats)
+            self._oldest = time.monotonic()
+            self._cond.notify_all()
+        logger.warning(
+            f"[ClickWriter] Erro ao gravar lote de {len(rows)} cliques ({erro}); "
+            f"tentativa {self._falhas_seguidas}/{CLICK_WRITER_MAX_RETRIES} em {espera_ms} ms"
+        )
+
+    def _reagendar_repeticoes(self, repeticoes: dict):
+        """Devolve incrementos ainda não aplicados (chamar com _cond adquirido)"""
+        agora = time.monotonic()
+        for click_id, repeticao in repeticoes.items():
+            if agora - repeticao[1] > CLICK_WRITER_REPEAT_RETRY_S:
+                self.repeats_dropped += repeticao[0]
+                continue
+            row = self._por_id.get(click_id)
+            if row is not None:
+                row["repeat_count"] = row.get("repeat_count", 0) + repeticao[0]
+                continue
+            atual = self._repeats.setdefault(click_id, [0, repeticao[1]])
+            atual[0] += repeticao[0]
+        if self._repeats and self._oldest is None:
+            self._oldest = agora
+
+
+# Instância global usada pelo pipeline de cliques
+click_writer = ClickWriter()
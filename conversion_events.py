@@ -0,0 +1,106 @@
+"""
+Campos tipados dos eventos de conversão
+Extrai de event_value (JSON string) os valores usados pelo analytics, uma vez
+na gravação, para que as métricas de conversão saiam de agregações SQL:
+
+- scroll: {"depth": 25|50|75|100} -> scroll_depth
+- pageview: {"time_on_page": segundos} -> time_on_page_s
+
+Preenchimento dos eventos gravados antes das colunas existirem:
+    python conversion_events.py --backfill
+"""
+import json
+import math
+import argparse
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from models import ConversionEvent
+
+# Tipos de evento que carregam campos tipados
+TIPOS_COM_CAMPOS = ("scroll", "pageview")
+
+
+def _numero(valor) -> Optional[float]:
+    """Valor numérico finito do JSON (bool, texto e números fora do alcance de float são ignorados)"""
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return None
+    try:
+        valor = float(valor)
+    except OverflowError:
+        return None
+    return valor if math.isfinite(valor) else None
+
+
+def campos_tipados(event_type: str, event_value: Optional[str]) -> dict:
+    """Colunas tipadas de um evento ({"scroll_depth": ..., "time_on_page_s": ...}, None quando ausentes)"""
+    campos = {"scroll_depth": None, "time_on_page_s": None}
+    if event_type not in TIPOS_COM_CAMPOS or not event_value:
+        return campos
+    try:
+        dados = json.loads(event_value)
+    except ValueError:
+        return campos
+    if not isinstance(dados, dict):
+        return campos
+
+    if event_type == "scroll":
+        depth = _numero(dados.get("depth"))
+        if depth is not None and depth.is_integer() and 0 <= depth <= 100:
+            campos["scroll_depth"] = int(depth)
+    else:
+        time_on_page = _numero(dados.get("time_on_page"))
+        if time_on_page is not None:
+            campos["time_on_page_s"] = float(time_on_page)
+    return campos
+
+
+def preencher_campos(db: Session, lote: int = 1000) -> int:
+    """Preenche scroll_depth/time_on_page_s dos eventos existentes (retorna quantos foram atualizados)"""
+    atualizados = 0
+    ultimo_id = 0
+    while True:
+        eventos = (
+            db.query(ConversionEvent.id, ConversionEvent.event_type, ConversionEvent.event_value)
+            .filter(
+                ConversionEvent.id > ultimo_id,
+                ConversionEvent.event_type.in_(TIPOS_COM_CAMPOS),
+                ConversionEvent.event_value.isnot(None)
+            )
+            .order_by(ConversionEvent.id)
+            .limit(lote)
+            .all()
+        )
+        if not eventos:
+            break
+        ultimo_id = eventos[-1][0]
+
+        valores = []
+        for event_id, event_type, event_value in eventos:
+            campos = campos_tipados(event_type, event_value)
+            if campos["scroll_depth"] is not None or campos["time_on_page_s"] is not None:
+                valores.append({"id": event_id, **campos})
+        if valores:
+            db.execute(update(ConversionEvent), valores)
+            db.commit()
+            atualizados += len(valores)
+    return atualizados
+
+
+if __name__ == "__main__":
+    from database import Base, engine, SessionLocal, migrar_colunas
+
+    parser = argparse.ArgumentParser(description="Campos tipados dos eventos de conversão")
+    parser.add_argument("--backfill", action="store_true", help="Preenche os campos tipados a partir de event_value")
+    args = parser.parse_args()
+
+    if not args.backfill:
+        parser.print_help()
+    else:
+        Base.metadata.create_all(bind=engine)
+        migrar_colunas()
+        db = SessionLocal()
+        try:
+            print(f"Eventos preenchidos: {preencher_campos(db)}")
+        finally:
+            db.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, event
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.types import DateTime
@@ -8,10 +8,17 @@ from timezone_utils import agora_brasil
 # Caminho do banco de dados SQLite
 SQLALCHEMY_DATABASE_URL = "sqlite:///./conteudooh.db"
 
+# Tamanho do pool de conexões: acompanha o threadpool dos handlers síncronos
+# mais as threads do pipeline de cliques (ver THREADPOOL_SIZE em main.py)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "30"))
+
 # Criar engine
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}
+    connect_args={"check_same_thread": False},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW
 )
 
 # Criar SessionLocal
@@ -28,3 +35,49 @@ def get_db():
     finally:
         db.close()
 
+# Migração leve: create_all só cria tabelas novas, não adiciona colunas
+def migrar_colunas():
+    """
+    Adiciona às tabelas existentes as colunas declaradas nos modelos que ainda não existem
+    
+    Retorna a lista de colunas criadas ("tabela.coluna")
+    """
+    inspetor = inspect(engine)
+    criadas = []
+    with engine.begin() as conn:
+        for tabela in Base.metadata.sorted_tables:
+            if not inspetor.has_table(tabela.name):
+                continue
+            existentes = {c["name"] for c in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name in existentes:
+                    continue
+                ddl = f"ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {coluna.type.compile(dialect=engine.dialect)}"
+                if coluna.server_default is not None:
+                    ddl += f" DEFAULT {coluna.server_default.arg}"
+                    if not coluna.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
+                criadas.append(f"{tabela.name}.{coluna.name}")
+    return criadas
+
+
+def migrar_indices():
+    """
+    Cria nas tabelas existentes os índices declarados nos modelos que ainda não existem
+    
+    Retorna a lista de índices criados
+    """
+    inspetor = inspect(engine)
+    criados = []
+    with engine.begin() as conn:
+        for tabela in Base.metadata.sorted_tables:
+            if not inspetor.has_table(tabela.name):
+                continue
+            existentes = {i["name"] for i in inspetor.get_indexes(tabela.name)}
+            for indice in tabela.indexes:
+                if indice.name in existentes:
+                    continue
+                indice.create(bind=conn)
+                criados.append(indice.name)
+    return criados
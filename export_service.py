@@ -0,0 +1,178 @@
+"""
+Exportação de dados brutos (cliques e eventos de conversão)
+Gera as linhas em CSV ou NDJSON aos poucos, para serem enviadas por um
+StreamingResponse: a memória usada não depende do tamanho do resultado.
+
+As linhas são lidas em páginas por id (keyset). Cada página é uma transação
+curta, então uma exportação lenta não segura o lock de leitura do SQLite
+enquanto o ClickWriter precisa gravar.
+"""
+import os
+import io
+import csv
+import json
+import zlib
+import logging
+from datetime import datetime
+from typing import Iterator, Optional
+from sqlalchemy import select
+from database import SessionLocal
+from models import Link, Click, ConversionEvent
+from analytics_service import AnalyticsService, PeriodoAnalytics
+
+logger = logging.getLogger(__name__)
+
+# Linhas lidas do banco por página
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+# Nível de compressão gzip (1 = mais rápido, 9 = menor)
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+FORMATOS = {
+    "csv": "text/csv",  # o Starlette acrescenta charset=utf-8
+    "ndjson": "application/x-ndjson",
+}
+
+# Colunas exportadas: (nome no arquivo, coluna)
+_COLUNAS_CLIQUES = (
+    ("id", Click.id),
+    ("link_id", Click.link_id),
+    ("identifier", Link.identifier),
+    ("ponto_dooh", Link.ponto_dooh),
+    ("campanha", Link.campanha),
+    ("clicked_at", Click.clicked_at),
+    ("ip_address", Click.ip_address),
+    ("device_type", Click.device_type),
+    ("browser", Click.browser),
+    ("operating_system", Click.operating_system),
+    ("country", Click.country),
+    ("state", Click.state),
+    ("city", Click.city),
+    ("language", Click.language),
+    ("isp", Click.isp),
+    ("timezone", Click.timezone),
+    ("referrer", Click.referrer),
+    ("user_agent", Click.user_agent),
+    ("repeat_count", Click.repeat_count),
+)
+
+_COLUNAS_EVENTOS = (
+    ("id", ConversionEvent.id),
+    ("click_id", ConversionEvent.click_id),
+    ("link_id", Click.link_id),
+    ("identifier", Link.identifier),
+    ("ponto_dooh", Link.ponto_dooh),
+    ("campanha", Link.campanha),
+    ("event_type", ConversionEvent.event_type),
+    ("event_value", ConversionEvent.event_value),
+    ("scroll_depth", ConversionEvent.scroll_depth),
+    ("time_on_page_s", ConversionEvent.time_on_page_s),
+    ("occurred_at", ConversionEvent.occurred_at),
+)
+
+
+def _valor(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+
+class ExportService:
+    """Serviço de exportação em streaming"""
+
+    @staticmethod
+    def clicks(
+        formato: str = "csv",
+        ponto_dooh: Optional[str] = None,
+        campanha: Optional[str] = None,
+        link_id: Optional[int] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None
+    ) -> Iterator[bytes]:
+        """Cliques no período (mesmos filtros de AnalyticsService.get_link_analytics)"""
+        periodo = PeriodoAnalytics(start_date, end_date, avisar=True)
+        consulta = (
+            select(*(coluna for _, coluna in _COLUNAS_CLIQUES))
+            .join(Link, Click.link_id == Link.id)
+            .where(*AnalyticsService.filtros_link(ponto_dooh, campanha, link_id), *periodo.condicoes_cliques())
+        )
+        return ExportService._gerar(consulta, Click.id, _COLUNAS_CLIQUES, formato)
+
+    @staticmethod
+    def events(
+        formato: str = "csv",
+        ponto_dooh: Optional[str] = None,
+        campanha: Optional[str] = None,
+        link_id: Optional[int] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None
+    ) -> Iterator[bytes]:
+        """Eventos de conversão no período (occurred_at), filtrados pelo link do clique de origem"""
+        periodo = PeriodoAnalytics(start_date, end_date, avisar=True)
+        condicoes = AnalyticsService.filtros_link(ponto_dooh, campanha, link_id)
+        if periodo.inicio is not None:
+            condicoes.append(ConversionEvent.occurred_at >= periodo.inicio)
+        if periodo.fim is not None:
+            condicoes.append(ConversionEvent.occurred_at < periodo.fim)
+        consulta = (
+            select(*(coluna for _, coluna in _COLUNAS_EVENTOS))
+            .join(Click, ConversionEvent.click_id == Click.id)
+            .join(Link, Click.link_id == Link.id)
+            .where(*condicoes)
+        )
+        return ExportService._gerar(consulta, ConversionEvent.id, _COLUNAS_EVENTOS, formato)
+
+    @staticmethod
+    def _gerar(consulta, coluna_id, colunas: tuple, formato: str) -> Iterator[bytes]:
+        """Percorre a consulta em páginas por id e devolve cada página já formatada"""
+        nomes = [nome for nome, _ in colunas]
+        if formato == "csv":
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer, lineterminator="\n")
+            escritor.writerow(nomes)
+            yield buffer.getvalue().encode("utf-8")
+
+        ultimo_id = None
+        total = 0
+        while True:
+            pagina = consulta if ultimo_id is None else consulta.where(coluna_id > ultimo_id)
+            db = SessionLocal()
+            try:
+                linhas = db.execute(pagina.order_by(coluna_id).limit(EXPORT_BATCH_SIZE)).all()
+            finally:
+                db.close()
+            if not linhas:
+                break
+            ultimo_id = linhas[-1][0]
+            total += len(linhas)
+
+            if formato == "csv":
+                buffer.seek(0)
+                buffer.truncate()
+                escritor.writerows([_valor(v) for v in linha] for linha in linhas)
+                yield buffer.getvalue().encode("utf-8")
+            else:
+                yield "".join(
+                    json.dumps({nome: _valor(v) for nome, v in zip(nomes, linha)}, ensure_ascii=False) + "\n"
+                    for linha in linhas
+                ).encode("utf-8")
+
+            if len(linhas) < EXPORT_BATCH_SIZE:
+                break
+        logger.info(f"[Export] {total} linhas exportadas em {formato}")
+
+    @staticmethod
+    def gzip(partes: Iterator[bytes]) -> Iterator[bytes]:
+        """Comprime o stream em gzip incrementalmente (Content-Encoding: gzip)"""
+        compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+        for parte in partes:
+            comprimido = compressor.compress(parte)
+            if comprimido:
+                yield comprimido
+        yield compressor.flush()
+
+    @staticmethod
+    def aceita_gzip(accept_encoding: Optional[str]) -> bool:
+        """Se o cliente aceita gzip (cabeçalho Accept-Encoding)"""
+        for item in (accept_encoding or "").lower().split(","):
+            nome, _, parametros = item.strip().partition(";")
+            if nome.strip() in ("gzip", "*"):
+                return parametros.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+        return False
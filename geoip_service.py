@@ -0,0 +1,217 @@
+"""
+Motor de GeoIP offline
+Carrega faixas de IP -> (país, estado, cidade, ISP, timezone) de um arquivo CSV
+para arrays ordenados e resolve IPs por busca binária, sem chamadas externas
+
+Formato do arquivo (com cabeçalho):
+    start_ip,end_ip,country,state,city,isp,timezone
+    177.0.0.0,177.0.255.255,Brazil,Paraíba,Cajazeiras,Exemplo Telecom,America/Fortaleza
+
+start_ip/end_ip aceitam IPv4 ou IPv6 em notação textual ou como inteiro.
+"""
+import os
+import csv
+import time
+import threading
+import ipaddress
+import logging
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente)
+GEOIP_DATABASE = os.getenv("GEOIP_DATABASE", "geoip.csv")
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "10000"))
+GEOIP_RELOAD_INTERVAL = int(os.getenv("GEOIP_RELOAD_INTERVAL", "60"))  # segundos entre checagens do arquivo
+
+CAMPOS_LOCALIZACAO = ("country", "state", "city", "isp", "timezone")
+LOCALIZACAO_VAZIA = {"country": None, "city": None, "state": None, "isp": None, "timezone": None}
+
+
+def _ip_para_int(valor: str):
+    """Converte IP textual ou inteiro em (versão, inteiro)"""
+    valor = valor.strip()
+    if valor.isdigit():
+        numero = int(valor)
+        return (4 if numero <= 0xFFFFFFFF else 6), numero
+    ip = ipaddress.ip_address(valor)
+    return ip.version, int(ip)
+
+
+class _IndiceFaixas:
+    """
+    Faixas de uma família de IP ordenadas por início
+
+    starts/ends guardam os limites das faixas e registros aponta para a tupla
+    de localização deduplicada em GeoIPIndex.localizacoes.
+    IPv4 usa array('I'); IPv6 precisa de inteiros de 128 bits (listas).
+    """
+
+    __slots__ = ("starts", "ends", "registros")
+
+    def __init__(self, faixas: list, compacto: bool):
+        faixas.sort()
+        if compacto:
+            self.starts = array("I", (f[0] for f in faixas))
+            self.ends = array("I", (f[1] for f in faixas))
+        else:
+            self.starts = [f[0] for f in faixas]
+            self.ends = [f[1] for f in faixas]
+        self.registros = array("I", (f[2] for f in faixas))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def buscar(self, numero: int) -> Optional[int]:
+        pos = bisect_right(self.starts, numero) - 1
+        if pos >= 0 and numero <= self.ends[pos]:
+            return self.registros[pos]
+        return None
+
+
+class GeoIPIndex:
+    """Índice imutável carregado de um arquivo de faixas"""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.localizacoes = []
+        faixas_v4 = []
+        faixas_v6 = []
+        ids_localizacao = {}
+
+        with open(caminho, newline="", encoding="utf-8") as arquivo:
+            for linha in csv.DictReader(arquivo):
+                try:
+                    versao, inicio = _ip_para_int(linha["start_ip"])
+                    versao_fim, fim = _ip_para_int(linha["end_ip"])
+                except (KeyError, ValueError):
+                    continue
+                if versao != versao_fim or fim < inicio:
+                    continue
+
+                localizacao = tuple((linha.get(campo) or "").strip() or None for campo in CAMPOS_LOCALIZACAO)
+                registro = ids_localizacao.get(localizacao)
+                if registro is None:
+                    registro = len(self.localizacoes)
+                    ids_localizacao[localizacao] = registro
+                    self.localizacoes.append(localizacao)
+
+                (faixas_v4 if versao == 4 else faixas_v6).append((inicio, fim, registro))
+
+        self.v4 = _IndiceFaixas(faixas_v4, compacto=True)
+        self.v6 = _IndiceFaixas(faixas_v6, compacto=False)
+
+    def __len__(self):
+        return len(self.v4) + len(self.v6)
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        try:
+            endereco = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+
+        # IPv4 mapeado em IPv6 (::ffff:a.b.c.d) usa o índice IPv4
+        if endereco.version == 6 and endereco.ipv4_mapped:
+            endereco = endereco.ipv4_mapped
+
+        indice = self.v4 if endereco.version == 4 else self.v6
+        registro = indice.buscar(int(endereco))
+        if registro is None:
+            return None
+        return dict(zip(CAMPOS_LOCALIZACAO, self.localizacoes[registro]))
+
+
+class GeoIPService:
+    """
+    Consulta local de GeoIP com cache LRU por IP e recarga automática do arquivo
+
+    O índice é trocado atomicamente quando o arquivo muda (mtime), sem
+    interromper consultas em andamento.
+    """
+
+    def __init__(self, caminho: str = GEOIP_DATABASE, cache_size: int = GEOIP_CACHE_SIZE,
+                 reload_interval: int = GEOIP_RELOAD_INTERVAL):
+        self.caminho = caminho
+        self.cache_size = max(1, cache_size)
+        self.reload_interval = reload_interval
+        self._indice = None
+        self._mtime = None
+        self._ultima_checagem = 0.0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def reload(self, force: bool = False) -> bool:
+        """Recarrega o arquivo se ele mudou desde a última carga"""
+        with self._reload_lock:
+            self._ultima_checagem = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.caminho)
+            except OSError:
+                if self._indice is None:
+                    logger.warning(f"[GeoIP] Arquivo de dados não encontrado: {self.caminho}")
+                    self._mtime = -1
+                return False
+            if not force and mtime == self._mtime:
+                return False
+
+            inicio = time.perf_counter()
+            try:
+                indice = GeoIPIndex(self.caminho)
+            except Exception as e:
+                logger.error(f"[GeoIP] Erro ao carregar {self.caminho}: {e}")
+                return False
+
+            with self._lock:
+                self._indice = indice
+                self._mtime = mtime
+                self._cache.clear()
+            logger.info(
+                f"[GeoIP] {len(indice)} faixas carregadas de {self.caminho} "
+                f"em {(time.perf_counter() - inicio) * 1000:.0f} ms"
+            )
+            return True
+
+    def _checar_recarga(self):
+        if self._mtime is None or time.monotonic() - self._ultima_checagem >= self.reload_interval:
+            self.reload()
+
+    def lookup(self, ip: str) -> dict:
+        """Retorna a localização do IP (campos None quando desconhecido)"""
+        self._checar_recarga()
+
+        with self._lock:
+            resultado = self._cache.get(ip)
+            if resultado is not None:
+                self._cache.move_to_end(ip)
+                self.hits += 1
+                return dict(resultado)
+            self.misses += 1
+            indice = self._indice
+
+        resultado = (indice.lookup(ip) if indice else None) or LOCALIZACAO_VAZIA
+
+        with self._lock:
+            self._cache[ip] = resultado
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dict(resultado)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ranges": len(self._indice) if self._indice else 0,
+                "cache_size": len(self._cache),
+                "cache_max_size": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# Instância global usada pelo TrackingService quando GEOIP_BACKEND=local
+geoip_service = GeoIPService()
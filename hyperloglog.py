@@ -0,0 +1,129 @@
+"""
+HyperLogLog para contagem aproximada de IPs distintos
+Sketches são mescláveis (máximo por registrador), então os sketches diários
+de vários links podem ser combinados para qualquer intervalo de dias.
+
+Com HLL_PRECISION = 12 (4096 registradores) o erro padrão é 1,04 / sqrt(4096),
+cerca de 1,6%; em ~95% das consultas o erro fica abaixo de 3,25%.
+"""
+import math
+import struct
+import hashlib
+from typing import Iterable, Optional
+
+HLL_PRECISION = 12
+HLL_REGISTRADORES = 1 << HLL_PRECISION
+HLL_ERRO_PADRAO = 1.04 / math.sqrt(HLL_REGISTRADORES)
+
+# Formato serializado: 1 byte de tipo + 1 byte de precisão + dados
+# - "S" (esparso): pares (índice uint16, valor uint8), para sketches com poucos IPs
+# - "D" (denso): um byte por registrador
+_ESPARSO = b"S"
+_DENSO = b"D"
+_PAR = struct.Struct(">HB")
+
+# Quantos sketches densos mesclar por chamada de map() em mesclar()
+_GRUPO_DENSOS = 256
+
+_BITS_RESTANTES = 64 - HLL_PRECISION
+_MASCARA_RESTANTE = (1 << _BITS_RESTANTES) - 1
+
+
+def _alpha(m: int) -> float:
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+class HyperLogLog:
+    """Sketch HyperLogLog com hash de 64 bits (blake2b)"""
+
+    __slots__ = ("registradores",)
+
+    def __init__(self, registradores: Optional[bytearray] = None):
+        self.registradores = registradores if registradores is not None else bytearray(HLL_REGISTRADORES)
+
+    def add(self, valor: str):
+        h = int.from_bytes(hashlib.blake2b(valor.encode("utf-8"), digest_size=8).digest(), "big")
+        indice = h >> _BITS_RESTANTES
+        posto = _BITS_RESTANTES - (h & _MASCARA_RESTANTE).bit_length() + 1
+        if posto > self.registradores[indice]:
+            self.registradores[indice] = posto
+
+    def update(self, valores: Iterable[str]):
+        for valor in valores:
+            if valor:
+                self.add(valor)
+
+    def merge(self, outro: "HyperLogLog"):
+        self.registradores = bytearray(map(max, self.registradores, outro.registradores))
+
+    def merge_bytes(self, dados: bytes):
+        """Mescla um sketch serializado sem desserializá-lo por completo"""
+        if not dados:
+            return
+        _verificar_cabecalho(dados)
+        if dados[:1] == _ESPARSO:
+            registradores = self.registradores
+            for indice, posto in _PAR.iter_unpack(dados[2:]):
+                if posto > registradores[indice]:
+                    registradores[indice] = posto
+        else:
+            self.registradores = bytearray(map(max, self.registradores, dados[2:]))
+
+    def count(self) -> int:
+        m = HLL_REGISTRADORES
+        zeros = self.registradores.count(0)
+        if zeros == m:
+            return 0
+        estimativa = _alpha(m) * m * m / sum(2.0 ** -r for r in self.registradores)
+        # Correção para cardinalidades pequenas (linear counting)
+        if estimativa <= 2.5 * m and zeros:
+            estimativa = m * math.log(m / zeros)
+        return int(round(estimativa))
+
+    def to_bytes(self) -> bytes:
+        ocupados = [(i, r) for i, r in enumerate(self.registradores) if r]
+        if len(ocupados) * _PAR.size < HLL_REGISTRADORES:
+            return _ESPARSO + bytes([HLL_PRECISION]) + b"".join(_PAR.pack(i, r) for i, r in ocupados)
+        return _DENSO + bytes([HLL_PRECISION]) + bytes(self.registradores)
+
+    @classmethod
+    def from_bytes(cls, dados: bytes) -> "HyperLogLog":
+        sketch = cls()
+        sketch.merge_bytes(dados)
+        return sketch
+
+
+def mesclar(sketches: Iterable[bytes]) -> HyperLogLog:
+    """
+    Mescla vários sketches serializados
+
+    Os densos são combinados em grupos (um max() por registrador para o grupo
+    inteiro), bem mais rápido que mesclá-los um a um em Python.
+    """
+    resultado = HyperLogLog()
+    densos = []
+    for dados in sketches:
+        if not dados:
+            continue
+        if dados[:1] == _DENSO:
+            _verificar_cabecalho(dados)
+            densos.append(memoryview(dados)[2:])
+            if len(densos) >= _GRUPO_DENSOS:
+                resultado.registradores = bytearray(map(max, resultado.registradores, *densos))
+                densos = []
+        else:
+            resultado.merge_bytes(dados)
+    if densos:
+        resultado.registradores = bytearray(map(max, resultado.registradores, *densos))
+    return resultado
+
+
+def _verificar_cabecalho(dados: bytes):
+    if dados[:1] not in (_ESPARSO, _DENSO) or dados[1] != HLL_PRECISION:
+        raise ValueError("Sketch HyperLogLog com formato ou precisão incompatível")
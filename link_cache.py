@@ -0,0 +1,138 @@
+"""
+Cache de resolução de links rastreáveis para o endpoint /r/{identifier}
+Guarda, por identifier, a URL de destino já com as UTMs aplicadas, de forma
+que o redirect seja uma consulta em dicionário mais a concatenação do click_id
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlencode, urlparse, urlunparse, parse_qs
+
+# Tamanho máximo do cache (LRU)
+LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", "1024"))
+
+
+class LinkResolvido:
+    """Destino pré-calculado de um link (URL com UTMs, pronta para receber o click_id)"""
+
+    __slots__ = ("link_id", "base_url", "separador", "fragmento", "tem_click_id")
+
+    def __init__(self, link_id: int, base_url: str, separador: str, fragmento: str, tem_click_id: bool):
+        self.link_id = link_id
+        self.base_url = base_url
+        self.separador = separador
+        self.fragmento = fragmento
+        self.tem_click_id = tem_click_id
+
+    def destino(self, click_id: Optional[int] = None) -> str:
+        """URL final de redirecionamento, com click_id quando informado"""
+        if not click_id or self.tem_click_id:
+            return self.base_url + self.fragmento
+        return f"{self.base_url}{self.separador}click_id={click_id}{self.fragmento}"
+
+
+def montar_link_resolvido(link) -> LinkResolvido:
+    """
+    Aplica as UTMs do link à URL de destino (sem sobrescrever as existentes)
+    e separa o fragmento para que o click_id possa ser anexado à query
+    """
+    destination_url = link.destination_url
+
+    # Se o link tem UTMs configurados, adicionar à URL
+    utm_params = {}
+    if link.utm_source:
+        utm_params["utm_source"] = link.utm_source
+    if link.utm_medium:
+        utm_params["utm_medium"] = link.utm_medium
+    if link.utm_campaign:
+        utm_params["utm_campaign"] = link.utm_campaign
+    if link.utm_content:
+        utm_params["utm_content"] = link.utm_content
+    if link.utm_term:
+        utm_params["utm_term"] = link.utm_term
+
+    parsed = urlparse(destination_url)
+    existing_params = parse_qs(parsed.query)
+    query = parsed.query
+
+    if utm_params:
+        # Adicionar UTMs (não sobrescrever se já existirem)
+        for key, value in utm_params.items():
+            if key not in existing_params:
+                existing_params[key] = [value]
+        query = urlencode(existing_params, doseq=True)
+
+    base_url = urlunparse((
+        parsed.scheme,
+        parsed.netloc,
+        parsed.path,
+        parsed.params,
+        query,
+        ""
+    ))
+
+    return LinkResolvido(
+        link_id=link.id,
+        base_url=base_url,
+        separador="&" if query else "?",
+        fragmento=f"#{parsed.fragment}" if parsed.fragment else "",
+        tem_click_id="click_id" in existing_params
+    )
+
+
+class LinkCache:
+    """Cache LRU limitado de LinkResolvido por identifier"""
+
+    def __init__(self, max_size: int = LINK_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, identifier: str) -> Optional[LinkResolvido]:
+        with self._lock:
+            resolvido = self._itens.get(identifier)
+            if resolvido is None:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(identifier)
+            self.hits += 1
+            return resolvido
+
+    def put(self, link) -> LinkResolvido:
+        """Calcula o destino do link e guarda no cache"""
+        resolvido = montar_link_resolvido(link)
+        with self._lock:
+            self._itens[link.identifier] = resolvido
+            self._itens.move_to_end(link.identifier)
+            while len(self._itens) > self.max_size:
+                self._itens.popitem(last=False)
+                self.evictions += 1
+        return resolvido
+
+    def invalidate(self, identifier: str):
+        with self._lock:
+            self._itens.pop(identifier, None)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._itens),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+# Instância global usada pela aplicação
+link_cache = LinkCache()
@@ -1,35 +1,90 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse, Response
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from jinja2 import Environment, FileSystemLoader
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, insert
+from pydantic import ValidationError
 from typing import List
 import os
-import qrcode
-import io
+import json
+import zlib
 import logging
 from datetime import datetime, timedelta
 from timezone_utils import agora_brasil
-from urllib.parse import urlencode, urlparse, urlunparse, parse_qs
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-from database import engine, get_db, Base
+from database import engine, get_db, Base, SessionLocal, migrar_colunas, migrar_indices
 from models import Noticia, Link, Click, ConversionEvent
-from schemas import LinkCreate, LinkResponse, LinkList, AnalyticsResponse, LinkAnalytics, TopLink, ConversionEventCreate, ConversionEventResponse, ConversionMetrics
-from tracking_service import TrackingService
-from analytics_service import AnalyticsService
+from schemas import LinkCreate, LinkResponse, LinkList, AnalyticsResponse, LinkAnalytics, HeatmapAnalytics, TopLink, ConversionEventCreate, ConversionEventResponse, ConversionEventBatchResponse, ConversionMetrics
+from tracking_service import TrackingService, user_agent_cache
+from click_pipeline import click_pipeline
+from click_writer import click_writer
+from link_cache import link_cache
+from scan_sessions import scan_sessions
+import click_rollups
+import conversion_events
+import noticia_links
+from rate_limiter import rate_limiter
+from analytics_service import AnalyticsService, PeriodoAnalytics, ANALYTICS_TOP_LINKS
+from analytics_cache import analytics_cache
+from click_snapshot import click_snapshot
+from noticia_pool import noticia_pool, NOTICIAS_FRESCOR_DIAS
+from qr_cache import qr_cache, chave as qr_cache_chave, versao as qr_cache_versao, base_url_qrcode, QR_CACHE_MAX_AGE_S
+from qr_prerender import qr_prerender
+from export_service import ExportService, FORMATOS as FORMATOS_EXPORT
 from scraper import RadiocentroScraper
 from scheduler import iniciar_scheduler
 from weather_service import criar_servico_clima, WeatherService
 from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
-
-# Criar tabelas
-Base.metadata.create_all(bind=engine)
+from fastapi.concurrency import run_in_threadpool
+from anyio import to_thread
+
+# Modelo de execução:
+# - Handlers que usam sessão SQLAlchemy síncrona, requests ou PIL/qrcode são declarados
+#   com "def" e o FastAPI os executa no threadpool (tamanho em THREADPOOL_SIZE)
+# - Handlers "async def" não podem bloquear; o redirect /r/ só usa o threadpool em cache miss
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+# Notícias por playlist das telas de exibição (padrão de /api/display/playlist)
+DISPLAY_PLAYLIST_SIZE = int(os.getenv("DISPLAY_PLAYLIST_SIZE", "20"))
+
+# Com python main.py, os processos do pré-render de QR codes (forkserver/spawn) importam
+# este módulo como __mp_main__: não podem migrar o banco nem iniciar o scheduler
+_PROCESSO_FILHO = __name__ == "__mp_main__"
+
+def _preparar_banco():
+    """Cria tabelas, colunas e índices novos e preenche os dados derivados em bancos antigos"""
+    Base.metadata.create_all(bind=engine)
+    colunas_criadas = migrar_colunas()
+    for coluna in colunas_criadas:
+        logger.info(f"Coluna adicionada ao banco: {coluna}")
+    for indice in migrar_indices():
+        logger.info(f"Índice criado no banco: {indice}")
+    
+    # Bancos criados antes dos rollups horários, dos campos tipados de eventos e dos links das notícias: preencher a partir dos dados existentes
+    db = SessionLocal()
+    try:
+        linhas_rollup = click_rollups.preencher_se_vazio(db)
+        if linhas_rollup:
+            logger.info(f"Rollups de cliques preenchidos: {linhas_rollup} linhas")
+        # Colunas tipadas dos eventos acabaram de ser criadas: extrair dos event_value existentes
+        if "conversion_events.scroll_depth" in colunas_criadas:
+            eventos = conversion_events.preencher_campos(db)
+            logger.info(f"Campos tipados preenchidos em {eventos} eventos de conversão")
+        # Notícias gravadas antes do provisionamento na ingestão: criar os links rastreáveis dos QR codes
+        links = noticia_links.preencher_faltantes(db)
+        if links["criados"]:
+            logger.info(f"Links rastreáveis criados para {links['criados']} notícias")
+    finally:
+        db.close()
+
+if not _PROCESSO_FILHO:
+    _preparar_banco()
 
 app = FastAPI(title="ConteudoOH - Sistema de Mídia Indoor/DOOH")
 
@@ -58,7 +113,32 @@ if os.path.exists("icones"):
     app.mount("/icones", StaticFiles(directory="icones"), name="icones")
 
 # Iniciar scheduler para atualização automática
-iniciar_scheduler()
+if not _PROCESSO_FILHO:
+    iniciar_scheduler()
+
+def _prewarm_user_agent_cache():
+    db = SessionLocal()
+    try:
+        TrackingService.prewarm_user_agent_cache(db)
+    except Exception as e:
+        logger.warning(f"Não foi possível pré-carregar o cache de User-Agent: {e}")
+    finally:
+        db.close()
+
+@app.on_event("startup")
+async def iniciar_pipeline_cliques():
+    """Dimensiona o threadpool, pré-carrega o cache de User-Agent e inicia os workers de cliques"""
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    await run_in_threadpool(_prewarm_user_agent_cache)
+    click_writer.start()
+    click_pipeline.start()
+
+@app.on_event("shutdown")
+async def encerrar_pipeline_cliques():
+    """Drena a fila de cliques e grava o buffer pendente antes de encerrar"""
+    click_pipeline.stop()
+    click_writer.stop()
+    qr_prerender.encerrar()
 
 @app.get("/", response_class=HTMLResponse)
 async def tela_exibicao(request: Request, db: Session = Depends(get_db)):
@@ -68,39 +148,71 @@ async def tela_exibicao(request: Request, db: Session = Depends(get_db)):
     return HTMLResponse(content=content)
 
 @app.get("/api/noticias/aleatoria")
-async def obter_noticia_aleatoria(db: Session = Depends(get_db)):
+async def obter_noticia_aleatoria():
     """Retorna uma notícia aleatória ativa dos últimos 2 dias
     
     Regra de frescor:
     - Tenta usar data_publicacao quando existir
     - Se não houver data_publicacao, usa data_criacao
+    
+    Sorteia do pool em memória (noticia_pool); o banco só é consultado
+    no threadpool quando o pool foi invalidado
     """
-    import random
-    limite_dias = 2
-    limite_data = agora_brasil() - timedelta(days=limite_dias)
-
-    # Notícias com data_publicacao recente
-    noticias = (
-        db.query(Noticia)
-        .filter(
-            Noticia.ativa == True,
-            (
-                # Usa data_publicacao quando existir
-                ((Noticia.data_publicacao != None) & (Noticia.data_publicacao >= limite_data))
-                |
-                # Fallback: quando não há data_publicacao, considera data_criacao
-                ((Noticia.data_publicacao == None) & (Noticia.data_criacao != None) & (Noticia.data_criacao >= limite_data))
-            )
-        )
-        .all()
-    )
-    if not noticias:
+    if not noticia_pool.valido:
+        await run_in_threadpool(noticia_pool.rebuild)
+    noticia = noticia_pool.escolher()
+    if noticia is None:
         raise HTTPException(status_code=404, detail="Nenhuma notícia ativa encontrada")
-    noticia = random.choice(noticias)
-    return noticia.to_dict()
+    return noticia
+
+def _etag_confere(if_none_match: str, etag: str) -> bool:
+    """Se o If-None-Match do cliente contém o ETag atual (comparação fraca, RFC 7232)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        item.strip().removeprefix("W/") == etag
+        for item in if_none_match.split(",")
+    )
+
+@app.get("/api/display/playlist")
+async def obter_playlist_exibicao(request: Request, limite: int = Query(DISPLAY_PLAYLIST_SIZE, ge=1, le=100)):
+    """Lote ordenado de notícias ativas e recentes para as telas de exibição
+    
+    As telas percorrem a playlist localmente e revalidam com If-None-Match:
+    o ETag é derivado da versão do pool (noticia_pool), então a resposta é
+    304 enquanto o conjunto de notícias não muda.
+    
+    Cada item traz o identifier do link rastreável, a URL codificada no QR
+    code (/r/<identifier>) e a URL da imagem do QR code.
+    """
+    if not noticia_pool.valido:
+        await run_in_threadpool(noticia_pool.rebuild)
+    versao, noticias = noticia_pool.lote(limite)
+    base_url = base_url_qrcode(str(request.base_url))
+    qr_prerender.registrar_base_url(base_url)
+    # A URL do QR code é absoluta: o host entra no ETag
+    etag = f'"{versao}.{limite}.{zlib.crc32(base_url.encode()):08x}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_confere(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    itens = []
+    for noticia in noticias:
+        identifier = Noticia.identificador_tracking(noticia["id"])
+        tem_url = bool(noticia.get("url"))
+        qrcode_url = f"{base_url}/r/{identifier}"
+        itens.append({
+            **noticia,
+            "identifier": identifier,
+            "qrcode_url": qrcode_url if tem_url else None,
+            "qrcode_image_url": f"/api/noticias/{noticia['id']}/qrcode?v={qr_cache_versao(qrcode_url)}" if tem_url else None
+        })
+    return JSONResponse(content={"versao": versao, "total": len(itens), "itens": itens}, headers=headers)
 
 @app.get("/admin", response_class=HTMLResponse)
-async def painel_admin(request: Request, db: Session = Depends(get_db)):
+def painel_admin(request: Request, db: Session = Depends(get_db)):
     """Painel administrativo"""
     noticias = db.query(Noticia).order_by(desc(Noticia.data_criacao)).all()
     noticias_dict = [n.to_dict() for n in noticias]
@@ -117,33 +229,26 @@ async def painel_admin(request: Request, db: Session = Depends(get_db)):
 
 # API REST
 @app.get("/api/noticias", response_model=List[dict])
-async def listar_noticias(db: Session = Depends(get_db), ativa: bool = None):
+def listar_noticias(db: Session = Depends(get_db), ativa: bool = None):
     """Lista notícias, priorizando itens recentes
     
     - Por padrão, retorna apenas notícias dos últimos 2 dias
     - Se quiser todas, use o parâmetro ?ativa=true/false explicitamente
     """
-    limite_dias = 2
-    limite_data = agora_brasil() - timedelta(days=limite_dias)
+    limite_data = agora_brasil() - timedelta(days=NOTICIAS_FRESCOR_DIAS)
 
     query = db.query(Noticia)
     if ativa is not None:
         query = query.filter(Noticia.ativa == ativa)
 
     # Aplicar filtro de últimos 2 dias
-    query = query.filter(
-        (
-            (Noticia.data_publicacao != None) & (Noticia.data_publicacao >= limite_data)
-        ) | (
-            (Noticia.data_publicacao == None) & (Noticia.data_criacao != None) & (Noticia.data_criacao >= limite_data)
-        )
-    )
+    query = query.filter(Noticia.filtro_recente(limite_data))
 
     noticias = query.order_by(desc(Noticia.data_criacao)).all()
     return [n.to_dict() for n in noticias]
 
 @app.get("/api/noticias/{noticia_id}")
-async def obter_noticia(noticia_id: int, db: Session = Depends(get_db)):
+def obter_noticia(noticia_id: int, db: Session = Depends(get_db)):
     """Obtém uma notícia específica"""
     noticia = db.query(Noticia).filter(Noticia.id == noticia_id).first()
     if not noticia:
@@ -151,12 +256,12 @@ async def obter_noticia(noticia_id: int, db: Session = Depends(get_db)):
     return noticia.to_dict()
 
 @app.post("/api/noticias/atualizar")
-async def atualizar_noticias(db: Session = Depends(get_db)):
+def atualizar_noticias(db: Session = Depends(get_db)):
     """Força atualização das notícias do site"""
     scraper = RadiocentroScraper()
     novas_noticias = scraper.obter_noticias(limite=30)
     
-    adicionadas = 0
+    adicionadas = []
     for noticia_data in novas_noticias:
         # Verificar se já existe
         existente = db.query(Noticia).filter(Noticia.url == noticia_data['url']).first()
@@ -169,13 +274,17 @@ async def atualizar_noticias(db: Session = Depends(get_db)):
                 data_publicacao=noticia_data['data_publicacao']
             )
             db.add(nova_noticia)
-            adicionadas += 1
+            adicionadas.append(nova_noticia)
     
+    # Links rastreáveis dos QR codes gravados na mesma transação das notícias
+    db.flush()
+    noticia_links.provisionar_links(db, adicionadas)
     db.commit()
-    return {"mensagem": f"{adicionadas} novas notícias adicionadas", "total": len(novas_noticias)}
+    noticia_pool.atualizar(db)
+    return {"mensagem": f"{len(adicionadas)} novas notícias adicionadas", "total": len(novas_noticias)}
 
 @app.put("/api/noticias/{noticia_id}")
-async def atualizar_noticia(noticia_id: int, dados: dict, db: Session = Depends(get_db)):
+def atualizar_noticia(noticia_id: int, dados: dict, db: Session = Depends(get_db)):
     """Atualiza uma notícia"""
     noticia = db.query(Noticia).filter(Noticia.id == noticia_id).first()
     if not noticia:
@@ -187,10 +296,13 @@ async def atualizar_noticia(noticia_id: int, dados: dict, db: Session = Depends(
     
     db.commit()
     db.refresh(noticia)
+    # URL alterada: atualizar o destino do link rastreável
+    noticia_links.provisionar_links(db, [noticia])
+    noticia_pool.atualizar(db)
     return noticia.to_dict()
 
 @app.delete("/api/noticias/{noticia_id}")
-async def deletar_noticia(noticia_id: int, db: Session = Depends(get_db)):
+def deletar_noticia(noticia_id: int, db: Session = Depends(get_db)):
     """Deleta uma notícia"""
     noticia = db.query(Noticia).filter(Noticia.id == noticia_id).first()
     if not noticia:
@@ -198,10 +310,13 @@ async def deletar_noticia(noticia_id: int, db: Session = Depends(get_db)):
     
     db.delete(noticia)
     db.commit()
+    # Imagens da notícia removida não serão mais servidas
+    qr_cache.invalidate(Noticia.identificador_tracking(noticia_id))
+    noticia_pool.atualizar(db)
     return {"mensagem": "Notícia deletada com sucesso"}
 
 @app.patch("/api/noticias/{noticia_id}/toggle")
-async def toggle_noticia(noticia_id: int, db: Session = Depends(get_db)):
+def toggle_noticia(noticia_id: int, db: Session = Depends(get_db)):
     """Ativa/desativa uma notícia"""
     noticia = db.query(Noticia).filter(Noticia.id == noticia_id).first()
     if not noticia:
@@ -210,15 +325,27 @@ async def toggle_noticia(noticia_id: int, db: Session = Depends(get_db)):
     noticia.ativa = not noticia.ativa
     db.commit()
     db.refresh(noticia)
+    noticia_pool.atualizar(db)
     return noticia.to_dict()
 
+def _headers_qrcode(chave_imagem: str, v: str, tracking_url: str) -> dict:
+    """ETag da imagem; a URL versionada (?v=) nunca muda de conteúdo e é cacheada como immutable"""
+    if v and v == qr_cache_versao(tracking_url):
+        cache_control = f"public, max-age={QR_CACHE_MAX_AGE_S}, immutable"
+    else:
+        cache_control = "public, no-cache"
+    return {"ETag": f'"{chave_imagem}"', "Cache-Control": cache_control}
+
 @app.get("/api/noticias/{noticia_id}/qrcode")
-async def gerar_qrcode_noticia(noticia_id: int, request: Request, db: Session = Depends(get_db), tamanho: str = "normal"):
+def gerar_qrcode_noticia(noticia_id: int, request: Request, db: Session = Depends(get_db), tamanho: str = "normal", v: str = None):
     """Gera um QR code do link da matéria - otimizado para telas de baixa resolução
     Integrado com sistema de tracking: QR code aponta para link rastreável
     
     Parâmetros:
     - tamanho: "pequeno" para telas muito pequenas (128x192, 160x240) ou "normal" para outras
+    - v: versão da imagem (hash da URL rastreável, enviada pela playlist); com ela a resposta é immutable
+    
+    O PNG vem do qr_cache (memória e disco) e só é gerado em cache miss
     """
     try:
         print(f"[QR Code] Requisição recebida para notícia ID: {noticia_id}, tamanho: {tamanho}")
@@ -231,117 +358,25 @@ async def gerar_qrcode_noticia(noticia_id: int, request: Request, db: Session =
             print(f"[QR Code] Notícia {noticia_id} não tem URL")
             raise HTTPException(status_code=400, detail="URL da notícia não disponível")
         
-        # Garantir que a URL seja válida e completa
-        url = noticia.url.strip()
-        if not url.startswith(('http://', 'https://')):
-            # Se não começar com http/https, adicionar https://
-            if url.startswith('//'):
-                url = 'https:' + url
-            elif url.startswith('/'):
-                url = 'https://radiocentrocz.com.br' + url
-            else:
-                url = 'https://' + url
-        
-        # Criar ou buscar link rastreável para esta notícia
-        identifier = f"noticia-{noticia_id}"
-        qr_code_id = f"qr-noticias-{noticia_id}"
-        link = db.query(Link).filter(Link.identifier == identifier).first()
-        
-        # Truncar título se necessário para campanha (máx 200 chars)
-        # Definir campanha antes do if/else para uso em ambos os blocos
-        campanha = noticia.titulo[:200] if noticia.titulo and len(noticia.titulo) > 200 else (noticia.titulo or "Notícia")
-        
-        if not link:
-            # Criar novo link rastreável
-            
-            # Auto-gerar UTMs para notícias
-            link = Link(
-                identifier=identifier,
-                destination_url=url,
-                ponto_dooh="Notícias",
-                campanha=campanha,
-                qr_code_id=qr_code_id,
-                tipo_midia="DOOH",  # Padrão para notícias
-                utm_source="dooh",
-                utm_medium="digital",
-                utm_campaign=campanha[:200] if len(campanha) > 200 else campanha,
-                utm_content=qr_code_id
-            )
-            db.add(link)
-            db.commit()
-            db.refresh(link)
-            print(f"[QR Code] Link rastreável criado: {identifier}")
-        else:
-            # Atualizar URL de destino se mudou
-            if link.destination_url != url:
-                link.destination_url = url
-                db.commit()
-                print(f"[QR Code] Link rastreável atualizado: {identifier}")
-            
-            # Garantir que tem qr_code_id e UTMs (para links antigos)
-            if not link.qr_code_id:
-                link.qr_code_id = qr_code_id
-            if not link.utm_source:
-                link.utm_source = "dooh"
-            if not link.utm_medium:
-                link.utm_medium = "digital"
-            if not link.utm_campaign:
-                link.utm_campaign = campanha[:200] if len(campanha) > 200 else campanha
-            if not link.utm_content:
-                link.utm_content = qr_code_id
-            if not link.tipo_midia:
-                link.tipo_midia = "DOOH"
-            db.commit()
-        
-        # Gerar URL do link rastreável
-        base_url = str(request.base_url).rstrip('/')
+        # Link rastreável provisionado na ingestão (noticia_links): este GET não grava no banco
+        identifier = Noticia.identificador_tracking(noticia_id)
+        base_url = base_url_qrcode(str(request.base_url))
         tracking_url = f"{base_url}/r/{identifier}"
+        qr_prerender.registrar_base_url(base_url)
         
-        print(f"[QR Code] Gerando QR code para URL rastreável: {tracking_url}")
+        # A imagem só depende da URL rastreável e do tamanho: revalidação pelo ETag
+        chave_imagem = qr_cache_chave(tracking_url, tamanho)
+        if _etag_confere(request.headers.get("if-none-match"), f'"{chave_imagem}"'):
+            return Response(status_code=304, headers=_headers_qrcode(chave_imagem, v, tracking_url))
         
-        # Configurações diferentes para telas pequenas vs normais
-        if tamanho == "pequeno":
-            # Para telas muito pequenas: correção de erro baixa para simplificar o QR code
-            error_correction = qrcode.constants.ERROR_CORRECT_L  # Correção baixa (~7%) para menos detalhamento
-            box_size = 8  # Módulos menores
-            border = 2  # Borda mínima
-            print(f"[QR Code] Usando configuração para tela pequena: error_correction=L, box_size={box_size}, border={border}")
-        else:
-            # Para telas maiores: correção de erro média e módulos menores
-            error_correction = qrcode.constants.ERROR_CORRECT_M  # Correção média (~15%) ao invés de H (~30%)
-            box_size = 10  # Módulos menores para menos detalhamento
-            border = 3  # Borda menor
-            print(f"[QR Code] Usando configuração normal: error_correction=M, box_size={box_size}, border={border}")
+        if db.query(Link.id).filter(Link.identifier == identifier).first() is None:
+            print(f"[QR Code] Aviso: link rastreável {identifier} ainda não provisionado (python noticia_links.py --backfill)")
         
-        # Criar QR code - otimizado para telas de baixa resolução e escaneamento à distância
-        qr = qrcode.QRCode(
-            version=None,  # Deixa a biblioteca escolher a versão mínima necessária
-            error_correction=error_correction,
-            box_size=box_size,
-            border=border,
-        )
-        qr.add_data(tracking_url)
-        qr.make(fit=True)
-        
-        # Criar imagem com alto contraste
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Converter para bytes com qualidade máxima
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format='PNG', optimize=False)
-        img_bytes.seek(0)
-        
-        tamanho_bytes = len(img_bytes.getvalue())
-        print(f"[QR Code] QR code gerado com sucesso. Tamanho: {tamanho_bytes} bytes, versão: {qr.version}")
-        
-        # Adicionar headers para evitar cache e garantir que a imagem seja servida corretamente
-        headers = {
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0"
-        }
+        print(f"[QR Code] QR code para URL rastreável: {tracking_url}")
         
-        return Response(content=img_bytes.getvalue(), media_type="image/png", headers=headers)
+        png, chave_imagem = qr_cache.obter(identifier, tracking_url, tamanho)
+        print(f"[QR Code] QR code servido. Tamanho: {len(png)} bytes, chave: {chave_imagem}")
+        return Response(content=png, media_type="image/png", headers=_headers_qrcode(chave_imagem, v, tracking_url))
     except HTTPException:
         raise
     except Exception as e:
@@ -359,7 +394,7 @@ async def tela_clima(request: Request):
     return HTMLResponse(content=content)
 
 @app.get("/api/clima")
-async def obter_dados_clima(cidade: str = None, estado: str = None):
+def obter_dados_clima(cidade: str = None, estado: str = None):
     """Retorna dados meteorológicos atuais e previsão.
     
     - Se nenhum parâmetro for passado, usa as coordenadas padrão (Cajazeiras - PB)
@@ -405,7 +440,7 @@ async def obter_dados_clima(cidade: str = None, estado: str = None):
 
 # Gestão de Links
 @app.post("/api/links", response_model=LinkResponse, status_code=201)
-async def criar_link(link_data: LinkCreate, db: Session = Depends(get_db)):
+def criar_link(link_data: LinkCreate, db: Session = Depends(get_db)):
     """Cria um novo link rastreável"""
     # Verificar se identifier já existe
     link_existente = db.query(Link).filter(Link.identifier == link_data.identifier).first()
@@ -438,13 +473,14 @@ async def criar_link(link_data: LinkCreate, db: Session = Depends(get_db)):
     db.add(novo_link)
     db.commit()
     db.refresh(novo_link)
+    link_cache.invalidate(novo_link.identifier)
     
     # Retornar com total_clicks = 0
     link_dict = novo_link.to_dict(include_clicks_count=True, db=db)
     return LinkResponse(**link_dict)
 
 @app.get("/api/links", response_model=LinkList)
-async def listar_links(
+def listar_links(
     skip: int = 0,
     limit: int = 100,
     ponto_dooh: str = None,
@@ -470,7 +506,7 @@ async def listar_links(
     return LinkList(links=links_response, total=total)
 
 @app.get("/api/links/{link_id}", response_model=LinkResponse)
-async def obter_link(link_id: int, db: Session = Depends(get_db)):
+def obter_link(link_id: int, db: Session = Depends(get_db)):
     """Obtém um link específico"""
     link = db.query(Link).filter(Link.id == link_id).first()
     if not link:
@@ -480,94 +516,98 @@ async def obter_link(link_id: int, db: Session = Depends(get_db)):
     return LinkResponse(**link_dict)
 
 @app.delete("/api/links/{link_id}", status_code=204)
-async def deletar_link(link_id: int, db: Session = Depends(get_db)):
-    """Deleta um link e todos os seus cliques (cascade)"""
+def deletar_link(link_id: int, db: Session = Depends(get_db)):
+    """Deleta um link e todos os seus cliques (cascade)
+    
+    Links de notícias são recriados em seguida (sem os cliques): o QR code
+    da notícia continua nas telas e não pode passar a dar 404.
+    """
     link = db.query(Link).filter(Link.id == link_id).first()
     if not link:
         raise HTTPException(status_code=404, detail="Link não encontrado")
     
+    noticia = noticia_links.noticia_do_link(db, link.identifier)
     db.delete(link)
     db.commit()
+    link_cache.invalidate(link.identifier)
+    qr_cache.invalidate(link.identifier)
+    analytics_cache.clear()
+    if noticia is not None:
+        noticia_links.provisionar_links(db, [noticia])
     return Response(status_code=204)
 
 # Rastreamento
+def _resolver_link(identifier: str):
+    """Busca o link no banco e guarda no cache (roda no threadpool)"""
+    db = SessionLocal()
+    try:
+        link_db = db.query(Link).filter(Link.identifier == identifier).first()
+        return link_cache.put(link_db) if link_db else None
+    finally:
+        db.close()
+
 @app.get("/r/{identifier}")
-async def rastrear_e_redirecionar(identifier: str, request: Request, db: Session = Depends(get_db)):
-    """Rastreia um clique e redireciona para a URL de destino com UTMs"""
-    # Buscar link
-    link = db.query(Link).filter(Link.identifier == identifier).first()
-    if not link:
-        raise HTTPException(status_code=404, detail=f"Link com identifier '{identifier}' não encontrado")
+async def rastrear_e_redirecionar(identifier: str, request: Request):
+    """Rastreia um clique e redireciona para a URL de destino com UTMs
+    
+    Não bloqueia o event loop: em cache hit não há I/O; em cache miss a
+    consulta ao banco roda no threadpool
+    """
+    # Buscar link (cache com destino e UTMs pré-calculados)
+    link = link_cache.get(identifier)
+    if link is None:
+        link = await run_in_threadpool(_resolver_link, identifier)
+        if link is None:
+            raise HTTPException(status_code=404, detail=f"Link com identifier '{identifier}' não encontrado")
     
     # Rastrear clique (não bloqueia se falhar)
+    # Apenas captura o scan bruto; enriquecimento e persistência rodam no pipeline.
+    # Repetições do mesmo dispositivo dentro da janela reutilizam o click_id da sessão.
     click_id = None
+    
+    # Acima do limite (scans idênticos do mesmo cliente ou por identifier): redireciona sem rastrear
+    if not rate_limiter.permitir_redirect(TrackingService.get_client_ip(request), identifier, request.headers.get("user-agent")):
+        return RedirectResponse(url=link.destino(), status_code=302)
+    
     try:
-        click = TrackingService.track_click(db, link.id, request)
-        if click:
-            click_id = click.id
+        scan = TrackingService.capture_scan(link.link_id, request)
+        click_id_sessao = scan_sessions.get(scan)
+        if click_id_sessao:
+            click_writer.add_repeat(click_id_sessao)
+            click_id = click_id_sessao
+        elif click_pipeline.submit(scan):
+            scan_sessions.put(scan)
+            click_id = scan["click_id"]
     except Exception as e:
-        logger.error(f"Erro ao rastrear clique para link {link.id}: {e}")
+        logger.error(f"Erro ao rastrear clique para link {link.link_id}: {e}")
         # Continua mesmo se tracking falhar
     
-    # Construir URL de destino com UTMs
-    destination_url = link.destination_url
-    
-    # Se o link tem UTMs configurados, adicionar à URL
-    utm_params = {}
-    if link.utm_source:
-        utm_params["utm_source"] = link.utm_source
-    if link.utm_medium:
-        utm_params["utm_medium"] = link.utm_medium
-    if link.utm_campaign:
-        utm_params["utm_campaign"] = link.utm_campaign
-    if link.utm_content:
-        utm_params["utm_content"] = link.utm_content
-    if link.utm_term:
-        utm_params["utm_term"] = link.utm_term
-    
-    if utm_params:
-        # Parse da URL para adicionar query params
-        parsed = urlparse(destination_url)
-        existing_params = parse_qs(parsed.query)
-        
-        # Adicionar UTMs (não sobrescrever se já existirem)
-        for key, value in utm_params.items():
-            if key not in existing_params:
-                existing_params[key] = [value]
-        
-        # Reconstruir URL com novos params
-        new_query = urlencode(existing_params, doseq=True)
-        destination_url = urlunparse((
-            parsed.scheme,
-            parsed.netloc,
-            parsed.path,
-            parsed.params,
-            new_query,
-            parsed.fragment
-        ))
-    
-    # Adicionar click_id à URL para tracking pós-scan
-    if click_id:
-        parsed = urlparse(destination_url)
-        existing_params = parse_qs(parsed.query)
-        if 'click_id' not in existing_params:
-            existing_params['click_id'] = [str(click_id)]
-            new_query = urlencode(existing_params, doseq=True)
-            destination_url = urlunparse((
-                parsed.scheme,
-                parsed.netloc,
-                parsed.path,
-                parsed.params,
-                new_query,
-                parsed.fragment
-            ))
-    
-    # Redirecionar
-    return RedirectResponse(url=destination_url, status_code=302)
+    # Redirecionar para o destino com UTMs (e click_id para tracking pós-scan)
+    return RedirectResponse(url=link.destino(click_id), status_code=302)
+
+@app.get("/api/tracking/stats")
+async def obter_estatisticas_tracking():
+    """Métricas internas do caminho de rastreamento e do analytics (fila, caches)"""
+    return {
+        "click_pipeline": click_pipeline.stats(),
+        "click_writer": click_writer.stats(),
+        "scan_sessions": scan_sessions.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "link_cache": link_cache.stats(),
+        "user_agent_cache": user_agent_cache.stats(),
+        "analytics_cache": analytics_cache.stats(),
+        "click_snapshot": click_snapshot.stats(),
+        "noticia_pool": noticia_pool.stats(),
+        "qr_cache": qr_cache.stats(),
+        "qr_prerender": qr_prerender.stats()
+    }
 
 # Tracking de Eventos de Conversão
+TIPOS_EVENTO_VALIDOS = ["pageview", "scroll", "cta_click", "whatsapp", "form", "download", "call", "purchase"]
+MAX_EVENTOS_POR_LOTE = int(os.getenv("MAX_EVENTOS_POR_LOTE", "100"))
+
 @app.post("/api/tracking/event", response_model=ConversionEventResponse, status_code=201)
-async def registrar_evento_conversao(event_data: ConversionEventCreate, db: Session = Depends(get_db)):
+def registrar_evento_conversao(event_data: ConversionEventCreate, request: Request, db: Session = Depends(get_db)):
     """
     Registra um evento de conversão/comportamento pós-scan
     
@@ -581,17 +621,19 @@ async def registrar_evento_conversao(event_data: ConversionEventCreate, db: Sess
     - call: Chamada telefônica
     - purchase: Compra/Conversão final
     """
-    # Verificar se o click existe
+    if not rate_limiter.permitir_evento(TrackingService.get_client_ip(request)):
+        raise HTTPException(status_code=429, detail="Muitas requisições. Tente novamente em instantes.")
+    
+    # Verificar se o click existe (ou ainda está na fila do pipeline)
     click = db.query(Click).filter(Click.id == event_data.click_id).first()
-    if not click:
+    if not click and not click_pipeline.is_pending(event_data.click_id):
         raise HTTPException(status_code=404, detail=f"Click com ID {event_data.click_id} não encontrado")
     
     # Validar tipo de evento
-    tipos_validos = ["pageview", "scroll", "cta_click", "whatsapp", "form", "download", "call", "purchase"]
-    if event_data.event_type not in tipos_validos:
+    if event_data.event_type not in TIPOS_EVENTO_VALIDOS:
         raise HTTPException(
             status_code=400, 
-            detail=f"Tipo de evento inválido. Tipos válidos: {', '.join(tipos_validos)}"
+            detail=f"Tipo de evento inválido. Tipos válidos: {', '.join(TIPOS_EVENTO_VALIDOS)}"
         )
     
     # Criar evento
@@ -599,7 +641,8 @@ async def registrar_evento_conversao(event_data: ConversionEventCreate, db: Sess
         click_id=event_data.click_id,
         event_type=event_data.event_type,
         event_value=event_data.event_value,
-        occurred_at=agora_brasil()
+        occurred_at=agora_brasil(),
+        **conversion_events.campos_tipados(event_data.event_type, event_data.event_value)
     )
     
     db.add(evento)
@@ -610,19 +653,96 @@ async def registrar_evento_conversao(event_data: ConversionEventCreate, db: Sess
     
     return ConversionEventResponse(**evento.to_dict())
 
+def _registrar_eventos_lote(eventos: List[ConversionEventCreate]) -> int:
+    """Valida os click_ids com uma única consulta IN e insere os eventos em uma transação"""
+    db = SessionLocal()
+    try:
+        ids = {e.click_id for e in eventos}
+        existentes = {
+            click_id for (click_id,) in
+            db.query(Click.id).filter(Click.id.in_(ids)).all()
+        }
+        validos = {cid for cid in ids if cid in existentes or click_pipeline.is_pending(cid)}
+        
+        agora = agora_brasil()
+        rows = [
+            {
+                "click_id": e.click_id,
+                "event_type": e.event_type,
+                "event_value": e.event_value,
+                "occurred_at": agora,
+                **conversion_events.campos_tipados(e.event_type, e.event_value)
+            }
+            for e in eventos if e.click_id in validos
+        ]
+        if rows:
+            db.execute(insert(ConversionEvent), rows)
+            db.commit()
+        return len(rows)
+    finally:
+        db.close()
+
+@app.post("/api/tracking/events", response_model=ConversionEventBatchResponse)
+async def registrar_eventos_lote(request: Request):
+    """
+    Registra vários eventos de conversão em uma única requisição
+    
+    Aceita um array de eventos ou {"events": [...]}. O corpo é lido como JSON
+    independente do Content-Type, para suportar navigator.sendBeacon (text/plain).
+    Eventos inválidos (tipo desconhecido, click inexistente) são descartados
+    individualmente e contados em "rejected".
+    """
+    if not rate_limiter.permitir_evento(TrackingService.get_client_ip(request)):
+        raise HTTPException(status_code=429, detail="Muitas requisições. Tente novamente em instantes.")
+    
+    try:
+        payload = json.loads(await request.body() or b"null")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Corpo da requisição não é um JSON válido")
+    
+    itens = payload.get("events") if isinstance(payload, dict) else payload
+    if not isinstance(itens, list):
+        raise HTTPException(status_code=400, detail="Envie um array de eventos ou {\"events\": [...]}")
+    if len(itens) > MAX_EVENTOS_POR_LOTE:
+        raise HTTPException(status_code=413, detail=f"Máximo de {MAX_EVENTOS_POR_LOTE} eventos por lote")
+    
+    eventos = []
+    for item in itens:
+        try:
+            evento = ConversionEventCreate.model_validate(item)
+        except ValidationError:
+            continue
+        if evento.event_type in TIPOS_EVENTO_VALIDOS:
+            eventos.append(evento)
+    
+    aceitos = await run_in_threadpool(_registrar_eventos_lote, eventos) if eventos else 0
+    
+    logger.info(f"Lote de eventos de conversão: {aceitos} aceitos, {len(itens) - aceitos} rejeitados")
+    
+    return ConversionEventBatchResponse(accepted=aceitos, rejected=len(itens) - aceitos)
+
 # Analytics
 @app.get("/api/analytics", response_model=AnalyticsResponse)
-async def obter_analytics(
+def obter_analytics(
     ponto_dooh: str = None,
     campanha: str = None,
     link_id: int = None,
     start_date: str = None,
     end_date: str = None,
+    top_n: int = Query(ANALYTICS_TOP_LINKS, ge=1, le=100),
+    unique_ips_mode: str = Query("auto", pattern="^(auto|exact|approx)$"),
     db: Session = Depends(get_db)
 ):
     """Obtém métricas agregadas de analytics com filtros opcionais"""
-    metrics = AnalyticsService.get_link_analytics(
-        db, ponto_dooh, campanha, link_id, start_date, end_date
+    periodo = PeriodoAnalytics(start_date, end_date)
+    chave = ("analytics", ponto_dooh or None, campanha or None, link_id or None,
+             periodo.inicio, periodo.fim, top_n, unique_ips_mode)
+    metrics = analytics_cache.obter(
+        db, chave,
+        lambda: AnalyticsService.get_link_analytics(
+            db, ponto_dooh, campanha, link_id, start_date, end_date, top_n, unique_ips_mode
+        ),
+        fim=periodo.fim
     )
     
     # Converter top_links para TopLink
@@ -631,6 +751,7 @@ async def obter_analytics(
     return AnalyticsResponse(
         total_clicks=metrics["total_clicks"],
         unique_ips=metrics["unique_ips"],
+        unique_ips_approximate=metrics["unique_ips_approximate"],
         clicks_by_ponto=metrics["clicks_by_ponto"],
         clicks_by_campanha=metrics["clicks_by_campanha"],
         clicks_by_device=metrics["clicks_by_device"],
@@ -639,10 +760,42 @@ async def obter_analytics(
         top_links=top_links
     )
 
+@app.get("/api/analytics/heatmap", response_model=HeatmapAnalytics)
+def obter_heatmap(
+    ponto_dooh: str = None,
+    campanha: str = None,
+    link_id: int = None,
+    start_date: str = None,
+    end_date: str = None,
+    db: Session = Depends(get_db)
+):
+    """Scans e conversões por dia da semana x hora (horário de Brasília)"""
+    periodo = PeriodoAnalytics(start_date, end_date)
+    chave = ("heatmap", ponto_dooh or None, campanha or None, link_id or None, periodo.inicio, periodo.fim)
+    heatmap = analytics_cache.obter(
+        db, chave,
+        lambda: AnalyticsService.get_heatmap(db, ponto_dooh, campanha, link_id, start_date, end_date),
+        fim=periodo.fim,
+        incluir_eventos=True
+    )
+    return HeatmapAnalytics(**heatmap)
+
 @app.get("/api/analytics/link/{link_id}", response_model=LinkAnalytics)
-async def obter_analytics_link(link_id: int, start_date: str = None, end_date: str = None, db: Session = Depends(get_db)):
+def obter_analytics_link(
+    link_id: int,
+    start_date: str = None,
+    end_date: str = None,
+    unique_ips_mode: str = Query("auto", pattern="^(auto|exact|approx)$"),
+    db: Session = Depends(get_db)
+):
     """Obtém métricas específicas de um link"""
-    analytics = AnalyticsService.get_link_specific_analytics(db, link_id, start_date, end_date)
+    periodo = PeriodoAnalytics(start_date, end_date)
+    chave = ("link", link_id, periodo.inicio, periodo.fim, unique_ips_mode)
+    analytics = analytics_cache.obter(
+        db, chave,
+        lambda: AnalyticsService.get_link_specific_analytics(db, link_id, start_date, end_date, unique_ips_mode),
+        fim=periodo.fim
+    )
     
     if not analytics:
         raise HTTPException(status_code=404, detail="Link não encontrado")
@@ -651,7 +804,7 @@ async def obter_analytics_link(link_id: int, start_date: str = None, end_date: s
 
 
 @app.get("/api/analytics/conversions", response_model=ConversionMetrics)
-async def obter_metricas_conversao(
+def obter_metricas_conversao(
     link_id: int = None,
     click_id: int = None,
     start_date: str = None,
@@ -659,9 +812,56 @@ async def obter_metricas_conversao(
     db: Session = Depends(get_db)
 ):
     """Obtém métricas de conversão/comportamento pós-scan"""
-    metrics = AnalyticsService.get_conversion_metrics(db, link_id, click_id, start_date, end_date)
+    periodo = PeriodoAnalytics(start_date, end_date)
+    chave = ("conversions", link_id or None, click_id or None, periodo.inicio, periodo.fim)
+    metrics = analytics_cache.obter(
+        db, chave,
+        lambda: AnalyticsService.get_conversion_metrics(db, link_id, click_id, start_date, end_date),
+        fim=periodo.fim,
+        incluir_eventos=True
+    )
     return ConversionMetrics(**metrics)
 
+# Exportação de dados brutos
+def _resposta_export(request: Request, nome: str, formato: str, partes) -> StreamingResponse:
+    """StreamingResponse com as linhas exportadas, comprimida em gzip se o cliente aceitar"""
+    headers = {
+        "Content-Disposition": f'attachment; filename="{nome}-{agora_brasil().strftime("%Y%m%d-%H%M%S")}.{formato}"',
+        "Vary": "Accept-Encoding",
+    }
+    if ExportService.aceita_gzip(request.headers.get("accept-encoding")):
+        partes = ExportService.gzip(partes)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(partes, media_type=FORMATOS_EXPORT[formato], headers=headers)
+
+@app.get("/api/export/clicks")
+def exportar_cliques(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    ponto_dooh: str = None,
+    campanha: str = None,
+    link_id: int = None,
+    start_date: str = None,
+    end_date: str = None
+):
+    """Exporta os cliques brutos em CSV ou NDJSON (mesmos filtros de /api/analytics)"""
+    partes = ExportService.clicks(format, ponto_dooh, campanha, link_id, start_date, end_date)
+    return _resposta_export(request, "clicks", format, partes)
+
+@app.get("/api/export/events")
+def exportar_eventos(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    ponto_dooh: str = None,
+    campanha: str = None,
+    link_id: int = None,
+    start_date: str = None,
+    end_date: str = None
+):
+    """Exporta os eventos de conversão brutos em CSV ou NDJSON (filtrados pelo link do clique)"""
+    partes = ExportService.events(format, ponto_dooh, campanha, link_id, start_date, end_date)
+    return _resposta_export(request, "events", format, partes)
+
 if __name__ == "__main__":
     import uvicorn
     import os
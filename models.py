@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, Date, Boolean, ForeignKey, Index, LargeBinary, or_
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -21,6 +21,25 @@ class Noticia(Base):
     ativa = Column(Boolean, default=True)
     ordem = Column(Integer, default=0)
     
+    # Filtro de frescor: (data_publicacao) para o primeiro ramo do OR,
+    # (data_publicacao IS NULL, data_criacao) para o segundo
+    __table_args__ = (
+        Index("ix_noticias_publicacao_criacao", "data_publicacao", "data_criacao"),
+    )
+    
+    @staticmethod
+    def filtro_recente(limite_data):
+        """Notícias recentes: data_publicacao quando existir, senão data_criacao"""
+        return or_(
+            (Noticia.data_publicacao != None) & (Noticia.data_publicacao >= limite_data),
+            (Noticia.data_publicacao == None) & (Noticia.data_criacao != None) & (Noticia.data_criacao >= limite_data)
+        )
+    
+    @staticmethod
+    def identificador_tracking(noticia_id: int) -> str:
+        """Identifier do link rastreável (/r/<identifier>) usado no QR code da notícia"""
+        return f"noticia-{noticia_id}"
+    
     def to_dict(self):
         return {
             "id": self.id,
@@ -60,8 +79,16 @@ class Link(Base):
     created_at = Column(DateTime, default=now_brasil)
     updated_at = Column(DateTime, default=now_brasil, onupdate=now_brasil)
     
+    # Filtros do analytics por ponto (e campanha) e por campanha
+    __table_args__ = (
+        Index("ix_links_ponto_campanha", "ponto_dooh", "campanha"),
+        Index("ix_links_campanha", "campanha"),
+    )
+    
     # Relacionamento
     clicks = relationship("Click", back_populates="link", cascade="all, delete-orphan")
+    rollups = relationship("ClickRollupHora", cascade="all, delete-orphan")
+    ip_sketches = relationship("ClickIpSketchDia", cascade="all, delete-orphan")
     
     def to_dict(self, include_clicks_count=False, db=None):
         from timezone_utils import converter_para_brasil, strftime_brasil
@@ -123,6 +150,14 @@ class Click(Base):
     
     clicked_at = Column(DateTime, default=now_brasil, index=True)
     
+    # Scans repetidos do mesmo dispositivo dentro da janela de sessão (não geram nova linha)
+    repeat_count = Column(Integer, nullable=False, default=0, server_default="0")
+    
+    # Analytics e exportação filtram por link e período de clicked_at
+    __table_args__ = (
+        Index("ix_clicks_link_clicked_at", "link_id", "clicked_at"),
+    )
+    
     # Relacionamento
     link = relationship("Link", back_populates="clicks")
     
@@ -143,9 +178,48 @@ class Click(Base):
             "isp": self.isp,
             "timezone": self.timezone,
             "clicked_at": self.clicked_at.isoformat() if self.clicked_at else None,
+            "repeat_count": self.repeat_count or 0,
         }
 
 
+class ClickRollupHora(Base):
+    """
+    Contagem de cliques por hora (horário de Brasília), link, dispositivo e país
+    
+    Mantida pelo ClickWriter na mesma transação do INSERT dos cliques
+    (ver click_rollups.py). device_type/country vazios são gravados como "unknown".
+    """
+    __tablename__ = "click_rollup_hora"
+    
+    link_id = Column(Integer, ForeignKey("links.id", ondelete="CASCADE"), primary_key=True)
+    hora = Column(DateTime, primary_key=True)  # Início da hora (minuto/segundo zerados)
+    device_type = Column(String(50), primary_key=True)
+    country = Column(String(100), primary_key=True)
+    clicks = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ix_click_rollup_hora_hora", "hora"),
+    )
+
+
+class ClickIpSketchDia(Base):
+    """
+    Sketch HyperLogLog dos IPs que clicaram no link em um dia (horário de Brasília)
+    
+    Mantido junto com os rollups horários; sketches de dias e links diferentes
+    são mesclados para estimar IPs únicos de qualquer intervalo (ver hyperloglog.py).
+    """
+    __tablename__ = "click_ip_sketch_dia"
+    
+    link_id = Column(Integer, ForeignKey("links.id", ondelete="CASCADE"), primary_key=True)
+    dia = Column(Date, primary_key=True)
+    sketch = Column(LargeBinary, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_click_ip_sketch_dia_dia", "dia"),
+    )
+
+
 class ConversionEvent(Base):
     __tablename__ = "conversion_events"
     
@@ -155,6 +229,15 @@ class ConversionEvent(Base):
     event_value = Column(Text, nullable=True)  # Dados adicionais (JSON string)
     occurred_at = Column(DateTime, default=now_brasil, index=True)
     
+    # Campos de event_value extraídos na gravação (ver conversion_events.campos_tipados)
+    scroll_depth = Column(Integer, nullable=True)  # "depth" de eventos scroll (25, 50, 75, 100)
+    time_on_page_s = Column(Float, nullable=True)  # "time_on_page" de eventos pageview, em segundos
+    
+    # Métricas de conversão filtram por tipo de evento e período
+    __table_args__ = (
+        Index("ix_conversion_events_type_occurred_at", "event_type", "occurred_at"),
+    )
+    
     # Relacionamento
     click = relationship("Click", backref="conversion_events")
     
@@ -0,0 +1,167 @@
+"""
+Links rastreáveis das notícias (identifier noticia-{id}, codificado no QR code)
+Criados e atualizados em lote na ingestão das notícias (scheduler e
+/api/noticias/atualizar) e na edição pelo painel, de forma que o GET do
+QR code seja somente leitura e não dispute o banco com a gravação de cliques.
+Um link de notícia removido pelo painel é recriado na hora (sem os cliques)
+e o scheduler recria os que faltarem após cada ingestão.
+
+Preenchimento das notícias existentes (cria os links que faltam e completa
+destino e UTMs dos antigos):
+    python noticia_links.py --backfill
+"""
+import argparse
+from typing import Iterable, Optional
+from sqlalchemy.orm import Session
+from models import Noticia, Link
+from link_cache import link_cache
+from analytics_cache import analytics_cache
+
+PONTO_DOOH_NOTICIAS = "Notícias"
+
+
+def normalizar_url(url: str) -> str:
+    """Garante que a URL da notícia seja válida e completa"""
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        # Se não começar com http/https, adicionar https://
+        if url.startswith('//'):
+            url = 'https:' + url
+        elif url.startswith('/'):
+            url = 'https://radiocentrocz.com.br' + url
+        else:
+            url = 'https://' + url
+    return url
+
+
+def _qr_code_id(noticia_id: int) -> str:
+    return f"qr-noticias-{noticia_id}"
+
+
+def _campanha(noticia: Noticia) -> str:
+    # Truncar título se necessário para campanha (máx 200 chars)
+    return noticia.titulo[:200] if noticia.titulo else "Notícia"
+
+
+def _novo_link(noticia: Noticia) -> Link:
+    """Link rastreável com UTMs gerados automaticamente para a notícia"""
+    campanha = _campanha(noticia)
+    qr_code_id = _qr_code_id(noticia.id)
+    return Link(
+        identifier=Noticia.identificador_tracking(noticia.id),
+        destination_url=normalizar_url(noticia.url),
+        ponto_dooh=PONTO_DOOH_NOTICIAS,
+        campanha=campanha,
+        qr_code_id=qr_code_id,
+        tipo_midia="DOOH",  # Padrão para notícias
+        utm_source="dooh",
+        utm_medium="digital",
+        utm_campaign=campanha,
+        utm_content=qr_code_id
+    )
+
+
+def _completar_link(link: Link, noticia: Noticia) -> bool:
+    """Atualiza destino e preenche UTMs ausentes (links antigos); retorna se o destino mudou"""
+    url = normalizar_url(noticia.url)
+    destino_mudou = link.destination_url != url
+    if destino_mudou:
+        link.destination_url = url
+
+    qr_code_id = _qr_code_id(noticia.id)
+    if not link.qr_code_id:
+        link.qr_code_id = qr_code_id
+    if not link.utm_source:
+        link.utm_source = "dooh"
+    if not link.utm_medium:
+        link.utm_medium = "digital"
+    if not link.utm_campaign:
+        link.utm_campaign = _campanha(noticia)
+    if not link.utm_content:
+        link.utm_content = qr_code_id
+    if not link.tipo_midia:
+        link.tipo_midia = "DOOH"
+    return destino_mudou
+
+
+def provisionar_links(db: Session, noticias: Optional[Iterable[Noticia]] = None) -> dict:
+    """
+    Cria ou atualiza os links rastreáveis das notícias (todas, se não informadas)
+
+    As notícias precisam ter id (após flush/commit). Faz um único commit e
+    invalida o link_cache dos links alterados.
+    """
+    if noticias is None:
+        noticias = db.query(Noticia).all()
+    noticias = [n for n in noticias if n.url]
+    if not noticias:
+        return {"criados": 0, "atualizados": 0}
+
+    por_identifier = {Noticia.identificador_tracking(n.id): n for n in noticias}
+    existentes = {
+        link.identifier: link
+        for link in db.query(Link).filter(Link.identifier.in_(list(por_identifier)))
+    }
+
+    criados = []
+    alterados = []
+    destino_alterado = False
+    for identifier, noticia in por_identifier.items():
+        link = existentes.get(identifier)
+        if link is None:
+            criados.append(_novo_link(noticia))
+            continue
+        destino_alterado |= _completar_link(link, noticia)
+        if db.is_modified(link):
+            alterados.append(identifier)
+
+    if not criados and not alterados:
+        return {"criados": 0, "atualizados": 0}
+    db.add_all(criados)
+    db.commit()
+
+    for identifier in alterados + [link.identifier for link in criados]:
+        link_cache.invalidate(identifier)
+    if destino_alterado:
+        analytics_cache.clear()
+    return {"criados": len(criados), "atualizados": len(alterados)}
+
+
+def noticia_do_link(db: Session, identifier: str) -> Optional[Noticia]:
+    """Notícia dona do link (identifier noticia-{id}), se existir e tiver URL"""
+    sufixo = identifier.rpartition("-")[2]
+    if not sufixo.isdigit() or Noticia.identificador_tracking(int(sufixo)) != identifier:
+        return None
+    noticia = db.query(Noticia).filter(Noticia.id == int(sufixo)).first()
+    return noticia if noticia is not None and noticia.url else None
+
+
+def preencher_faltantes(db: Session) -> dict:
+    """Cria os links das notícias que ainda não têm (bancos anteriores ao provisionamento na ingestão)"""
+    identificadores = {identifier for (identifier,) in db.query(Link.identifier)}
+    ids = [
+        noticia_id for (noticia_id,) in db.query(Noticia.id).filter(Noticia.url != "")
+        if Noticia.identificador_tracking(noticia_id) not in identificadores
+    ]
+    if not ids:
+        return {"criados": 0, "atualizados": 0}
+    return provisionar_links(db, db.query(Noticia).filter(Noticia.id.in_(ids)).all())
+
+
+if __name__ == "__main__":
+    from database import Base, engine, SessionLocal
+
+    parser = argparse.ArgumentParser(description="Links rastreáveis das notícias")
+    parser.add_argument("--backfill", action="store_true", help="Cria e completa os links de todas as notícias")
+    args = parser.parse_args()
+
+    if not args.backfill:
+        parser.print_help()
+    else:
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        try:
+            resultado = provisionar_links(db)
+            print(f"Links criados: {resultado['criados']}, atualizados: {resultado['atualizados']}")
+        finally:
+            db.close()
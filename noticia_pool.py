@@ -0,0 +1,148 @@
+"""
+Pool em memória das notícias exibíveis pelas telas (/api/noticias/aleatoria)
+Guarda o to_dict() das notícias ativas e recentes (data_publicacao, ou
+data_criacao na falta dela, nos últimos NOTICIAS_FRESCOR_DIAS dias), de forma
+que o sorteio seja um random.choice sobre uma tupla, sem consultar o banco.
+
+O pool é reconstruído após a ingestão do scheduler e após alterações nas
+notícias; notícias que envelhecem saem dele sem nova consulta.
+
+A versão do pool muda sempre que o conjunto de notícias muda (reconstrução
+com conteúdo diferente ou expiração) e serve de ETag da playlist das telas.
+"""
+import os
+import random
+import secrets
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy.orm import Session
+from models import Noticia
+from timezone_utils import agora_brasil
+
+# Janela de frescor das notícias exibidas
+NOTICIAS_FRESCOR_DIAS = int(os.getenv("NOTICIAS_FRESCOR_DIAS", "2"))
+
+
+def _agora() -> datetime:
+    # Datas do SQLite voltam sem tzinfo, no horário de Brasília
+    return agora_brasil().replace(tzinfo=None)
+
+
+class NoticiaPool:
+    """Notícias ativas e recentes já serializadas, com sorteio O(1)"""
+
+    def __init__(self, dias: int = NOTICIAS_FRESCOR_DIAS):
+        self.dias = dias
+        self._itens = ()  # (payload, expira_em), ordenado por expira_em
+        self._valido = False
+        self._geracao = 0  # incrementada a cada invalidação
+        self._instancia = secrets.token_hex(4)  # versões de outro processo não colidem
+        self._versao = 0  # incrementada quando o conteúdo muda
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+        self.expiracoes = 0
+        self.escolhas = 0
+
+    @property
+    def valido(self) -> bool:
+        return self._valido
+
+    @property
+    def versao(self) -> str:
+        return f"{self._instancia}.{self._versao}"
+
+    def rebuild(self, db: Optional[Session] = None) -> int:
+        """Recarrega o pool do banco (abre uma sessão própria se db não for informado)"""
+        from database import SessionLocal
+
+        geracao = self._geracao
+        sessao = db or SessionLocal()
+        try:
+            limite = agora_brasil() - timedelta(days=self.dias)
+            noticias = (
+                sessao.query(Noticia)
+                .filter(Noticia.ativa == True, Noticia.filtro_recente(limite))
+                .all()
+            )
+            itens = []
+            for noticia in noticias:
+                referencia = noticia.data_publicacao or noticia.data_criacao
+                itens.append((noticia.to_dict(), referencia.replace(tzinfo=None) + timedelta(days=self.dias)))
+        finally:
+            if db is None:
+                sessao.close()
+
+        itens.sort(key=lambda item: item[1])
+        itens = tuple(itens)
+        with self._lock:
+            if itens != self._itens:
+                self._itens = itens
+                self._versao += 1
+            # Invalidado durante a leitura: o que foi lido pode estar desatualizado
+            self._valido = geracao == self._geracao
+            self.rebuilds += 1
+        return len(itens)
+
+    def invalidate(self):
+        """Força a reconstrução na próxima escolha"""
+        with self._lock:
+            self._geracao += 1
+            self._valido = False
+
+    def atualizar(self, db: Optional[Session] = None) -> int:
+        """Invalida e reconstrói o pool (após ingestão ou alteração de notícias)"""
+        self.invalidate()
+        return self.rebuild(db)
+
+    def _expirar(self):
+        """Remove as notícias que saíram da janela de frescor (mais antigas primeiro)"""
+        with self._lock:
+            agora = _agora()
+            inicio = 0
+            while inicio < len(self._itens) and self._itens[inicio][1] <= agora:
+                inicio += 1
+            if inicio:
+                self._itens = self._itens[inicio:]
+                self._versao += 1
+                self.expiracoes += inicio
+
+    def _atuais(self) -> tuple:
+        itens = self._itens
+        if itens and itens[0][1] <= _agora():
+            self._expirar()
+            itens = self._itens
+        return itens
+
+    def escolher(self) -> Optional[dict]:
+        """Notícia sorteada do pool (None se vazio); o pool precisa estar válido"""
+        itens = self._atuais()
+        self.escolhas += 1
+        if not itens:
+            return None
+        return random.choice(itens)[0]
+
+    def lote(self, limite: Optional[int] = None) -> tuple:
+        """(versão, até `limite` notícias do pool, mais recentes primeiro); o pool precisa estar válido"""
+        self._atuais()
+        with self._lock:
+            itens, versao = self._itens, self.versao
+        if limite is not None:
+            itens = itens[-limite:]
+        return versao, [payload for payload, _ in reversed(itens)]
+
+    def stats(self) -> dict:
+        itens = self._itens
+        return {
+            "size": len(itens),
+            "valid": self._valido,
+            "version": self.versao,
+            "rebuilds": self.rebuilds,
+            "expired": self.expiracoes,
+            "picks": self.escolhas,
+            "next_expiry": itens[0][1].isoformat() if itens else None
+        }
+
+
+# Instância global usada pela tela de exibição e atualizada pelo scheduler
+noticia_pool = NoticiaPool()
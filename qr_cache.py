@@ -0,0 +1,258 @@
+"""
+Cache das imagens de QR code das notícias (/api/noticias/{id}/qrcode)
+O PNG depende apenas da URL rastreável codificada (/r/<identifier>) e do
+tamanho ("pequeno" ou "normal"), então cada imagem é endereçada por um hash
+dessas entradas e gerada uma única vez:
+
+- memória: LRU limitado (QR_CACHE_SIZE imagens)
+- disco: QR_CACHE_DIR/<hash do identifier>/<chave>.png, sobrevive a reinícios
+
+A chave também serve de ETag; a URL da imagem com ?v=<versão> (enviada na
+playlist das telas) nunca muda de conteúdo e pode ser cacheada como immutable.
+
+O host da URL codificada não vem direto do cabeçalho Host da requisição (que
+o cliente controla): só hosts de QR_ALLOWED_HOSTS são aceitos, os demais usam
+QR_PUBLIC_BASE_URL. Cada pasta de identifier guarda no máximo
+QR_CACHE_MAX_POR_IDENTIFIER imagens (as mais antigas são removidas).
+"""
+import io
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit
+import qrcode
+
+logger = logging.getLogger(__name__)
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente)
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "256"))
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR", os.path.join("cache", "qrcodes"))
+# max-age das imagens versionadas (?v=), padrão 1 ano
+QR_CACHE_MAX_AGE_S = int(os.getenv("QR_CACHE_MAX_AGE_S", "31536000"))
+# Imagens em disco por identifier (hosts x tamanhos); as mais antigas são removidas
+QR_CACHE_MAX_POR_IDENTIFIER = int(os.getenv("QR_CACHE_MAX_POR_IDENTIFIER", "8"))
+# URL pública usada nos QR codes (ex.: http://192.168.1.100:8000)
+QR_PUBLIC_BASE_URL = os.getenv("QR_PUBLIC_BASE_URL", "").rstrip("/")
+# Hosts (host[:porta]) aceitos do cabeçalho Host, separados por vírgula
+QR_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("QR_ALLOWED_HOSTS", "").split(",") if h.strip()]
+
+# Incrementar ao mudar os parâmetros de renderização: invalida as imagens em disco
+QR_RENDER_VERSAO = 1
+
+TAMANHOS = ("normal", "pequeno")
+
+
+def normalizar_tamanho(tamanho: Optional[str]) -> str:
+    """Tamanho da imagem: "pequeno" para telas muito pequenas, "normal" para qualquer outro valor"""
+    return "pequeno" if tamanho == "pequeno" else "normal"
+
+
+def versao(tracking_url: str) -> str:
+    """Hash da URL codificada (e da versão de renderização), usado em ?v= e nas chaves"""
+    return hashlib.sha256(f"{QR_RENDER_VERSAO}\0{tracking_url}".encode("utf-8")).hexdigest()[:16]
+
+
+def chave(tracking_url: str, tamanho: str) -> str:
+    """Chave da imagem (nome do arquivo em disco e ETag)"""
+    return f"{versao(tracking_url)}-{normalizar_tamanho(tamanho)}"
+
+
+def hosts_permitidos() -> list:
+    """Hosts aceitos na URL dos QR codes: QR_ALLOWED_HOSTS e o host de QR_PUBLIC_BASE_URL"""
+    hosts = list(QR_ALLOWED_HOSTS)
+    if QR_PUBLIC_BASE_URL:
+        hosts.append(urlsplit(QR_PUBLIC_BASE_URL).netloc.lower())
+    return hosts
+
+
+def base_url_qrcode(base_url_requisicao: str) -> str:
+    """
+    Base da URL rastreável codificada no QR code para uma requisição
+
+    Host permitido: a própria base da requisição. Outro host: QR_PUBLIC_BASE_URL
+    (ou o primeiro de QR_ALLOWED_HOSTS). Sem nenhuma configuração, usa a base
+    da requisição (o limite por pasta do disco continua valendo).
+    """
+    base_url = base_url_requisicao.rstrip("/")
+    hosts = hosts_permitidos()
+    partes = urlsplit(base_url)
+    if not hosts or partes.netloc.lower() in hosts:
+        return base_url
+    return QR_PUBLIC_BASE_URL or f"{partes.scheme}://{hosts[0]}"
+
+
+def renderizar_qrcode(tracking_url: str, tamanho: str) -> bytes:
+    """Gera o PNG do QR code - otimizado para telas de baixa resolução e escaneamento à distância"""
+    if normalizar_tamanho(tamanho) == "pequeno":
+        # Para telas muito pequenas: correção de erro baixa para simplificar o QR code
+        error_correction = qrcode.constants.ERROR_CORRECT_L  # Correção baixa (~7%) para menos detalhamento
+        box_size = 8  # Módulos menores
+        border = 2  # Borda mínima
+    else:
+        # Para telas maiores: correção de erro média e módulos menores
+        error_correction = qrcode.constants.ERROR_CORRECT_M  # Correção média (~15%) ao invés de H (~30%)
+        box_size = 10  # Módulos menores para menos detalhamento
+        border = 3  # Borda menor
+
+    qr = qrcode.QRCode(
+        version=None,  # Deixa a biblioteca escolher a versão mínima necessária
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(tracking_url)
+    qr.make(fit=True)
+
+    # Criar imagem com alto contraste
+    img = qr.make_image(fill_color="black", back_color="white")
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format="PNG", optimize=False)
+    return img_bytes.getvalue()
+
+
+def _pasta_identifier(diretorio: str, identifier: str) -> str:
+    # Identifiers são livres (podem ter "/" ou ".."): a pasta usa o hash
+    return os.path.join(diretorio, hashlib.sha256(identifier.encode("utf-8")).hexdigest()[:16])
+
+
+class QRCodeCache:
+    """Cache em dois níveis (LRU em memória + disco) dos PNGs de QR code"""
+
+    def __init__(self, maxsize: int = QR_CACHE_SIZE, diretorio: Optional[str] = QR_CACHE_DIR,
+                 max_por_identifier: int = QR_CACHE_MAX_POR_IDENTIFIER):
+        self.maxsize = maxsize
+        self.diretorio = diretorio or None  # vazio desativa o disco
+        self.max_por_identifier = max_por_identifier
+        self._itens = OrderedDict()  # chave -> (identifier, png)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.render_s = 0.0
+        self.disk_evictions = 0
+
+    def caminho(self, identifier: str, chave_imagem: str) -> Optional[str]:
+        if not self.diretorio:
+            return None
+        return os.path.join(_pasta_identifier(self.diretorio, identifier), chave_imagem + ".png")
+
+    def _guardar_memoria(self, chave_imagem: str, identifier: str, png: bytes):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._itens[chave_imagem] = (identifier, png)
+            self._itens.move_to_end(chave_imagem)
+            while len(self._itens) > self.maxsize:
+                self._itens.popitem(last=False)
+
+    def gravar_disco(self, identifier: str, chave_imagem: str, png: bytes):
+        """Grava o PNG de forma atômica (arquivo temporário + os.replace)"""
+        caminho = self.caminho(identifier, chave_imagem)
+        if caminho is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporario, "wb") as arquivo:
+                arquivo.write(png)
+            os.replace(temporario, caminho)
+            self._limitar_pasta(caminho)
+        except OSError as e:
+            logger.warning(f"[QR Cache] Erro ao gravar {caminho}: {e}")
+
+    def _limitar_pasta(self, gravado: str):
+        """Remove as imagens mais antigas da pasta acima de max_por_identifier (mantém a recém-gravada)"""
+        if self.max_por_identifier <= 0:
+            return
+        with os.scandir(os.path.dirname(gravado)) as entradas:
+            arquivos = [
+                (e.stat().st_mtime, e.path) for e in entradas
+                if e.name.endswith(".png") and e.path != gravado
+            ]
+        excesso = len(arquivos) + 1 - self.max_por_identifier
+        if excesso <= 0:
+            return
+        arquivos.sort()
+        removidos = 0
+        for _, caminho in arquivos[:excesso]:
+            try:
+                os.remove(caminho)
+                removidos += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.disk_evictions += removidos
+
+    def obter(self, identifier: str, tracking_url: str, tamanho: str) -> tuple:
+        """(PNG, chave) do QR code da URL rastreável, gerando apenas em cache miss"""
+        chave_imagem = chave(tracking_url, tamanho)
+        with self._lock:
+            entrada = self._itens.get(chave_imagem)
+            if entrada is not None:
+                self._itens.move_to_end(chave_imagem)
+                self.memory_hits += 1
+                return entrada[1], chave_imagem
+
+        caminho = self.caminho(identifier, chave_imagem)
+        if caminho is not None:
+            try:
+                with open(caminho, "rb") as arquivo:
+                    png = arquivo.read()
+            except OSError:
+                png = None
+            if png:
+                with self._lock:
+                    self.disk_hits += 1
+                self._guardar_memoria(chave_imagem, identifier, png)
+                return png, chave_imagem
+
+        inicio = time.perf_counter()
+        png = renderizar_qrcode(tracking_url, tamanho)
+        duracao = time.perf_counter() - inicio
+        with self._lock:
+            self.misses += 1
+            self.renders += 1
+            self.render_s += duracao
+        self.gravar_disco(identifier, chave_imagem, png)
+        self._guardar_memoria(chave_imagem, identifier, png)
+        return png, chave_imagem
+
+    def invalidate(self, identifier: str):
+        """Descarta as imagens de um identifier (link removido ou identifier reaproveitado)"""
+        with self._lock:
+            for chave_imagem in [c for c, (ident, _) in self._itens.items() if ident == identifier]:
+                del self._itens[chave_imagem]
+        if self.diretorio:
+            shutil.rmtree(_pasta_identifier(self.diretorio, identifier), ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._itens),
+                "maxsize": self.maxsize,
+                "bytes": sum(len(png) for _, png in self._itens.values()),
+                "directory": self.diretorio,
+                "max_per_identifier": self.max_por_identifier,
+                "disk_evictions": self.disk_evictions,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / total, 4) if total else 0.0,
+                "renders": self.renders,
+                "render_ms_avg": round(self.render_s * 1000 / self.renders, 3) if self.renders else 0.0
+            }
+
+
+# Instância global usada pelo endpoint de QR code
+qr_cache = QRCodeCache()
@@ -0,0 +1,170 @@
+"""
+Pré-renderização dos QR codes das notícias
+Etapa executada pelo scheduler após cada ingestão: gera os PNGs ("pequeno" e
+"normal") das notícias do pool que ainda não estão no diretório do qr_cache,
+em um ProcessPoolExecutor com um processo por núcleo, de forma que a primeira
+tela a exibir uma notícia nova não pague a geração (CPU) na requisição.
+
+O executor é criado uma única vez (primeira execução) e encerrado no shutdown
+da aplicação. Os processos vêm de um forkserver que só pré-carrega qr_cache
+(spawn no Windows): nunca de um fork do servidor, que tem várias threads.
+
+A URL codificada no QR code depende do host usado pelas telas: vem de
+QR_PUBLIC_BASE_URL e dos hosts já vistos na playlist e no endpoint de QR code,
+com a mesma regra de qr_cache.base_url_qrcode: configurado QR_ALLOWED_HOSTS
+ou QR_PUBLIC_BASE_URL, só hosts permitidos (um Host forjado não gera
+pré-renderização); sem configuração, os últimos hosts vistos.
+"""
+import os
+import time
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from urllib.parse import urlsplit
+from qr_cache import qr_cache, chave, renderizar_qrcode, hosts_permitidos, TAMANHOS, QR_PUBLIC_BASE_URL
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente)
+# Processos do pré-render (padrão: núcleos do host; 0 desativa a etapa)
+QR_PRERENDER_WORKERS = int(os.getenv("QR_PRERENDER_WORKERS", str(os.cpu_count() or 1)))
+
+# Hosts observados guardados (os mais recentes)
+_MAX_BASES = 8
+
+
+def _contexto_processos():
+    # forkserver: processos filhos de um servidor limpo que só importa qr_cache
+    # (renderizar_qrcode); no Windows só existe spawn
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        contexto = multiprocessing.get_context("forkserver")
+        contexto.set_forkserver_preload(["qr_cache"])
+        return contexto
+    return multiprocessing.get_context("spawn")
+
+
+class QRPreRender:
+    """Geração em lote, em processos separados, dos QR codes ainda fora do cache em disco"""
+
+    def __init__(self, workers: int = QR_PRERENDER_WORKERS, base_url: str = QR_PUBLIC_BASE_URL):
+        self.workers = workers
+        self.base_url = base_url
+        self._bases = OrderedDict()  # hosts permitidos vistos nas requisições das telas
+        self._lock = threading.Lock()
+        self._executor = None
+        self.execucoes = 0
+        self.renderizadas = 0
+        self.ultima_execucao = None
+
+    def iniciar(self) -> Optional[ProcessPoolExecutor]:
+        """Cria o executor (uma vez); os processos sobem sob demanda na primeira execução"""
+        with self._lock:
+            if self._executor is None and self.workers > 0:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_contexto_processos())
+            return self._executor
+
+    def encerrar(self):
+        """Encerra os processos do executor (shutdown da aplicação)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _descartar(self, executor: ProcessPoolExecutor):
+        # Processo morto (BrokenProcessPool): a próxima execução cria outro executor
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def registrar_base_url(self, base_url: str):
+        """Guarda o host usado por uma tela (chamado pelos endpoints da playlist e do QR code)
+
+        Com QR_ALLOWED_HOSTS ou QR_PUBLIC_BASE_URL configurados, só hosts permitidos são guardados.
+        """
+        hosts = hosts_permitidos()
+        if hosts and urlsplit(base_url).netloc.lower() not in hosts:
+            return
+        with self._lock:
+            self._bases[base_url] = True
+            self._bases.move_to_end(base_url)
+            while len(self._bases) > _MAX_BASES:
+                self._bases.popitem(last=False)
+
+    def bases(self) -> list:
+        with self._lock:
+            bases = list(self._bases)
+        if self.base_url and self.base_url not in bases:
+            bases.insert(0, self.base_url)
+        return bases
+
+    def pendentes(self, noticias: list) -> list:
+        """(identifier, URL rastreável, tamanho) das imagens que ainda não estão em disco"""
+        from models import Noticia
+
+        tarefas = []
+        for base_url in self.bases():
+            for noticia in noticias:
+                if not noticia.get("url"):
+                    continue
+                identifier = Noticia.identificador_tracking(noticia["id"])
+                tracking_url = f"{base_url}/r/{identifier}"
+                for tamanho in TAMANHOS:
+                    caminho = qr_cache.caminho(identifier, chave(tracking_url, tamanho))
+                    if caminho is not None and not os.path.exists(caminho):
+                        tarefas.append((identifier, tracking_url, tamanho))
+        return tarefas
+
+    def executar(self, noticias: Optional[list] = None) -> dict:
+        """Gera e grava no qr_cache as imagens pendentes das notícias (padrão: todas do pool)"""
+        if noticias is None:
+            from noticia_pool import noticia_pool
+            if not noticia_pool.valido:
+                noticia_pool.rebuild()
+            _, noticias = noticia_pool.lote()
+
+        inicio = time.perf_counter()
+        tarefas = self.pendentes(noticias) if self.workers > 0 and qr_cache.diretorio else []
+        workers = min(self.workers, len(tarefas))
+        executor = self.iniciar() if tarefas else None
+        if executor is not None:
+            pngs = executor.map(
+                renderizar_qrcode,
+                [tracking_url for _, tracking_url, _ in tarefas],
+                [tamanho for _, _, tamanho in tarefas],
+                chunksize=max(1, len(tarefas) // (workers * 4))
+            )
+            try:
+                for (identifier, tracking_url, tamanho), png in zip(tarefas, pngs):
+                    qr_cache.gravar_disco(identifier, chave(tracking_url, tamanho), png)
+            except BrokenProcessPool:
+                self._descartar(executor)
+                raise
+
+        resultado = {
+            "rendered": len(tarefas),
+            "workers": workers,
+            "base_urls": len(self.bases()),
+            "seconds": round(time.perf_counter() - inicio, 3)
+        }
+        with self._lock:
+            self.execucoes += 1
+            self.renderizadas += len(tarefas)
+            self.ultima_execucao = resultado
+        return resultado
+
+    def stats(self) -> dict:
+        bases = self.bases()
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "base_urls": bases,
+                "runs": self.execucoes,
+                "rendered": self.renderizadas,
+                "last_run": self.ultima_execucao
+            }
+
+
+# Instância global usada pelo scheduler
+qr_prerender = QRPreRender()
@@ -0,0 +1,127 @@
+"""
+Limitação de taxa em memória (token bucket) para o redirect e a API de eventos
+Um bot ou leitor com defeito não deve gerar escrita no banco e consultas de
+GeoIP a cada requisição; o tráfego acima do limite é contado e descartado
+
+O limite do redirect por cliente usa a chave (IP, identifier, User-Agent):
+em CGNAT de operadora ou Wi-Fi do local, muitos celulares compartilham o IP
+e só scans idênticos repetidos devem ser descartados.
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente; taxa 0 desativa o limite)
+# Por cliente: (IP, identifier, User-Agent)
+RATE_LIMIT_REDIRECT_CLIENT_PER_MIN = float(os.getenv("RATE_LIMIT_REDIRECT_CLIENT_PER_MIN", "60"))
+RATE_LIMIT_REDIRECT_CLIENT_BURST = float(os.getenv("RATE_LIMIT_REDIRECT_CLIENT_BURST", "20"))
+RATE_LIMIT_IDENTIFIER_PER_S = float(os.getenv("RATE_LIMIT_IDENTIFIER_PER_S", "100"))
+RATE_LIMIT_IDENTIFIER_BURST = float(os.getenv("RATE_LIMIT_IDENTIFIER_BURST", "200"))
+RATE_LIMIT_EVENT_IP_PER_MIN = float(os.getenv("RATE_LIMIT_EVENT_IP_PER_MIN", "120"))
+RATE_LIMIT_EVENT_IP_BURST = float(os.getenv("RATE_LIMIT_EVENT_IP_BURST", "40"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket por chave
+
+    Cada chave recebe rate_per_s fichas por segundo até o máximo de burst.
+    As chaves ficam em um LRU limitado; descartar uma chave ociosa equivale a
+    recriá-la com o balde cheio, que é o estado que ela teria de qualquer forma.
+    """
+
+    def __init__(self, rate_per_s: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate_per_s = rate_per_s
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._baldes = OrderedDict()  # chave -> [fichas, instante da última recarga]
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate_per_s > 0
+
+    def allow(self, key: str, cost: float = 1.0, agora: Optional[float] = None) -> bool:
+        if not self.enabled:
+            return True
+        agora = time.monotonic() if agora is None else agora
+        with self._lock:
+            balde = self._baldes.get(key)
+            if balde is None:
+                balde = [self.burst, agora]
+                self._baldes[key] = balde
+                if len(self._baldes) > self.max_keys:
+                    self._baldes.popitem(last=False)
+            else:
+                self._baldes.move_to_end(key)
+                balde[0] = min(self.burst, balde[0] + (agora - balde[1]) * self.rate_per_s)
+                balde[1] = agora
+
+            if balde[0] >= cost:
+                balde[0] -= cost
+                self.allowed += 1
+                return True
+            self.throttled += 1
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate_per_s": round(self.rate_per_s, 4),
+                "burst": self.burst,
+                "keys": len(self._baldes),
+                "allowed": self.allowed,
+                "throttled": self.throttled
+            }
+
+
+def _chave_cliente(ip: str, identifier: str, user_agent: Optional[str]) -> str:
+    # Hash curto: User-Agents longos não inflam o LRU de chaves
+    return hashlib.blake2b(f"{ip}\0{identifier}\0{user_agent or ''}".encode("utf-8"), digest_size=12).hexdigest()
+
+
+class RateLimiter:
+    """Limites usados pela aplicação: redirect por cliente e por identifier, eventos por IP"""
+
+    def __init__(self):
+        self.redirect_cliente = TokenBucketLimiter(RATE_LIMIT_REDIRECT_CLIENT_PER_MIN / 60.0, RATE_LIMIT_REDIRECT_CLIENT_BURST)
+        self.redirect_identifier = TokenBucketLimiter(RATE_LIMIT_IDENTIFIER_PER_S, RATE_LIMIT_IDENTIFIER_BURST)
+        self.event_ip = TokenBucketLimiter(RATE_LIMIT_EVENT_IP_PER_MIN / 60.0, RATE_LIMIT_EVENT_IP_BURST)
+        self._lock = threading.Lock()
+        self.scans_nao_rastreados = 0
+
+    def permitir_redirect(self, ip: str, identifier: str, user_agent: Optional[str] = None) -> bool:
+        """Indica se o scan deve ser rastreado (o redirect acontece de qualquer forma)"""
+        # Cliente bloqueado não consome fichas do identifier: um bot insistente
+        # não deve esgotar o limite dos scans legítimos do mesmo QR code
+        permitido = (
+            self.redirect_cliente.allow(_chave_cliente(ip, identifier, user_agent))
+            and self.redirect_identifier.allow(identifier)
+        )
+        if not permitido:
+            with self._lock:
+                self.scans_nao_rastreados += 1
+        return permitido
+
+    def permitir_evento(self, ip: str) -> bool:
+        return self.event_ip.allow(ip)
+
+    def stats(self) -> dict:
+        with self._lock:
+            scans_nao_rastreados = self.scans_nao_rastreados
+        return {
+            "untracked_scans": scans_nao_rastreados,
+            "redirect_client": self.redirect_cliente.stats(),
+            "redirect_identifier": self.redirect_identifier.stats(),
+            "event_ip": self.event_ip.stats()
+        }
+
+
+# Instância global usada pela aplicação
+rate_limiter = RateLimiter()
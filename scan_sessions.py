@@ -0,0 +1,84 @@
+"""
+Sessionização de scans repetidos
+Scans do mesmo (link_id, ip, user_agent) dentro da janela configurada reutilizam
+o click_id do primeiro scan: em vez de uma nova linha em clicks (e nova consulta
+de GeoIP), apenas incrementam repeat_count
+"""
+import os
+import time
+import threading
+from typing import Optional
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente)
+SCAN_SESSION_WINDOW_S = int(os.getenv("SCAN_SESSION_WINDOW_S", "30"))
+SCAN_SESSION_MAX_KEYS = int(os.getenv("SCAN_SESSION_MAX_KEYS", "200000"))
+
+
+class ScanSessions:
+    """
+    Mapa de sessões particionado em baldes de tempo
+
+    Cada balde cobre uma janela; uma consulta olha o balde atual e o anterior,
+    e baldes mais antigos são descartados inteiros (sem varrer chaves).
+    """
+
+    def __init__(self, window_s: int = SCAN_SESSION_WINDOW_S, max_keys: int = SCAN_SESSION_MAX_KEYS):
+        self.window_s = window_s
+        self.max_keys = max_keys
+        self._baldes = {}  # índice do balde -> {chave: (click_id, instante)}
+        self._lock = threading.Lock()
+        self.repeats = 0
+        self.sessions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_s > 0
+
+    @staticmethod
+    def _chave(scan: dict) -> tuple:
+        return (scan["link_id"], scan["ip_address"], scan["user_agent"])
+
+    def _limpar(self, balde_atual: int):
+        for indice in [i for i in self._baldes if i < balde_atual - 1]:
+            del self._baldes[indice]
+
+    def get(self, scan: dict, agora: Optional[float] = None) -> Optional[int]:
+        """Retorna o click_id da sessão aberta para este scan, se houver"""
+        if not self.enabled:
+            return None
+        agora = time.monotonic() if agora is None else agora
+        balde_atual = int(agora // self.window_s)
+        chave = self._chave(scan)
+        with self._lock:
+            for indice in (balde_atual, balde_atual - 1):
+                sessao = self._baldes.get(indice, {}).get(chave)
+                if sessao and agora - sessao[1] <= self.window_s:
+                    self.repeats += 1
+                    return sessao[0]
+        return None
+
+    def put(self, scan: dict, agora: Optional[float] = None):
+        """Abre uma sessão para o scan (chamar após o clique ser aceito)"""
+        if not self.enabled:
+            return
+        agora = time.monotonic() if agora is None else agora
+        balde_atual = int(agora // self.window_s)
+        with self._lock:
+            self._limpar(balde_atual)
+            if sum(len(b) for b in self._baldes.values()) >= self.max_keys:
+                return
+            self._baldes.setdefault(balde_atual, {})[self._chave(scan)] = (scan["click_id"], agora)
+            self.sessions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "window_s": self.window_s,
+                "keys": sum(len(b) for b in self._baldes.values()),
+                "sessions": self.sessions,
+                "repeats": self.repeats
+            }
+
+
+# Instância global usada pelo redirect
+scan_sessions = ScanSessions()
@@ -4,6 +4,14 @@ from sqlalchemy.orm import Session
 from database import SessionLocal
 from models import Noticia
 from scraper import RadiocentroScraper
+from noticia_pool import noticia_pool
+from noticia_links import provisionar_links, preencher_faltantes
+from qr_prerender import qr_prerender
+from click_snapshot import (
+    click_snapshot, exportar_periodicamente as exportar_snapshot_cliques,
+    CLICK_SNAPSHOT_INTERVAL_MIN, CLICK_SNAPSHOT_STARTUP_DELAY_S
+)
+from datetime import datetime, timedelta
 import atexit
 
 scheduler = BackgroundScheduler()
@@ -15,7 +23,7 @@ def atualizar_noticias_automaticamente():
         scraper = RadiocentroScraper()
         novas_noticias = scraper.obter_noticias(limite=30)
         
-        adicionadas = 0
+        adicionadas = []
         for noticia_data in novas_noticias:
             # Verificar se já existe
             existente = db.query(Noticia).filter(Noticia.url == noticia_data['url']).first()
@@ -28,15 +36,29 @@ def atualizar_noticias_automaticamente():
                     data_publicacao=noticia_data['data_publicacao']
                 )
                 db.add(nova_noticia)
-                adicionadas += 1
+                adicionadas.append(nova_noticia)
         
+        # Links rastreáveis dos QR codes gravados na mesma transação das notícias
+        db.flush()
+        links = provisionar_links(db, adicionadas)
         db.commit()
-        print(f"[Scheduler] {adicionadas} novas notícias adicionadas automaticamente")
+        # Notícias antigas cujo link foi removido fora do painel
+        links["criados"] += preencher_faltantes(db)["criados"]
+        print(f"[Scheduler] {len(adicionadas)} novas notícias adicionadas automaticamente ({links['criados']} links rastreáveis criados)")
+        # Recarregar o pool das telas (novas notícias e as que envelheceram)
+        noticia_pool.atualizar(db)
     except Exception as e:
         print(f"[Scheduler] Erro ao atualizar notícias: {e}")
         db.rollback()
     finally:
         db.close()
+    
+    # Pré-renderizar os QR codes das notícias novas (processos separados, fora das requisições)
+    try:
+        resultado = qr_prerender.executar()
+        print(f"[Scheduler] {resultado['rendered']} QR codes pré-renderizados em {resultado['seconds']}s ({resultado['workers']} processos)")
+    except Exception as e:
+        print(f"[Scheduler] Erro ao pré-renderizar QR codes: {e}")
 
 def iniciar_scheduler():
     """Inicia o scheduler para atualização automática"""
@@ -49,6 +71,22 @@ def iniciar_scheduler():
             name='Atualizar notícias do radiocentrocz.com.br',
             replace_existing=True
         )
+        # Snapshot colunar de cliques para relatórios longos. Fora da partida: com um
+        # snapshot em disco, a primeira exportação espera o intervalo; sem, espera
+        # CLICK_SNAPSHOT_STARTUP_DELAY_S
+        if CLICK_SNAPSHOT_INTERVAL_MIN > 0:
+            espera = (
+                timedelta(minutes=CLICK_SNAPSHOT_INTERVAL_MIN) if click_snapshot.atual() is not None
+                else timedelta(seconds=CLICK_SNAPSHOT_STARTUP_DELAY_S)
+            )
+            scheduler.add_job(
+                exportar_snapshot_cliques,
+                trigger=IntervalTrigger(minutes=CLICK_SNAPSHOT_INTERVAL_MIN),
+                id='exportar_snapshot_cliques',
+                name='Exportar snapshot colunar de cliques',
+                replace_existing=True,
+                next_run_time=datetime.now() + espera
+            )
         scheduler.start()
         print("[Scheduler] Scheduler iniciado - atualização automática a cada 30 minutos")
         
@@ -78,6 +78,7 @@ class ClickResponse(BaseModel):
     isp: Optional[str] = None
     timezone: Optional[str] = None
     clicked_at: Optional[datetime]
+    repeat_count: int = 0
 
     class Config:
         from_attributes = True
@@ -100,6 +101,7 @@ class TopLink(BaseModel):
 class AnalyticsResponse(BaseModel):
     total_clicks: int
     unique_ips: int
+    unique_ips_approximate: bool = False
     clicks_by_ponto: Dict[str, int]
     clicks_by_campanha: Dict[str, int]
     clicks_by_device: Dict[str, int]
@@ -108,6 +110,14 @@ class AnalyticsResponse(BaseModel):
     top_links: List[TopLink]
 
 
+class HeatmapAnalytics(BaseModel):
+    weekdays: List[str]
+    clicks: List[List[int]]
+    conversions: List[List[int]]
+    total_clicks: int
+    total_conversions: int
+
+
 class LinkAnalytics(BaseModel):
     link_id: int
     identifier: str
@@ -116,6 +126,7 @@ class LinkAnalytics(BaseModel):
     campanha: str
     total_clicks: int
     unique_ips: int
+    unique_ips_approximate: bool = False
     clicks_by_device: Dict[str, int]
     clicks_by_country: Dict[str, int]
     clicks_by_day: Dict[str, int]
@@ -131,6 +142,11 @@ class ConversionEventCreate(BaseModel):
     event_value: Optional[str] = Field(None, description="Dados adicionais em formato JSON string")
 
 
+class ConversionEventBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+
+
 class ConversionEventResponse(BaseModel):
     id: int
     click_id: int
@@ -1,18 +1,82 @@
 
-// Buscar uma notícia aleatória
-async function buscarNoticiaAleatoria() {
+// Tempo de cada notícia na tela e intervalo de revalidação da playlist
+const TEMPO_SLIDE_MS = 15000; // 15 segundos
+const REVALIDAR_PLAYLIST_MS = 300000; // 5 minutos
+
+// Playlist atual (lote de /api/display/playlist) e posição da rotação
+let playlist = [];
+let playlistEtag = null;
+let posicaoAtual = -1;
+
+// QR codes já baixados (URL da imagem -> object URL), reaproveitados a cada volta da playlist
+const qrcodesCarregados = new Map();
+
+// Buscar a playlist; retorna false quando não mudou (304) ou em caso de erro
+async function buscarPlaylist() {
     try {
-        const response = await fetch('/api/noticias/aleatoria');
+        const headers = playlistEtag ? { 'If-None-Match': playlistEtag } : {};
+        const response = await fetch('/api/display/playlist', { headers, cache: 'no-store' });
+        if (response.status === 304) {
+            return false;
+        }
         if (!response.ok) {
-            throw new Error('Erro ao buscar notícia');
+            throw new Error('Erro ao buscar playlist');
         }
-        return await response.json();
+        const dados = await response.json();
+        playlistEtag = response.headers.get('ETag');
+        atualizarPlaylist(dados.itens || []);
+        return true;
     } catch (error) {
-        console.error('Erro ao buscar notícia:', error);
-        return null;
+        console.error('Erro ao buscar playlist:', error);
+        return false;
     }
 }
 
+// Trocar a playlist mantendo a notícia atual, se ela continua no lote
+function atualizarPlaylist(itens) {
+    const atual = playlist[posicaoAtual];
+    playlist = itens;
+    posicaoAtual = atual ? playlist.findIndex(item => item.id === atual.id) : -1;
+
+    // Liberar QR codes de notícias que saíram da playlist
+    const urlsAtuais = new Set(playlist.map(item => item.qrcode_image_url));
+    for (const [url, objectUrl] of qrcodesCarregados) {
+        if (!urlsAtuais.has(url.split('&tamanho=')[0])) {
+            URL.revokeObjectURL(objectUrl);
+            qrcodesCarregados.delete(url);
+        }
+    }
+}
+
+// Baixar o QR code uma vez e guardar como object URL
+async function carregarQrcode(url) {
+    if (qrcodesCarregados.has(url)) {
+        return qrcodesCarregados.get(url);
+    }
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error('Erro ao carregar QR code');
+    }
+    const objectUrl = URL.createObjectURL(await response.blob());
+    qrcodesCarregados.set(url, objectUrl);
+    return objectUrl;
+}
+
+// Mostrar a próxima notícia da playlist
+function proximoSlide() {
+    if (!playlist.length) {
+        return;
+    }
+    const anterior = playlist[posicaoAtual];
+    posicaoAtual = (posicaoAtual + 1) % playlist.length;
+    const noticia = playlist[posicaoAtual];
+    // Playlist com uma só notícia: não reexibir a mesma
+    if (anterior && anterior.id === noticia.id) {
+        return;
+    }
+    exibirNoticia(noticia);
+}
+
 // Exibir notícia na tela
 function exibirNoticia(noticia) {
     const display = document.getElementById('noticia-display');
@@ -100,7 +164,7 @@ function exibirNoticia(noticia) {
     // Configurar QR code no footer inferior
     const qrcodeImage = document.getElementById('qrcode-image-bottom');
     const qrcodeContainer = document.getElementById('qrcode-container-bottom');
-    if (noticia.id && noticia.url) {
+    if (noticia.qrcode_image_url) {
         // Detectar se é uma tela muito pequena para usar QR code simplificado
         const larguraTela = window.innerWidth || document.documentElement.clientWidth || screen.width;
         const alturaTela = window.innerHeight || document.documentElement.clientHeight || screen.height;
@@ -108,7 +172,8 @@ function exibirNoticia(noticia) {
         
         // Garantir que a URL seja absoluta - usar caminho relativo que funciona em qualquer ambiente
         const tamanhoParam = telaMuitoPequena ? 'pequeno' : 'normal';
-        const qrcodeUrl = `/api/noticias/${noticia.id}/qrcode?tamanho=${tamanhoParam}`;
+        // URL versionada pela playlist (?v=): o navegador pode guardar a imagem em cache
+        const qrcodeUrl = `${noticia.qrcode_image_url}&tamanho=${tamanhoParam}`;
         
         console.log('Tentando carregar QR code:', qrcodeUrl, 'Notícia ID:', noticia.id, 'Tela pequena:', telaMuitoPequena);
         
@@ -197,10 +262,17 @@ function exibirNoticia(noticia) {
         qrcodeImage.style.display = 'block';
         qrcodeImage.style.visibility = 'visible';
         
-        // Adicionar timestamp para evitar cache
-        qrcodeImage.src = qrcodeUrl + '&t=' + Date.now();
+        // Reaproveitar o QR code já baixado; se o download falhar, carregar direto com timestamp para evitar cache
+        qrcodeImage.dataset.qrcodeUrl = qrcodeUrl;
+        carregarQrcode(qrcodeUrl)
+            .then(src => {
+                if (qrcodeImage.dataset.qrcodeUrl === qrcodeUrl) qrcodeImage.src = src;
+            })
+            .catch(() => {
+                if (qrcodeImage.dataset.qrcodeUrl === qrcodeUrl) qrcodeImage.src = qrcodeUrl + '&t=' + Date.now();
+            });
     } else {
-        console.warn('QR code não pode ser gerado - ID ou URL ausente:', { id: noticia.id, url: noticia.url });
+        console.warn('QR code não pode ser gerado - URL ausente:', { id: noticia.id, url: noticia.url });
         if (qrcodeImage) qrcodeImage.style.display = 'none';
         if (qrcodeContainer) qrcodeContainer.style.display = 'none';
     }
@@ -216,17 +288,28 @@ function exibirNoticia(noticia) {
     }
 }
 
-// Inicializar sistema - busca apenas uma vez
+// Inicializar sistema - busca a playlist e faz a rotação localmente
 async function inicializar() {
-    // Buscar notícia aleatória
-    const noticia = await buscarNoticiaAleatoria();
+    await buscarPlaylist();
     
-    if (noticia) {
-        exibirNoticia(noticia);
+    if (playlist.length) {
+        // Começar de uma posição aleatória para as telas não exibirem a mesma sequência
+        posicaoAtual = Math.floor(Math.random() * playlist.length) - 1;
+        proximoSlide();
     } else {
         document.getElementById('loading').querySelector('p').textContent = 
             'Nenhuma notícia disponível no momento. Aguarde a próxima atualização...';
     }
+    
+    setInterval(proximoSlide, TEMPO_SLIDE_MS);
+    
+    // Revalidar a playlist (304 enquanto não houver notícias novas)
+    setInterval(async () => {
+        const mudou = await buscarPlaylist();
+        if (mudou && posicaoAtual === -1) {
+            proximoSlide();
+        }
+    }, REVALIDAR_PLAYLIST_MS);
 }
 
 // Função para ajustar o tamanho da fonte do título para caber todo o texto
@@ -447,8 +530,3 @@ window.addEventListener('resize', () => {
 
 // Iniciar quando a página carregar
 document.addEventListener('DOMContentLoaded', inicializar);
-
-// Atualizar página a cada 30 minutos para buscar nova notícia aleatória
-setInterval(() => {
-    location.reload();
-}, 1800000); // 30 minutos
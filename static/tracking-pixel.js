@@ -4,6 +4,10 @@
  * 
  * Este script deve ser incluído na landing page após o redirecionamento
  * 
+ * Os eventos são acumulados em uma fila local e enviados em lote para
+ * /api/tracking/events (navigator.sendBeacon) a cada flushInterval,
+ * quando a fila enche e quando a página é ocultada/fechada.
+ * 
  * Uso:
  * <script>
  *   window.TRACKING_CLICK_ID = 123; // ID do clique (deve ser passado via URL ou localStorage)
@@ -16,7 +20,9 @@
     
     // Configurações
     const CONFIG = {
-        apiUrl: '/api/tracking/event',
+        batchUrl: '/api/tracking/events',
+        flushInterval: 5000, // 5 segundos
+        maxBatchSize: 20, // Enviar imediatamente ao atingir este tamanho
         heartbeatInterval: 30000, // 30 segundos
         scrollThresholds: [25, 50, 75, 100], // Percentuais de scroll
         maxScrollDepth: 0,
@@ -47,7 +53,38 @@
         return null;
     }
     
-    // Enviar evento para o servidor
+    // Fila local de eventos pendentes de envio
+    const eventQueue = [];
+    
+    // Enviar eventos acumulados em lote
+    function flushEvents() {
+        if (eventQueue.length === 0) {
+            return;
+        }
+        
+        const batch = eventQueue.splice(0, eventQueue.length);
+        // text/plain evita preflight de CORS; o servidor lê o corpo como JSON
+        const body = JSON.stringify(batch);
+        
+        // sendBeacon é entregue mesmo com a página sendo fechada
+        if (navigator.sendBeacon && navigator.sendBeacon(CONFIG.batchUrl, body)) {
+            return;
+        }
+        
+        // Fallback: fetch com keepalive
+        fetch(CONFIG.batchUrl, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'text/plain;charset=UTF-8'
+            },
+            body: body,
+            keepalive: true // Garante que a requisição seja enviada mesmo se a página for fechada
+        }).catch(error => {
+            console.error('[Tracking] Erro ao enviar eventos:', error);
+        });
+    }
+    
+    // Enfileirar evento para envio em lote
     function trackEvent(eventType, eventValue = null) {
         const clickId = getClickId();
         if (!clickId) {
@@ -55,23 +92,15 @@
             return;
         }
         
-        const payload = {
+        eventQueue.push({
             click_id: clickId,
             event_type: eventType,
             event_value: eventValue ? JSON.stringify(eventValue) : null
-        };
-        
-        // Enviar via fetch (não bloqueia)
-        fetch(CONFIG.apiUrl, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(payload),
-            keepalive: true // Garante que a requisição seja enviada mesmo se a página for fechada
-        }).catch(error => {
-            console.error('[Tracking] Erro ao enviar evento:', error);
         });
+        
+        if (eventQueue.length >= CONFIG.maxBatchSize) {
+            flushEvents();
+        }
     }
     
     // Rastrear pageview inicial
@@ -228,26 +257,27 @@
         // Rastrear conversões
         trackConversions();
         
+        // Enviar fila periodicamente
+        setInterval(flushEvents, CONFIG.flushInterval);
+        
+        // Enviar fila quando a aba for ocultada (pode não haver outra chance em mobile)
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'hidden') {
+                flushEvents();
+            }
+        });
+        
         // Rastrear tempo de permanência ao sair da página
-        window.addEventListener('beforeunload', function() {
+        window.addEventListener('pagehide', function() {
             const finalTimeOnPage = Math.round((Date.now() - CONFIG.sessionStartTime) / 1000);
             if (finalTimeOnPage > 0) {
-                // Usar sendBeacon para garantir envio mesmo ao fechar a página
-                const clickId = getClickId();
-                if (clickId) {
-                    const payload = JSON.stringify({
-                        click_id: clickId,
-                        event_type: 'pageview',
-                        event_value: JSON.stringify({
-                            time_on_page: finalTimeOnPage,
-                            max_scroll_depth: CONFIG.maxScrollDepth,
-                            timestamp: new Date().toISOString()
-                        })
-                    });
-                    
-                    navigator.sendBeacon(CONFIG.apiUrl, payload);
-                }
+                trackEvent('pageview', {
+                    time_on_page: finalTimeOnPage,
+                    max_scroll_depth: CONFIG.maxScrollDepth,
+                    timestamp: new Date().toISOString()
+                });
             }
+            flushEvents();
         });
     }
     
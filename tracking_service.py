@@ -6,11 +6,117 @@ from fastapi import Request
 from sqlalchemy.orm import Session
 from user_agents import parse as parse_user_agent
 from timezone_utils import agora_brasil
+import os
 import requests
 import logging
+import threading
+import time
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+# Backend de geolocalização: "ipapi" (consulta externa ao ipapi.co) ou "local" (geoip_service)
+GEOIP_BACKEND = os.getenv("GEOIP_BACKEND", "ipapi").lower()
+# Endpoint do ipapi.co ({ip} é substituído); sobrescrevível para apontar para um stub local
+IPAPI_URL = os.getenv("IPAPI_URL", "https://ipapi.co/{ip}/json/")
+
+# Memoização do parse de User-Agent (o público DOOH concentra poucas centenas de UAs)
+UA_CACHE_SIZE = int(os.getenv("UA_CACHE_SIZE", "2048"))
+UA_CACHE_PREWARM = int(os.getenv("UA_CACHE_PREWARM", "500"))  # UAs mais frequentes carregados no startup
+UA_CACHE_PREWARM_ROWS = int(os.getenv("UA_CACHE_PREWARM_ROWS", "50000"))  # cliques mais recentes considerados no pré-carregamento
+
+# IDs de clique ordenados no tempo (pré-alocados no redirect)
+# Layout: milissegundos desde CLICK_ID_EPOCH_MS (41 bits) + sequência (12 bits)
+# O total fica abaixo de 2^53 para que o ID seja lido sem perda pelo JavaScript
+CLICK_ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+CLICK_ID_SEQUENCE_BITS = 12
+_CLICK_ID_SEQUENCE_MASK = (1 << CLICK_ID_SEQUENCE_BITS) - 1
+_click_id_lock = threading.Lock()
+_click_id_last_ms = 0
+_click_id_sequence = 0
+
+
+def gerar_click_id() -> int:
+    """
+    Gera um ID de clique único e crescente no tempo, sem consultar o banco
+    
+    Permite devolver o click_id na URL de redirecionamento antes de o
+    registro ser persistido pelo pipeline em background.
+    Assume um único processo gravando cliques (uvicorn com 1 worker).
+    """
+    global _click_id_last_ms, _click_id_sequence
+    with _click_id_lock:
+        agora_ms = int(time.time() * 1000) - CLICK_ID_EPOCH_MS
+        if agora_ms < _click_id_last_ms:
+            # Relógio voltou: continuar a partir do último instante emitido
+            agora_ms = _click_id_last_ms
+        if agora_ms == _click_id_last_ms:
+            _click_id_sequence = (_click_id_sequence + 1) & _CLICK_ID_SEQUENCE_MASK
+            if _click_id_sequence == 0:
+                # Sequência esgotada neste milissegundo: avançar para o próximo
+                agora_ms += 1
+        else:
+            _click_id_sequence = 0
+        _click_id_last_ms = agora_ms
+        return (agora_ms << CLICK_ID_SEQUENCE_BITS) | _click_id_sequence
+
+
+class UserAgentCache:
+    """Cache LRU limitado de resultados de parse_user_agent, com contadores"""
+    
+    def __init__(self, max_size: int = UA_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, user_agent_str: str):
+        with self._lock:
+            resultado = self._itens.get(user_agent_str)
+            if resultado is None:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(user_agent_str)
+            self.hits += 1
+            return resultado
+    
+    def put(self, user_agent_str: str, resultado: dict):
+        with self._lock:
+            self._itens[user_agent_str] = resultado
+            self._itens.move_to_end(user_agent_str)
+            while len(self._itens) > self.max_size:
+                self._itens.popitem(last=False)
+                self.evictions += 1
+    
+    def resize(self, max_size: int):
+        with self._lock:
+            self.max_size = max(1, max_size)
+            while len(self._itens) > self.max_size:
+                self._itens.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+            self.hits = self.misses = self.evictions = 0
+    
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._itens),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+user_agent_cache = UserAgentCache()
+
 
 class TrackingService:
     """Serviço para rastreamento de cliques"""
@@ -54,6 +160,8 @@ class TrackingService:
         - device_type: "mobile", "tablet", "desktop", ou "unknown"
         - browser: "Chrome 120.0" ou "unknown"
         - operating_system: "Windows 10" ou "unknown"
+        
+        Resultados ficam memoizados em user_agent_cache (chave: UA bruto)
         """
         if not user_agent_str:
             return {
@@ -62,6 +170,15 @@ class TrackingService:
                 "operating_system": "unknown"
             }
         
+        resultado = user_agent_cache.get(user_agent_str)
+        if resultado is None:
+            resultado = TrackingService._parse_user_agent_uncached(user_agent_str)
+            user_agent_cache.put(user_agent_str, resultado)
+        return dict(resultado)
+    
+    @staticmethod
+    def _parse_user_agent_uncached(user_agent_str: str) -> dict:
+        """Parse do User-Agent com ua-parser (custo alto, sem cache)"""
         try:
             ua = parse_user_agent(user_agent_str)
             
@@ -96,10 +213,49 @@ class TrackingService:
                 "operating_system": "unknown"
             }
     
+    @staticmethod
+    def prewarm_user_agent_cache(db: Session, limit: int = UA_CACHE_PREWARM, linhas: int = UA_CACHE_PREWARM_ROWS) -> int:
+        """
+        Pré-carrega o cache com os User-Agents mais frequentes nos cliques recentes
+        
+        Só os últimos `linhas` ids de Click entram no GROUP BY (busca pela chave
+        primária): o tempo de startup não cresce com o tamanho da tabela.
+        Retorna quantos UAs foram processados
+        """
+        from sqlalchemy import func
+        from models import Click
+        
+        limit = min(limit, user_agent_cache.max_size)
+        if limit <= 0 or linhas <= 0:
+            return 0
+        
+        ultimo_id = db.query(func.max(Click.id)).scalar()
+        if ultimo_id is None:
+            return 0
+        
+        mais_frequentes = (
+            db.query(Click.user_agent)
+            .filter(Click.id > ultimo_id - linhas, Click.user_agent != None)
+            .group_by(Click.user_agent)
+            .order_by(func.count(Click.id).desc())
+            .limit(limit)
+            .all()
+        )
+        
+        # Inserir do menos para o mais frequente, deixando os mais usados no topo do LRU
+        for (user_agent_str,) in reversed(mais_frequentes):
+            user_agent_cache.put(user_agent_str, TrackingService._parse_user_agent_uncached(user_agent_str))
+        
+        logger.info(f"Cache de User-Agent pré-carregado com {len(mais_frequentes)} entradas")
+        return len(mais_frequentes)
+    
     @staticmethod
     def get_location_info(ip: str) -> dict:
         """
-        Busca informações de geolocalização usando ipapi.co (serviço gratuito)
+        Busca informações de geolocalização
+        
+        Usa o motor local (geoip_service) quando GEOIP_BACKEND=local;
+        caso contrário consulta ipapi.co (serviço gratuito)
         
         Retorna:
         - country: Nome do país ou None
@@ -113,10 +269,14 @@ class TrackingService:
         if not ip or ip == "unknown" or ip.startswith("127.") or ip.startswith("192.168.") or ip.startswith("10."):
             return {"country": None, "city": None, "state": None, "isp": None, "timezone": None}
         
+        if GEOIP_BACKEND == "local":
+            from geoip_service import geoip_service
+            return geoip_service.lookup(ip)
+        
         try:
             # Usar serviço gratuito ipapi.co
             # Limite: 1000 requisições/dia (suficiente para começar)
-            url = f"https://ipapi.co/{ip}/json/"
+            url = IPAPI_URL.format(ip=ip)
             response = requests.get(url, timeout=3)
             
             if response.status_code == 200:
@@ -169,55 +329,129 @@ class TrackingService:
             return "unknown"
     
     @staticmethod
-    def track_click(db: Session, link_id: int, request: Request):
+    def capture_scan(link_id: int, request: Request) -> dict:
         """
-        Método principal que orquestra todo o rastreamento
+        Captura os dados brutos de um scan, sem I/O
         
-        Processo:
-        1. Extrai IP do cliente
-        2. Extrai User-Agent e faz parse
-        3. Extrai Referrer
-        4. Busca geolocalização (opcional, não bloqueia se falhar)
-        5. Cria registro de clique
+        Usado no caminho do redirect: o enriquecimento (User-Agent, GeoIP)
+        e a persistência ficam para o pipeline em background.
+        O click_id é pré-alocado para poder ir na URL de destino.
         """
-        from models import Click
-        
-        # Extrair dados básicos
         ip_address = TrackingService.get_client_ip(request)
         user_agent_str = request.headers.get("User-Agent", "")
         referrer = request.headers.get("Referer")
+        language = TrackingService.get_language(request)
+        
+        return {
+            "click_id": gerar_click_id(),
+            "link_id": link_id,
+            "ip_address": ip_address if ip_address != "unknown" else None,
+            "user_agent": user_agent_str if user_agent_str else None,
+            "referrer": referrer if referrer else None,
+            "language": language if language != "unknown" else None,
+            "clicked_at": agora_brasil()  # Garantir timezone correto
+        }
+    
+    @staticmethod
+    def build_click_row(scan: dict, geoip: bool = True) -> dict:
+        """
+        Enriquece um scan bruto (User-Agent e GeoIP) e monta as colunas do clique
         
+        Pode bloquear (consulta de GeoIP); deve rodar fora do event loop.
+        Com geoip=False (fila do pipeline acumulada) as colunas de localização ficam vazias.
+        """
         # Parse User-Agent
-        ua_data = TrackingService.parse_user_agent(user_agent_str)
+        ua_data = TrackingService.parse_user_agent(scan["user_agent"] or "")
         
         # Buscar geolocalização (não bloqueia se falhar)
-        location_data = TrackingService.get_location_info(ip_address)
+        if geoip:
+            location_data = TrackingService.get_location_info(scan["ip_address"] or "unknown")
+        else:
+            location_data = {"country": None, "city": None, "state": None, "isp": None, "timezone": None}
         
-        # Extrair idioma do dispositivo
-        language = TrackingService.get_language(request)
+        return TrackingService._montar_linha(scan, ua_data, location_data)
+    
+    @staticmethod
+    def build_raw_click_row(scan: dict) -> dict:
+        """
+        Colunas do clique sem I/O: User-Agent apenas se já estiver em user_agent_cache, sem GeoIP
         
-        # Criar registro de clique (com timezone UTC-03:00)
-        click = Click(
-            link_id=link_id,
-            ip_address=ip_address if ip_address != "unknown" else None,
-            user_agent=user_agent_str if user_agent_str else None,
-            referrer=referrer if referrer else None,
-            device_type=ua_data["device_type"],
-            browser=ua_data["browser"],
-            operating_system=ua_data["operating_system"],
-            country=location_data["country"],
-            city=location_data["city"],
-            state=location_data["state"],
-            isp=location_data["isp"],
-            timezone=location_data["timezone"],
-            language=language if language != "unknown" else None,
-            clicked_at=agora_brasil()  # Garantir timezone correto
-        )
+        Usado quando o scan não pode passar pelo enriquecimento (fila do pipeline
+        cheia ou encerramento): o clique é gravado mesmo assim.
+        """
+        ua_data = user_agent_cache.get(scan["user_agent"]) if scan["user_agent"] else None
+        if ua_data is None:
+            ua_data = {"device_type": "unknown", "browser": "unknown", "operating_system": "unknown"}
+        location_data = {"country": None, "city": None, "state": None, "isp": None, "timezone": None}
+        return TrackingService._montar_linha(scan, ua_data, location_data)
+    
+    @staticmethod
+    def _montar_linha(scan: dict, ua_data: dict, location_data: dict) -> dict:
+        return {
+            "id": scan["click_id"],
+            "link_id": scan["link_id"],
+            "ip_address": scan["ip_address"],
+            "user_agent": scan["user_agent"],
+            "referrer": scan["referrer"],
+            "device_type": ua_data["device_type"],
+            "browser": ua_data["browser"],
+            "operating_system": ua_data["operating_system"],
+            "country": location_data["country"],
+            "city": location_data["city"],
+            "state": location_data["state"],
+            "isp": location_data["isp"],
+            "timezone": location_data["timezone"],
+            "language": scan["language"],
+            "clicked_at": scan["clicked_at"],
+            "repeat_count": 0
+        }
+    
+    @staticmethod
+    def build_click(scan: dict):
+        """Enriquece um scan bruto e devolve o objeto Click (não persistido)"""
+        from models import Click
+        
+        return Click(**TrackingService.build_click_row(scan))
+    
+    @staticmethod
+    def track_click(db: Session, link_id: int, request: Request):
+        """
+        Rastreia um clique de forma síncrona (captura, enriquecimento e commit)
+        
+        O redirect usa o pipeline em background (click_pipeline); este método
+        continua disponível para scripts e rotinas que precisam do registro na hora.
+        
+        Processo:
+        1. Extrai IP, User-Agent, Referrer e idioma
+        2. Se for repetição de um scan recente (scan_sessions), incrementa repeat_count
+        3. Faz parse do User-Agent e busca geolocalização
+        4. Cria registro de clique
+        """
+        from models import Click
+        from scan_sessions import scan_sessions
+        import click_rollups
+        
+        scan = TrackingService.capture_scan(link_id, request)
+        
+        click_id_sessao = scan_sessions.get(scan)
+        if click_id_sessao:
+            click = db.query(Click).filter(Click.id == click_id_sessao).first()
+            if click:
+                click.repeat_count = (click.repeat_count or 0) + 1
+                db.commit()
+                db.refresh(click)
+                logger.info(f"Scan repetido: link_id={link_id}, click_id={click.id}, repeat_count={click.repeat_count}")
+                return click
+        
+        row = TrackingService.build_click_row(scan)
+        click = Click(**row)
         
         db.add(click)
+        click_rollups.registrar(db, [row])
         db.commit()
         db.refresh(click)
+        scan_sessions.put(scan)
         
-        logger.info(f"Clique rastreado: link_id={link_id}, ip={ip_address}, device={ua_data['device_type']}, click_id={click.id}")
+        logger.info(f"Clique rastreado: link_id={link_id}, ip={scan['ip_address']}, device={click.device_type}, click_id={click.id}")
         
         return click